@@ -0,0 +1,187 @@
+import os
+import sys
+import time
+import argparse
+import logging
+import logging.config
+import importlib
+from datetime import datetime
+
+import numpy as np
+
+import core.util as util
+from core.database import setup_db, last_trade_id
+
+logger = logging.getLogger(__name__)
+
+
+class BacktestLedger(object):
+    """
+    Stands in for core.ledger.Ledger, records executed trades instead of touching balances.
+    """
+
+    def __init__(self, symbol, exchange_id):
+        self.symbol = symbol
+        self.exchange_id = exchange_id
+        self.longs = list()
+        self.shorts = list()
+
+    def tick(self):
+        pass
+
+    def add_long(self, price):
+        self.longs.append(price)
+
+    def add_short(self, price):
+        self.shorts.append(price)
+
+
+def load_strategy(path):
+    """
+    :param path: module.Class of a core.engine.BaseEngine subclass
+    """
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def trades_from_file(path):
+    """
+    load trades from a .npz with epoch, price, buy_vol and sell_vol arrays,
+    or a .csv with epoch, price, type and quantity columns
+
+    :return: epoch, price, buy_vol, sell_vol numpy arrays sorted by time
+    """
+    if path.endswith('.npz'):
+        data = np.load(path)
+        epoch, price, buy_vol, sell_vol = data['epoch'], data['price'], data['buy_vol'], data['sell_vol']
+    else:
+        data = np.genfromtxt(path, delimiter=',', names=True, dtype=None, encoding='utf8')
+        quantity = data['quantity'].astype(float)
+        epoch = data['epoch'].astype(float)
+        price = data['price'].astype(float)
+        buy_vol = np.where(data['type'] == 'BUY', quantity, 0.0)
+        sell_vol = np.where(data['type'] == 'SELL', quantity, 0.0)
+
+    order = np.argsort(epoch, kind='stable')
+    return epoch[order], price[order], buy_vol[order], sell_vol[order]
+
+
+def run_file(engine, path, chunk_size, start_at=None, stop_at=None):
+    """
+    :param start_at: epoch seconds of the first trade to run, optional
+    :param stop_at: epoch seconds of the last trade to run, optional
+    """
+    epoch, price, buy_vol, sell_vol = trades_from_file(path)
+
+    window = np.ones(len(epoch), dtype=bool)
+    if start_at:
+        window &= epoch >= start_at
+    if stop_at:
+        window &= epoch <= stop_at
+    if not window.all():
+        epoch, price, buy_vol, sell_vol = epoch[window], price[window], buy_vol[window], sell_vol[window]
+
+    for i in range(0, len(epoch), chunk_size):
+        engine.candle.tick_many(
+            epoch[i:i + chunk_size], price[i:i + chunk_size],
+            buy_vol[i:i + chunk_size], sell_vol[i:i + chunk_size]
+        )
+    return len(epoch)
+
+
+def trade_arrays(trades):
+    """
+    :param trades: list of (id, epoch, price, type, quantity) rows
+    :return: epoch, price, buy_vol, sell_vol numpy arrays
+    """
+    _, epoch, price, types, quantity = zip(*trades)
+    quantity = np.array(quantity, dtype=float)
+    types = np.array(types)
+    return (np.array(epoch, dtype=float), np.array(price, dtype=float),
+            np.where(types == 'BUY', quantity, 0.0), np.where(types == 'SELL', quantity, 0.0))
+
+
+def run_db(engine, start_at, stop_at, export=None):
+    engine.watermark = last_trade_id(engine.db_session, engine.symbol, engine.exchange_id)
+
+    count = 0
+    chunks = list()
+    for trades in engine.get_trade_history(start_at, stop_at):
+        engine.tick_many(trades)
+        count += len(trades)
+        if export:
+            chunks.append(trade_arrays(trades))
+
+    if export:
+        columns = [np.concatenate(c) for c in zip(*chunks)] if chunks else [np.array([], dtype=float)] * 4
+        np.savez_compressed(export, **dict(zip(('epoch', 'price', 'buy_vol', 'sell_vol'), columns)))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run a strategy over stored trades')
+    parser.add_argument('symbol', help='COIN/BASE symbol configured in trade.conf')
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'trade.conf'))
+    parser.add_argument('--strategy', default='strategy.StrategyA', help='module.Class of the engine to test')
+    parser.add_argument('--file', help='read trades from a .npz or .csv file instead of the database')
+    parser.add_argument('--export', help='also write the trades read from the database to this .npz file')
+    parser.add_argument('--start-at', type=float, help='epoch seconds, defaults to the symbol start_at_epoch')
+    parser.add_argument('--stop-at', type=float, help='epoch seconds, defaults to the symbol stop_at_epoch')
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--verbose', action='store_true', help='keep strategy logging enabled')
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.config.fileConfig('logging.conf')
+    else:
+        logging.disable(logging.CRITICAL)
+
+    config = util.get_config(args.config)
+    options = config['symbols'][args.symbol]
+    exchange_id = options['exchange']
+
+    # no snapshots or candle cache, every run starts from scratch
+    config['snapshot']['path'] = ''
+    options['candle_cache'] = '0'
+
+    db_session = None
+    if not args.file:
+        db_session = setup_db(**config['database'])
+
+    ledger = BacktestLedger(args.symbol, exchange_id)
+    engine = load_strategy(args.strategy)(db_session, ledger, args.symbol, exchange_id, config)
+
+    start_at = args.start_at or options.get('start_at_epoch')
+    stop_at = args.stop_at or options.get('stop_at_epoch')
+
+    start = time.perf_counter()
+    if args.file:
+        count = run_file(
+            engine, args.file, args.chunk_size,
+            start_at=float(start_at) if start_at else None,
+            stop_at=float(stop_at) if stop_at else None
+        )
+    else:
+        engine.chunk_size = args.chunk_size
+        count = run_db(
+            engine,
+            datetime.utcfromtimestamp(float(start_at)) if start_at else None,
+            datetime.utcfromtimestamp(float(stop_at)) if stop_at else None,
+            export=args.export
+        )
+    elapsed = time.perf_counter() - start
+
+    print('{} {} {}'.format(args.strategy, args.symbol, exchange_id))
+    print('trades:          {}'.format(count))
+    print('candles:         {}'.format(engine.candle.candles.count))
+    print('longs executed:  {} {}'.format(len(ledger.longs), 'avg {:.8f}'.format(np.mean(ledger.longs))
+                                          if ledger.longs else ''))
+    print('shorts executed: {} {}'.format(len(ledger.shorts), 'avg {:.8f}'.format(np.mean(ledger.shorts))
+                                          if ledger.shorts else ''))
+    print('profit position: {}'.format(engine.schedule.profit_position))
+    print('elapsed:         {:.3f}s'.format(elapsed))
+    print('throughput:      {:.0f} trades/s'.format(count / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,670 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import concurrent.futures
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import talib.abstract
+
+import core.bus
+import core.candle
+import core.feed
+import core.feedlog
+import core.levels
+import core.notify
+import core.schedule
+import core.trade
+import core.util
+import indicator
+import replay
+import strategy
+from backtest import BacktestLedger
+from core.database import Trades, TradeWriter, setup_db, new_session
+
+BENCHMARKS = dict()
+
+CONFIG = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'trade.conf')
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def timed(label, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print('{:<40} {:>10.3f}s'.format(label, elapsed))
+    return result, elapsed
+
+
+def gen_trades(count, start_epoch=1506816000, seconds=30 * 24 * 3600, seed=0):
+    """
+    random walk trades spread over seconds, sorted by time
+
+    :return: timestamps, prices, buy_vols, sell_vols numpy arrays
+    """
+    rng = np.random.RandomState(seed)
+    timestamps = np.sort(start_epoch + rng.random_sample(count) * seconds)
+    prices = np.round(4000 + np.cumsum(rng.normal(0, 2, count)), 2)
+    quantities = rng.random_sample(count)
+    is_buy = rng.random_sample(count) > 0.5
+    return timestamps, prices, np.where(is_buy, quantities, 0.0), np.where(is_buy, 0.0, quantities)
+
+
+def candle_manager(period_seconds, closed):
+    cm = core.candle.CandleManager('BTC/USDT', 'BTRX', period_seconds)
+    cm.register('candle_open', lambda candle: None)
+    cm.register('candle_close', closed.append)
+    cm.register('candle_update', lambda candle: None)
+    return cm
+
+
+@benchmark
+def backfill(trades=1000000, period_seconds=300, chunk_size=10000):
+    """a month of trades through CandleManager.tick vs CandleManager.tick_many"""
+    timestamps, prices, buy_vols, sell_vols = gen_trades(trades)
+
+    per_tick = list()
+    cm = candle_manager(period_seconds, per_tick)
+    rows = list(zip(timestamps.tolist(), prices.tolist(), buy_vols.tolist(), sell_vols.tolist()))
+
+    def run_tick():
+        for ts, price, buy_vol, sell_vol in rows:
+            cm.tick(ts, price, buy_vol, sell_vol)
+
+    _, tick_elapsed = timed('tick ({} trades)'.format(trades), run_tick)
+
+    vectorized = list()
+    cm = candle_manager(period_seconds, vectorized)
+
+    def run_tick_many():
+        for i in range(0, trades, chunk_size):
+            cm.tick_many(
+                timestamps[i:i + chunk_size], prices[i:i + chunk_size],
+                buy_vols[i:i + chunk_size], sell_vols[i:i + chunk_size]
+            )
+
+    _, many_elapsed = timed('tick_many ({} trades)'.format(trades), run_tick_many)
+
+    same = [(c.time, c.open, c.high, c.low, c.close) for c in per_tick] == \
+        [(c.time, c.open, c.high, c.low, c.close) for c in vectorized]
+    print('{} candles, identical: {}, speedup: {:.1f}x'.format(len(per_tick), same, tick_elapsed / many_elapsed))
+
+
+@benchmark
+def indicators(history=(1000, 10000, 100000), samples=200):
+    """per candle cost of streaming RSI/MACD/EMA vs talib recomputation as the history grows"""
+    rng = np.random.RandomState(0)
+
+    for size in history:
+        closes = 4000 + np.cumsum(rng.normal(0, 5, size))
+        head, tail = closes[:-samples], closes[-samples:].tolist()
+
+        streaming = [indicator.RSI(), indicator.MACD(), indicator.EMA()]
+        for value in head.tolist():
+            for ind in streaming:
+                ind.update(value)
+
+        start = time.perf_counter()
+        for value in tail:
+            for ind in streaming:
+                ind.update(value)
+        streaming_us = (time.perf_counter() - start) / samples * 1e6
+
+        start = time.perf_counter()
+        for i in range(size - samples, size):
+            inputs = dict(close=closes[:i + 1])
+            indicator.rsi(inputs, 'close')
+            indicator.macd_crossing(inputs, 'close')
+            indicator.ema(inputs, 'close')
+        talib_us = (time.perf_counter() - start) / samples * 1e6
+
+        rsi, _, _ = streaming
+        reference = talib.abstract.RSI(dict(close=closes), price='close')[-1]
+        print('{:>7} candles: streaming {:>8.2f}us/candle, talib {:>10.2f}us/candle, rsi diff {:.2e}'.format(
+            size, streaming_us, talib_us, abs(rsi.value - reference)
+        ))
+
+
+@benchmark
+def levels(trades=2000000, period_seconds=60, samples=200):
+    """support/resistance levels over a year of 1m candles, fit once vs updated on every candle close"""
+    timestamps, prices, buy_vols, sell_vols = gen_trades(trades, seconds=365 * 24 * 3600)
+
+    closed = list()
+    cm = candle_manager(period_seconds, closed)
+    cm.tick_many(timestamps, prices, buy_vols, sell_vols)
+    highs = np.array([c.high for c in closed])
+    lows = np.array([c.low for c in closed])
+
+    fitted = core.levels.LevelGenerator('BTC/USDT', 'BTRX')
+    timed('fit ({} candles)'.format(len(closed)), fitted.fit, highs, lows)
+
+    generator = core.levels.LevelGenerator('BTC/USDT', 'BTRX')
+    changes = list()
+
+    def on_close(candle):
+        result = generator.update(cm.candles)
+        if result is not None:
+            changes.append(result)
+
+    cm = core.candle.CandleManager('BTC/USDT', 'BTRX', period_seconds)
+    cm.register('candle_open', lambda candle: None)
+    cm.register('candle_close', on_close)
+    cm.register('candle_update', lambda candle: None)
+    _, update_elapsed = timed('update ({} candles)'.format(len(closed)), cm.tick_many,
+                              timestamps, prices, buy_vols, sell_vols)
+
+    # refitting the lookback window on every close instead
+    start = time.perf_counter()
+    for i in range(len(closed) - samples, len(closed)):
+        core.levels.LevelGenerator('BTC/USDT', 'BTRX').fit(
+            highs[i - generator.lookback:i], lows[i - generator.lookback:i]
+        )
+    refit_us = (time.perf_counter() - start) / samples * 1e6
+
+    print('update {:.2f}us/candle, refit {:.2f}us/candle, {} level changes, {} levels, same as fit: {}'.format(
+        update_elapsed / len(closed) * 1e6, refit_us, len(changes), len(generator.levels),
+        generator.levels == fitted.levels
+    ))
+
+
+@benchmark
+def schedules(count=10000, rounds=1000, frequency=10, seed=0):
+    """ScheduleManager.tick with count live allocation and distribution schedules"""
+    rng = np.random.RandomState(seed)
+    ledger = BacktestLedger('BTC/USDT', 'BTRX')
+    trade = core.trade.TradeManager('USDT', 'BTC', 'BTC/USDT', 'BTRX', 0.001, paper=True)
+    manager = core.schedule.ScheduleManager('BTC/USDT', 'BTRX', trade, ledger, frequency, position_mult=0)
+    trade.add_schedule(manager)
+
+    price = 4000.0
+    prices = (price + np.cumsum(rng.normal(0, 2, rounds + frequency))).tolist()
+    starts = rng.random_sample(count).tolist()
+
+    # created over frequency candles, so they come due on different ticks
+    per_tick = count // frequency
+    for i in range(frequency):
+        for j in range(i * per_tick, (i + 1) * per_tick):
+            if j % 2:
+                manager.allocate(j, price + 50 + starts[j] * 1000)
+                schedule = manager.allocations[j]
+            else:
+                manager.distribute(j, price - 50 - starts[j] * 1000)
+                schedule = manager.distributions[j]
+            # run for the whole benchmark unless the price crosses the start price
+            schedule.position_count = rounds
+            manager.profit_position = None
+        manager.tick(prices[i], i)
+
+    live = len(manager.allocations) + len(manager.distributions)
+
+    def run_ticks():
+        for i in range(frequency, frequency + rounds):
+            manager.tick(prices[i], i)
+
+    _, elapsed = timed('tick ({} rounds)'.format(rounds), run_ticks)
+    print('{} live schedules at the start, {} at the end, {} longs, {} shorts, {:.1f}us/tick'.format(
+        live, len(manager.allocations) + len(manager.distributions), len(ledger.longs), len(ledger.shorts),
+        elapsed / rounds * 1e6
+    ))
+
+
+def bytes_per_object(count, factory):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    objects = [factory(i) for i in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del objects
+    return (after - before) / count
+
+
+class DictBaseline(object):
+    """
+    the same attributes as a __slots__ object, laid out as before slots were used:
+    in an instance __dict__, with a logger_extra dict of its own holding the candle time
+    """
+
+    def __init__(self, obj):
+        self.logger_extra = dict(symbol=obj.symbol, exchange_id=obj.exchange_id, candle_time=None)
+        for cls in type(obj).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if name != 'candle_time':
+                    setattr(self, name, getattr(obj, name))
+
+
+@benchmark
+def memory(count=1000000):
+    """bytes held per Candle and per Schedule, with count of each in memory, with and without __slots__"""
+    factories = (
+        ('Candle', lambda i: core.candle.Candle('BTC/USDT', 'BTRX', i * 300, 4000.0 + i, sell_vol=0.5, buy_vol=0.25)),
+        ('Allocation', lambda i: core.schedule.Allocation('BTC/USDT', 'BTRX', None, 4000.0, 4000.0 + i, 2, 10)),
+    )
+    for name, factory in factories:
+        # a class per type, instance dicts share their keys only between instances of one class
+        baseline_class = type('Dict' + name, (DictBaseline,), dict())
+        baseline = bytes_per_object(count, lambda i: baseline_class(factory(i)))
+        slots = bytes_per_object(count, factory)
+        print('{:<40} {:>10.1f} bytes without __slots__, {:.1f} bytes with'.format(name, baseline, slots))
+
+
+def percentiles(values):
+    values = np.array(values) * 1000
+    return 'p50 {:>7.1f}ms  p99 {:>7.1f}ms  max {:>7.1f}ms'.format(
+        np.percentile(values, 50), np.percentile(values, 99), values.max()
+    ) if len(values) else 'no samples'
+
+
+def engine_config(markets, exchange_id, period_seconds=300):
+    """
+    config for paper trading StrategyA engines on markets, without snapshots
+    """
+    options = dict(
+        exchange=exchange_id, trends=[float(p) for p in range(8000, 0, -200)], position_size='0.001',
+        position_mult='1', trade_frequency='10', paper='True', candle_period_seconds=str(period_seconds)
+    )
+    return dict(
+        symbols=dict((market, dict(options)) for market in markets),
+        snapshot=dict(path='', interval_seconds='300')
+    )
+
+
+def trade_source(exchange_id, prefix):
+    """
+    :return: function of a market returning a trade at the current time, as the ticker decodes it
+    """
+    trade_ids = itertools.count()
+
+    def received(market):
+        return core.feed.decode_trade(dict(
+            exchange=exchange_id, label=market, tradeid='{}-{}'.format(prefix, next(trade_ids)), type='BUY',
+            price=4000.0, quantity=1.0, total=4000.0, time='{:%Y-%m-%dT%H:%M:%S}'.format(datetime.utcnow())
+        ), datetime.utcnow())
+    return received
+
+
+def insert_trades(db_session, rows):
+    """
+    :return: list of (symbol, id) of the inserted rows
+    """
+    result = db_session.execute(Trades.__table__.insert().values(rows).returning(Trades.symbol, Trades.id))
+    ids = result.fetchall()
+    db_session.commit()
+    return ids
+
+
+@benchmark
+def ingest(count=200000, redelivered=0.1, config_path=CONFIG):
+    """
+    decode and persist throughput of ticker messages, with some delivered twice as after a reconnect,
+    uses the database in trade.conf and removes the trades it adds
+    """
+    exchange_id = 'BENCH'
+    timestamps, prices, buy_vols, sell_vols = gen_trades(count, start_epoch=time.time() - 30 * 24 * 3600)
+    messages = [json.dumps(dict(
+        exchange=exchange_id, label='BTC/USDT', tradeid=str(i), type='BUY' if buy_vol else 'SELL',
+        price=price, quantity=buy_vol or sell_vol, total=price * (buy_vol or sell_vol),
+        time='{:%Y-%m-%dT%H:%M:%S}'.format(datetime.utcfromtimestamp(ts))
+    )) for i, (ts, price, buy_vol, sell_vol) in enumerate(zip(
+        timestamps.tolist(), prices.tolist(), buy_vols.tolist(), sell_vols.tolist()
+    ))]
+
+    # captured traffic, with a run of messages sent again after each reconnect
+    rng = np.random.RandomState(0)
+    capture = list()
+    for start in range(0, count, 1000):
+        capture.extend(messages[start:start + 1000])
+        if rng.random_sample() < redelivered * 10:
+            capture.extend(messages[max(0, start - 100):start])
+
+    def strptime_decode():
+        for message in capture:
+            data = json.loads(message)
+            dict(symbol=data['label'], exchange=data['exchange'], price=data['price'], type=data['type'],
+                 quantity=data['quantity'], total=data['total'],
+                 time=datetime.strptime(data['time'], "%Y-%m-%dT%H:%M:%S"), created_at=datetime.utcnow())
+
+    def decode():
+        for message in capture:
+            core.feed.decode_trade(json.loads(message), datetime.utcnow())
+
+    _, strptime_elapsed = timed('strptime decode ({} messages)'.format(len(capture)), strptime_decode)
+    _, decode_elapsed = timed('decode_trade ({} messages)'.format(len(capture)), decode)
+
+    config = core.util.get_config(config_path)
+    db_session = setup_db(**config['database'])
+    db_session.query(Trades).filter(Trades.exchange == exchange_id).delete()
+    db_session.commit()
+
+    writer = TradeWriter(new_session(db_session), flush_rows=int(config['ticker']['flush_rows']),
+                         flush_ms=int(config['ticker']['flush_ms']), max_rows=int(config['ticker']['max_rows']))
+
+    def persist():
+        with writer:
+            for message in capture:
+                writer.add(core.feed.decode_trade(json.loads(message), datetime.utcnow()))
+
+    try:
+        _, persist_elapsed = timed('decode and persist ({} messages)'.format(len(capture)), persist)
+        stored = db_session.query(Trades).filter(Trades.exchange == exchange_id).count()
+    finally:
+        db_session.query(Trades).filter(Trades.exchange == exchange_id).delete()
+        db_session.commit()
+
+    print('messages/s: strptime decode {:.0f}, decode {:.0f}, decode and persist {:.0f}'.format(
+        len(capture) / strptime_elapsed, len(capture) / decode_elapsed, len(capture) / persist_elapsed
+    ))
+    print('{} messages, {} unique trades, {} stored, {} skipped as already stored'.format(
+        len(capture), count, stored, writer.duplicates
+    ))
+
+
+@benchmark
+def engine_latency(symbols=20, history=300000, rounds=200, interval=0.05, query_threads=4, config_path=CONFIG):
+    """
+    insert to tick latency of engines sharing one event loop while one of them backfills,
+    uses the database in trade.conf and removes the trades it adds
+    """
+    config = core.util.get_config(config_path)
+    db_session = setup_db(**config['database'])
+    writer_session = new_session(db_session)
+
+    exchange_id = 'BENCH'
+    markets = ['B{:02d}/USDT'.format(i) for i in range(symbols)]
+    db_session.query(Trades).filter(Trades.exchange == exchange_id).delete()
+    db_session.commit()
+
+    # only the first market has history, it is still backfilling while the others monitor
+    timestamps, prices, buy_vols, sell_vols = gen_trades(history, start_epoch=time.time() - 30 * 24 * 3600)
+    rows = [dict(
+        symbol=markets[0], exchange=exchange_id, price=price, type='BUY' if buy_vol else 'SELL',
+        quantity=buy_vol or sell_vol, total=price * (buy_vol or sell_vol), time=datetime.utcfromtimestamp(ts)
+    ) for ts, price, buy_vol, sell_vol in zip(timestamps.tolist(), prices.tolist(), buy_vols.tolist(),
+                                              sell_vols.tolist())]
+    writer_session.execute(Trades.__table__.insert(), rows)
+    writer_session.commit()
+
+    engines_config = engine_config(markets, exchange_id)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=query_threads)
+    engines = [
+        strategy.StrategyA(db_session, BacktestLedger(market, exchange_id), market, exchange_id, engines_config,
+                           executor=executor)
+        for market in markets
+    ]
+
+    backfilling, monitoring, lags = list(), list(), list()
+
+    async def heartbeat():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - start - 0.01)
+
+    async def measure():
+        loop = asyncio.get_event_loop()
+        tasks = [asyncio.ensure_future(e.run(interval, None, None)) for e in engines]
+        tasks.append(asyncio.ensure_future(heartbeat()))
+        backfill_start = time.perf_counter()
+        backfill_elapsed = None
+
+        # wait for the monitors to start
+        while any(e.backfill for e in engines[1:]):
+            await asyncio.sleep(0.01)
+
+        for _ in range(rounds):
+            during_backfill = engines[0].backfill
+            pending = dict(await loop.run_in_executor(None, insert_trades, writer_session, [dict(
+                symbol=market, exchange=exchange_id, price=4000.0, type='BUY', quantity=1.0, total=4000.0,
+                time=datetime.utcnow()
+            ) for market in markets[1:]]))
+            sent = time.perf_counter()
+
+            while pending:
+                for e in engines[1:]:
+                    if e.symbol in pending and e.watermark >= pending[e.symbol]:
+                        (backfilling if during_backfill else monitoring).append(time.perf_counter() - sent)
+                        del pending[e.symbol]
+                if backfill_elapsed is None and not engines[0].backfill:
+                    backfill_elapsed = time.perf_counter() - backfill_start
+                await asyncio.sleep(0.001)
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return backfill_elapsed
+
+    try:
+        backfill_elapsed = asyncio.get_event_loop().run_until_complete(measure())
+    finally:
+        executor.shutdown()
+        db_session.query(Trades).filter(Trades.exchange == exchange_id).delete()
+        db_session.commit()
+
+    print('{} engines, {} trades backfilled by {} in {}'.format(
+        symbols, history, markets[0], '{:.3f}s'.format(backfill_elapsed) if backfill_elapsed else 'more than the run'
+    ))
+    print('{:<30} {}'.format('latency during backfill', percentiles(backfilling)))
+    print('{:<30} {}'.format('latency after backfill', percentiles(monitoring)))
+    print('{:<30} {}'.format('event loop lag', percentiles(lags)))
+
+
+@benchmark
+def bus_latency(symbols=10, rounds=30, interval=1.0, config_path=CONFIG):
+    """
+    receive to tick latency of engines polling the database vs taking trades from the trade bus,
+    uses the database in trade.conf and removes the trades it adds
+    """
+    config = core.util.get_config(config_path)
+    db_session = setup_db(**config['database'])
+
+    exchange_id = 'BENCH'
+    markets = ['B{:02d}/USDT'.format(i) for i in range(symbols)]
+    engines_config = engine_config(markets, exchange_id)
+    received = trade_source(exchange_id, 'bus')
+
+    async def measure(bus):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        writer = TradeWriter(new_session(db_session), flush_rows=int(config['ticker']['flush_rows']),
+                             flush_ms=int(config['ticker']['flush_ms']))
+        engines = [
+            strategy.StrategyA(db_session, BacktestLedger(market, exchange_id), market, exchange_id, engines_config,
+                               executor=executor, bus=bus)
+            for market in markets
+        ]
+        tasks = [asyncio.ensure_future(e.run(interval, None, None)) for e in engines]
+        latencies = list()
+
+        with writer:
+            while any(e.backfill for e in engines):
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(interval)
+
+            for _ in range(rounds):
+                watermarks = dict((e.symbol, e.watermark) for e in engines)
+                sent = time.perf_counter()
+                for market in markets:
+                    trade = received(market)
+                    if bus:
+                        bus.publish(trade)
+                    writer.add(trade)
+
+                if bus:
+                    await bus.sync()
+                    latencies.append(time.perf_counter() - sent)
+                else:
+                    pending = set(markets)
+                    while pending:
+                        for e in engines:
+                            if e.symbol in pending and e.watermark > watermarks[e.symbol]:
+                                latencies.append(time.perf_counter() - sent)
+                                pending.discard(e.symbol)
+                        await asyncio.sleep(0.001)
+
+                # spread the rounds over the poll interval
+                await asyncio.sleep(interval * 0.37)
+
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        executor.shutdown()
+        return latencies, writer.written
+
+    loop = asyncio.get_event_loop()
+    try:
+        for name, bus in (('database poll', None), ('trade bus', core.bus.TradeBus())):
+            db_session.query(Trades).filter(Trades.exchange == exchange_id).delete()
+            db_session.commit()
+
+            latencies, written = loop.run_until_complete(measure(bus))
+            print('{:<30} {}, {} trades stored'.format(name, percentiles(latencies), written))
+    finally:
+        db_session.query(Trades).filter(Trades.exchange == exchange_id).delete()
+        db_session.commit()
+
+
+@benchmark
+def notify_latency(symbols=10, active=2, rounds=30, interval=1.0, config_path=CONFIG):
+    """
+    store to tick latency and queries made by engines polling the database vs waiting for notifications,
+    with trades on only some of the markets. uses the database in trade.conf and removes the trades it adds
+    """
+    config = core.util.get_config(config_path)
+    db_session = setup_db(**config['database'])
+
+    exchange_id = 'BENCH'
+    markets = ['N{:02d}/USDT'.format(i) for i in range(symbols)]
+    engines_config = engine_config(markets, exchange_id)
+    received = trade_source(exchange_id, 'notify')
+
+    async def measure(notify):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        writer = TradeWriter(new_session(db_session), flush_rows=int(config['ticker']['flush_rows']),
+                             flush_ms=int(config['ticker']['flush_ms']), notify=notify)
+        listener = core.notify.TradeListener(db_session) if notify else None
+        listening = asyncio.ensure_future(listener.run()) if listener else None
+        engines = [
+            strategy.StrategyA(db_session, BacktestLedger(market, exchange_id), market, exchange_id, engines_config,
+                               executor=executor, listener=listener)
+            for market in markets
+        ]
+
+        queries = list()
+        for e in engines:
+            def fetch_new_trades(fetch=e.fetch_new_trades):
+                queries.append(1)
+                return fetch()
+            e.fetch_new_trades = fetch_new_trades
+
+        tasks = [asyncio.ensure_future(e.run(interval, None, None)) for e in engines]
+        latencies = list()
+
+        with writer:
+            while any(e.backfill for e in engines) or (listener and not listener.listening):
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(interval)
+
+            del queries[:]
+            started = time.perf_counter()
+            for _ in range(rounds):
+                watermarks = dict((e.symbol, e.watermark) for e in engines)
+                for market in markets[:active]:
+                    writer.add(received(market))
+                writer.flush()
+
+                stored = time.perf_counter()
+                pending = set(markets[:active])
+                while pending:
+                    for e in engines:
+                        if e.symbol in pending and e.watermark > watermarks[e.symbol]:
+                            latencies.append(time.perf_counter() - stored)
+                            pending.discard(e.symbol)
+                    await asyncio.sleep(0.001)
+
+                # spread the rounds over the poll interval
+                await asyncio.sleep(interval * 0.37)
+            elapsed = time.perf_counter() - started
+
+            for task in tasks + ([listening] if listening else []):
+                task.cancel()
+            await asyncio.gather(*tasks + ([listening] if listening else []), return_exceptions=True)
+        executor.shutdown()
+        return latencies, len(queries) / elapsed
+
+    loop = asyncio.get_event_loop()
+    try:
+        for name, notify in (('database poll', False), ('listen/notify', True)):
+            db_session.query(Trades).filter(Trades.exchange == exchange_id).delete()
+            db_session.commit()
+
+            latencies, queries = loop.run_until_complete(measure(notify))
+            print('{:<30} {}, {:.1f} queries/s'.format(name, percentiles(latencies), queries))
+    finally:
+        db_session.query(Trades).filter(Trades.exchange == exchange_id).delete()
+        db_session.commit()
+
+
+@benchmark
+def feed_log(count=500000, period_seconds=60, segment_mb=16):
+    """
+    record throughput and size of the raw feed log, and replay throughput through StrategyA at max speed
+    """
+    timestamps, prices, buy_vols, sell_vols = gen_trades(count, seconds=7 * 24 * 3600)
+    messages = [dict(
+        exchange='BTRX', label='BTC/USDT', tradeid=str(i), type='BUY' if buy_vol else 'SELL',
+        price=price, quantity=buy_vol or sell_vol, total=price * (buy_vol or sell_vol),
+        time='{:%Y-%m-%dT%H:%M:%S}'.format(datetime.utcfromtimestamp(ts))
+    ) for i, (ts, price, buy_vol, sell_vol) in enumerate(zip(
+        timestamps.tolist(), prices.tolist(), buy_vols.tolist(), sell_vols.tolist()
+    ))]
+    received = [datetime.utcfromtimestamp(ts + 0.5) for ts in timestamps.tolist()]
+
+    engines_config = engine_config(['BTC/USDT'], 'BTRX', period_seconds)
+
+    def record(path):
+        with core.feedlog.FeedRecorder(path, segment_bytes=segment_mb * 1024 * 1024) as recorder:
+            for data, received_at in zip(messages, received):
+                recorder.record('TRADE-BTRX--BTC--USDT', data, received_at)
+        return recorder.segments
+
+    def run_replay(path):
+        engine = strategy.StrategyA(None, BacktestLedger('BTC/USDT', 'BTRX'), 'BTC/USDT', 'BTRX', engines_config)
+        replay.replay({('BTC/USDT', 'BTRX'): engine}, path)
+        return engine.candle.candles.count, len(engine.ledger.longs), len(engine.ledger.shorts)
+
+    with tempfile.TemporaryDirectory() as path:
+        segments, record_elapsed = timed('record ({} messages)'.format(count), record, path)
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        _, read_elapsed = timed('read', lambda: sum(1 for _ in core.feedlog.read_feed(path)))
+        first, replay_elapsed = timed('replay through StrategyA', run_replay, path)
+        second, _ = timed('replay again', run_replay, path)
+
+    print('{} segments, {:.1f} bytes/message, messages/s: record {:.0f}, read {:.0f}, replay {:.0f}'.format(
+        segments, size / count, count / record_elapsed, count / read_elapsed, count / replay_elapsed
+    ))
+    print('candles, longs, shorts: {} {}'.format(
+        first, 'identical' if first == second else 'differ: {}'.format(second)
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='estbot benchmarks')
+    parser.add_argument('name', choices=sorted(BENCHMARKS.keys()))
+    args = parser.parse_args()
+
+    print('{}: {}'.format(args.name, BENCHMARKS[args.name].__doc__))
+    BENCHMARKS[args.name]()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription(object):
+    """
+    trades of one market published on a TradeBus, in the order they were published.
+    once a trade is dropped, every later one is too, so what is queued never has a gap.
+    """
+
+    def __init__(self, bus, symbol, exchange_id, max_pending):
+        self.bus = bus
+        self.symbol = symbol
+        self.exchange_id = exchange_id
+        self.max_pending = max_pending
+        self.queue = asyncio.Queue()
+        self.dropped = 0
+        self.lost = False
+
+        # trade_id and created_at of the first trade queued. the subscriber has caught up with the bus
+        # once it has read this trade, or one received after it, from the database
+        self.first_trade_id = None
+        self.started_at = None
+
+    def put(self, trade):
+        if self.lost or self.queue.qsize() >= self.max_pending:
+            # the subscriber reads this and every later trade from the database instead
+            self.lost = True
+            self.dropped += 1
+            return
+
+        if self.first_trade_id is None:
+            self.first_trade_id = trade['trade_id']
+            self.started_at = trade['created_at']
+        self.queue.put_nowait(trade)
+
+    async def get(self, limit, timeout=None):
+        """
+        wait for the next trade, then take whatever else is queued, up to limit trades.
+        pass the number taken to done() once they are processed.
+
+        :param timeout: seconds to wait for a trade, optional
+        :return: list of trades, empty after timeout
+        """
+        try:
+            trades = [await asyncio.wait_for(self.queue.get(), timeout)]
+        except asyncio.TimeoutError:
+            return list()
+
+        while len(trades) < limit and not self.queue.empty():
+            trades.append(self.queue.get_nowait())
+        return trades
+
+    def done(self, count):
+        for _ in range(count):
+            self.queue.task_done()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+        # nobody will process what is left
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+
+
+class TradeBus(object):
+    """
+    In-process publish/subscribe of received trades, so engines running next to the ticker
+    get trades as they arrive instead of polling the database for them.
+    Trades are dicts of core.database.Trades column values, as made by core.feed.decode_trade.
+    """
+
+    def __init__(self, max_pending=100000):
+        """
+        :param max_pending: trades queued per subscription before newer ones are dropped
+        """
+        self.max_pending = max_pending
+
+        # (symbol, exchange_id) -> list of Subscription
+        self.subscriptions = dict()
+        self.published = 0
+
+    def subscribe(self, symbol, exchange_id):
+        subscription = Subscription(self, symbol, exchange_id, self.max_pending)
+        self.subscriptions.setdefault((symbol, exchange_id), list()).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self.subscriptions.get((subscription.symbol, subscription.exchange_id), list())
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+
+    def publish(self, trade):
+        for subscription in self.subscriptions.get((trade['symbol'], trade['exchange']), ()):
+            subscription.put(trade)
+        self.published += 1
+
+    async def sync(self):
+        """
+        wait until every subscriber has processed every trade published so far
+        """
+        await asyncio.gather(*[
+            subscription.queue.join() for subscriptions in self.subscriptions.values()
+            for subscription in subscriptions
+        ])
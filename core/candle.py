@@ -1,7 +1,9 @@
-import time
 import logging
+import calendar
 from datetime import datetime
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 
@@ -10,11 +12,12 @@ class CandleManager(object):
     Groups price data into time-chunks (candles) based on period_seconds.
     """
 
-    def __init__(self, symbol, exchange_id, period_seconds):
+    def __init__(self, symbol, exchange_id, period_seconds, capacity=10000):
         """
         :param symbol: COIN/BASE symbol for the market.
         :param exchange_id: coinigy exchange id
         :param period_seconds: the candlestick period in seconds
+        :param capacity: how many of the latest candles are kept in memory
         """
         self.symbol = symbol
         self.exchange_id = exchange_id
@@ -22,7 +25,7 @@ class CandleManager(object):
 
         self.period_seconds = period_seconds
         self.curr_candle = None
-        self.candles = list()
+        self.candles = CandleStore(symbol, exchange_id, capacity)
         self.curr_candle_time = None
 
         self.callbacks = dict()
@@ -31,34 +34,127 @@ class CandleManager(object):
         """
         Updates the CandleManager with new price info.
 
-        :param timestamp: the datetime of the price data
+        :param timestamp: epoch seconds (UTC) of the price data, int or float. a datetime is also accepted
         :param price: the price
         :param buy_vol: how much was bought
         :param sell_vol: how much was sold sold
         :return:
         """
+        if isinstance(timestamp, datetime):
+            timestamp = calendar.timegm(timestamp.utctimetuple())
 
-        timestamp_seconds = time.mktime(timestamp.timetuple())
-        time_round = int(timestamp_seconds / self.period_seconds) * self.period_seconds
-
-        self.curr_candle_time = datetime.fromtimestamp(time_round)
-        self.logger_extra['candle_time'] = self.curr_candle_time
+        time_round = int(timestamp // self.period_seconds) * self.period_seconds
 
         if not self.curr_candle:
-            self.curr_candle = Candle(self.symbol, self.exchange_id, time_round, price, buy_vol, sell_vol)
+            self._set_candle_time(time_round)
+            self.curr_candle = Candle(self.symbol, self.exchange_id, time_round, price,
+                                      sell_vol=sell_vol, buy_vol=buy_vol)
             self.candles.append(self.curr_candle)
             self.trigger('candle_open', self.curr_candle)
 
         elif self.curr_candle.time == time_round:
-            self.curr_candle.update(price, buy_vol, sell_vol)
+            self.curr_candle.update(price, sell_vol=sell_vol, buy_vol=buy_vol)
             self.trigger('candle_update', self.curr_candle)
 
         else:
+            self._set_candle_time(time_round)
             self.trigger('candle_close', self.curr_candle)
-            self.curr_candle = Candle(self.symbol, self.exchange_id, time_round, price, buy_vol, sell_vol)
+            self.curr_candle = Candle(self.symbol, self.exchange_id, time_round, price,
+                                      sell_vol=sell_vol, buy_vol=buy_vol)
             self.candles.append(self.curr_candle)
             self.trigger('candle_open', self.curr_candle)
 
+    def tick_many(self, timestamps, prices, buy_vols, sell_vols):
+        """
+        Updates the CandleManager with many trades at once, e.g. a backfill chunk.
+
+        Trades are bucketed and reduced to one open/high/low/close/volume row per candle with numpy,
+        so callbacks fire once per candle instead of once per trade. The candles, and the candles
+        passed to candle_close, are the same as feeding the trades to tick() one at a time.
+
+        :param timestamps: numpy array of epoch seconds (UTC)
+        :param prices: numpy array of prices
+        :param buy_vols: numpy array of bought volume
+        :param sell_vols: numpy array of sold volume
+        :return:
+        """
+        if not len(timestamps):
+            return
+
+        buckets = (timestamps // self.period_seconds).astype(np.int64) * self.period_seconds
+
+        # a new candle starts wherever the bucket changes, just like tick()
+        starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+        ends = np.append(starts[1:], len(buckets)) - 1
+
+        candles = zip(
+            buckets[starts].tolist(),
+            prices[starts].tolist(),
+            np.maximum.reduceat(prices, starts).tolist(),
+            np.minimum.reduceat(prices, starts).tolist(),
+            prices[ends].tolist(),
+            np.add.reduceat(sell_vols, starts).tolist(),
+            np.add.reduceat(buy_vols, starts).tolist()
+        )
+
+        for time_round, open_price, high, low, close, sell_vol, buy_vol in candles:
+            self._tick_aggregate(time_round, open_price, high, low, close, sell_vol, buy_vol)
+
+    def tick_candle(self, candle):
+        """
+        Updates the CandleManager with a candle of a shorter period, e.g. a closed 1m candle into 5m candles.
+
+        :param candle: Candle whose period divides period_seconds
+        :return:
+        """
+        time_round = (candle.time // self.period_seconds) * self.period_seconds
+        self._tick_aggregate(time_round, candle.open, candle.high, candle.low, candle.close,
+                             candle.total_sell_vol, candle.total_buy_vol)
+
+    def close_candle(self):
+        """close the current candle now rather than when the first price of the next one arrives"""
+        if self.curr_candle:
+            self.trigger('candle_close', self.curr_candle)
+            self.curr_candle = None
+
+    def _tick_aggregate(self, time_round, open_price, high, low, close, sell_vol, buy_vol):
+        if self.curr_candle and self.curr_candle.time == time_round:
+            self.curr_candle.merge(high, low, close, sell_vol, buy_vol)
+            self.trigger('candle_update', self.curr_candle)
+            return
+
+        self._set_candle_time(time_round)
+
+        if self.curr_candle:
+            self.trigger('candle_close', self.curr_candle)
+
+        self.curr_candle = Candle(self.symbol, self.exchange_id, time_round, open_price,
+                                  sell_vol=sell_vol, buy_vol=buy_vol)
+        self.curr_candle.merge(high, low, close, 0, 0)
+        self.candles.append(self.curr_candle)
+        self.trigger('candle_open', self.curr_candle)
+
+    def get_state(self):
+        return dict(
+            curr_candle=self.curr_candle.get_state() if self.curr_candle else None,
+            candles=self.candles.get_state()
+        )
+
+    def set_state(self, state):
+        self.candles.set_state(state['candles'])
+        self.curr_candle = None
+        self.curr_candle_time = None
+
+        if state['curr_candle']:
+            self.curr_candle = Candle.from_state(self.symbol, self.exchange_id, state['curr_candle'])
+            self.candles.live = self.curr_candle
+            self._set_candle_time(self.curr_candle.time)
+
+    def _set_candle_time(self, time_round):
+        """only called when a candle opens, the datetime is not rebuilt for every trade"""
+        self.curr_candle_time = datetime.utcfromtimestamp(time_round)
+        self.logger_extra['candle_time'] = self.curr_candle_time
+
     def trigger(self, event, candle):
         if event in self.callbacks:
             self.callbacks[event](candle)
@@ -67,10 +163,185 @@ class CandleManager(object):
         self.callbacks.setdefault(event, callback)
 
 
+class CandleRollup(object):
+    """
+    Rolls the candles of a base CandleManager up into longer timeframes, so one pass over
+    the trades feeds every timeframe. Each timeframe has its own candles and callbacks.
+
+    Longer candles are built from closed base candles, and close as soon as the first
+    base candle of the next period opens.
+    """
+
+    def __init__(self, base, periods, capacity=10000):
+        """
+        :param base: the CandleManager that receives the trades
+        :param periods: candlestick periods in seconds, each a multiple of the base period
+        :param capacity: how many of the latest candles each timeframe keeps in memory
+        """
+        self.base = base
+        self.managers = {base.period_seconds: base}
+        self.callbacks = dict()
+
+        for period in sorted(set(periods)):
+            if period == base.period_seconds:
+                continue
+            if period % base.period_seconds:
+                raise ValueError('candle period {} is not a multiple of {}'.format(period, base.period_seconds))
+            self.managers[period] = CandleManager(base.symbol, base.exchange_id, period, capacity)
+
+        self.rollups = [m for p, m in sorted(self.managers.items()) if p != base.period_seconds]
+
+        base.register('candle_open', self._base_open)
+        base.register('candle_close', self._base_close)
+        base.register('candle_update', self._base_update)
+
+    def _base_open(self, candle):
+        for cm in self.rollups:
+            if cm.curr_candle and (candle.time // cm.period_seconds) * cm.period_seconds != cm.curr_candle.time:
+                cm.close_candle()
+        self.trigger('candle_open', candle)
+
+    def _base_close(self, candle):
+        for cm in self.rollups:
+            cm.tick_candle(candle)
+        self.trigger('candle_close', candle)
+
+    def _base_update(self, candle):
+        self.trigger('candle_update', candle)
+
+    def trigger(self, event, candle):
+        if event in self.callbacks:
+            self.callbacks[event](candle)
+
+    def register(self, period, event, callback):
+        """
+        :param period: the timeframe in seconds
+        :param event: candle_open, candle_close or candle_update
+        :param callback: called with the Candle
+        """
+        if period == self.base.period_seconds:
+            self.callbacks.setdefault(event, callback)
+        else:
+            self.managers[period].register(event, callback)
+
+
+class CandleStore(object):
+    """
+    Fixed-capacity ring buffer of candles backed by preallocated numpy columns.
+
+    Every row is written at i and i + capacity, so the latest candles are always one
+    contiguous slice and column() returns a view without copying. Indexing and iterating
+    build Candle objects for code that expects the old list of candles.
+    """
+
+    COLUMNS = ('time', 'open', 'high', 'low', 'close', 'buy_vol', 'sell_vol')
+    ALIASES = dict(total_buy_vol='buy_vol', total_sell_vol='sell_vol')
+
+    def __init__(self, symbol, exchange_id, capacity=10000):
+        """
+        :param symbol: COIN/BASE symbol for the market.
+        :param exchange_id: coinigy exchange id
+        :param capacity: the number of candles kept, older ones are overwritten
+        """
+        self.symbol = symbol
+        self.exchange_id = exchange_id
+        self.capacity = capacity
+
+        self.columns = dict(
+            (name, np.zeros(2 * capacity, dtype=np.int64 if name == 'time' else float)) for name in self.COLUMNS
+        )
+        self.head = 0
+        self.count = 0
+
+        # the open candle keeps changing, its row is written lazily before any read
+        self.live = None
+
+    def append(self, candle):
+        self._sync()
+        self._write(self.head, candle)
+        self.head = (self.head + 1) % self.capacity
+        self.count += 1
+        self.live = candle
+
+    def column(self, name):
+        """
+        read-only view of a column for the stored candles, oldest first.
+        the view is only valid until the next candle is appended.
+
+        :param name: one of COLUMNS, or a Candle attribute name
+        :return: numpy array view
+        """
+        self._sync()
+        start = self._start()
+        view = self.columns[self.ALIASES.get(name, name)][start:start + len(self)]
+        view.flags.writeable = False
+        return view
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def get_state(self):
+        return dict((name, self.column(name).copy()) for name in self.COLUMNS)
+
+    def set_state(self, state):
+        """
+        :param state: dict of column arrays, oldest first, as returned by get_state
+        """
+        size = min(len(state['time']), self.capacity)
+        for name in self.COLUMNS:
+            rows = state[name][len(state[name]) - size:]
+            self.columns[name][:size] = rows
+            self.columns[name][self.capacity:self.capacity + size] = rows
+
+        self.head = size % self.capacity
+        self.count = size
+        self.live = None
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('candle index out of range')
+
+        self._sync()
+        pos = self._start() + index
+        return Candle.from_state(self.symbol, self.exchange_id, (
+            int(self.columns['time'][pos]), float(self.columns['open'][pos]), float(self.columns['high'][pos]),
+            float(self.columns['low'][pos]), float(self.columns['close'][pos]),
+            float(self.columns['sell_vol'][pos]), float(self.columns['buy_vol'][pos])
+        ))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _start(self):
+        return self.head if self.count >= self.capacity else 0
+
+    def _sync(self):
+        if self.live is not None:
+            self._write((self.head - 1) % self.capacity, self.live)
+
+    def _write(self, pos, candle):
+        for p in (pos, pos + self.capacity):
+            self.columns['time'][p] = candle.time
+            self.columns['open'][p] = candle.open
+            self.columns['high'][p] = candle.high
+            self.columns['low'][p] = candle.low
+            self.columns['close'][p] = candle.close
+            self.columns['buy_vol'][p] = candle.total_buy_vol
+            self.columns['sell_vol'][p] = candle.total_sell_vol
+
+
 class Candle(object):
     """
     Represents a Candle. Tracks key points during a candle's lifetime.
     """
+    __slots__ = ('symbol', 'exchange_id', 'time', 'open', 'high', 'low', 'close', 'total_sell_vol', 'total_buy_vol')
+
     def __init__(self, symbol, exchange_id, time_round, start_price, sell_vol, buy_vol):
         """
         :param symbol:  COIN/BASE symbol for the market.
@@ -80,7 +351,6 @@ class Candle(object):
         """
         self.symbol = symbol
         self.exchange_id = exchange_id
-        self.logger_extra = dict(symbol=self.symbol, exchange_id=self.exchange_id, candle_time=time_round)
 
         self.time = time_round
         self.open = start_price
@@ -90,11 +360,26 @@ class Candle(object):
         self.total_sell_vol = sell_vol
         self.total_buy_vol = buy_vol
 
+    @property
+    def logger_extra(self):
+        return dict(symbol=self.symbol, exchange_id=self.exchange_id, candle_time=self.time)
+
+    def get_state(self):
+        return (self.time, self.open, self.high, self.low, self.close, self.total_sell_vol, self.total_buy_vol)
+
+    @staticmethod
+    def from_state(symbol, exchange_id, state):
+        time_round, open_price, high, low, close, sell_vol, buy_vol = state
+        candle = Candle(symbol, exchange_id, time_round, open_price, sell_vol=sell_vol, buy_vol=buy_vol)
+        candle.merge(high, low, close, 0, 0)
+        return candle
+
     def update(self, price, sell_vol, buy_vol):
         """update high, low and close values and add to volume"""
-        logger.debug('candle_update Price: {}, Sell: {}, Buy: {}'.format(
-            price, sell_vol, buy_vol
-        ), extra=self.logger_extra)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('candle_update Price: {}, Sell: {}, Buy: {}'.format(
+                price, sell_vol, buy_vol
+            ), extra=self.logger_extra)
 
         if price > self.high:
             self.high = price
@@ -103,3 +388,13 @@ class Candle(object):
         self.close = price
         self.total_sell_vol += sell_vol
         self.total_buy_vol += buy_vol
+
+    def merge(self, high, low, close, sell_vol, buy_vol):
+        """fold an aggregate of later trades into the candle"""
+        if high > self.high:
+            self.high = high
+        if low < self.low:
+            self.low = low
+        self.close = close
+        self.total_sell_vol += sell_vol
+        self.total_buy_vol += buy_vol
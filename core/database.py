@@ -1,20 +1,30 @@
+import time
 import logging
+import threading
 
-from sqlalchemy import Column, Integer, Float, String, DateTime
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, Index, inspect, func, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import sessionmaker
 
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# indexes superseded by one in the model, dropped by create_indexes
+REPLACED_INDEXES = dict(
+    trades=('ix_trades_symbol_exchange_created_at', 'ix_trades_symbol_exchange_time')
+)
+
 
 class Trades(Base):
     __tablename__ = 'trades'
     id = Column(Integer, primary_key=True)
     symbol = Column(String)
     exchange = Column(String)
+    # exchange trade id, or a content hash, see core.feed.trade_key
+    trade_id = Column(String)
     price = Column(Float)
     type = Column(String)
     quantity = Column(Float)
@@ -22,8 +32,354 @@ class Trades(Base):
     time = Column(DateTime)
     created_at = Column(DateTime)
 
+    __table_args__ = (
+        Index('ix_trades_symbol_exchange_time_id', 'symbol', 'exchange', 'time', 'id'),
+        Index('ix_trades_symbol_exchange_id', 'symbol', 'exchange', 'id'),
+        Index('ux_trades_symbol_exchange_trade_id', 'symbol', 'exchange', 'trade_id', unique=True),
+    )
+
+
+class Candles(Base):
+    """closed candles built by the engines, time is the candle start in UTC epoch seconds"""
+    __tablename__ = 'candles'
+    symbol = Column(String, primary_key=True)
+    exchange = Column(String, primary_key=True)
+    period = Column(Integer, primary_key=True)
+    time = Column(BigInteger, primary_key=True)
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float)
+    buy_vol = Column(Float)
+    sell_vol = Column(Float)
+
+
+def trade_history_query(db_session, symbol, exchange, start_at=None, stop_at=None, max_id=None, chunk_size=10000):
+    """
+    trades for a market between start_at and stop_at, up to and including max_id, oldest first,
+    in insertion order within the same second as the monitor loop reads them.
+    rows are plain (id, epoch, price, type, quantity) tuples streamed from a server-side
+    cursor chunk_size at a time, so memory use does not depend on the length of the history.
+    epoch is the trade time in UTC epoch seconds.
+    """
+    epoch = func.date_part('epoch', Trades.time).label('epoch')
+    query = db_session.query(Trades.id, epoch, Trades.price, Trades.type, Trades.quantity)\
+        .filter(Trades.symbol == symbol)\
+        .filter(Trades.exchange == exchange)\
+        .order_by(Trades.time, Trades.id)
+
+    if max_id is not None:
+        query = query.filter(Trades.id <= max_id)
+    if start_at:
+        query = query.filter(Trades.time >= start_at)
+    if stop_at:
+        query = query.filter(Trades.time <= stop_at)
+
+    return query.execution_options(stream_results=True).yield_per(chunk_size)
+
+
+def trades_after_query(db_session, symbol, exchange, after_id, limit):
+    """
+    the next batch of trades for a market stored after the trade with id after_id, in insertion order,
+    as (id, epoch, price, type, quantity, trade_id, created_at) rows.
+    ids are handed out by the single ticker writer in commit order, so a trade
+    is never committed with an id below one that has already been read.
+    """
+    epoch = func.date_part('epoch', Trades.time).label('epoch')
+    return db_session.query(Trades.id, epoch, Trades.price, Trades.type, Trades.quantity, Trades.trade_id,
+                            Trades.created_at) \
+        .filter(Trades.symbol == symbol) \
+        .filter(Trades.exchange == exchange) \
+        .filter(Trades.id > after_id) \
+        .order_by(Trades.id) \
+        .limit(limit)
+
+
+def last_trade_id(db_session, symbol, exchange):
+    """id of the latest stored trade for a market, 0 if there are none"""
+    return db_session.query(func.max(Trades.id)) \
+        .filter(Trades.symbol == symbol) \
+        .filter(Trades.exchange == exchange) \
+        .scalar() or 0
+
+
+def cached_candles_query(db_session, symbol, exchange, period, start_at=None, stop_at=None):
+    """
+    cached candles for a market and period, oldest first
+
+    :param start_at: epoch seconds, optional
+    :param stop_at: epoch seconds, optional
+    """
+    query = db_session.query(Candles) \
+        .filter(Candles.symbol == symbol) \
+        .filter(Candles.exchange == exchange) \
+        .filter(Candles.period == period) \
+        .order_by(Candles.time)
+
+    if start_at is not None:
+        query = query.filter(Candles.time >= start_at)
+    if stop_at is not None:
+        query = query.filter(Candles.time <= stop_at)
+
+    return query
+
+
+def save_candles(db_session, rows):
+    """
+    insert or replace cached candles, does not commit
+
+    :param rows: list of dicts of Candles column values
+    """
+    if not rows:
+        return
+
+    stmt = insert(Candles.__table__).values(rows)
+    db_session.execute(stmt.on_conflict_do_update(
+        index_elements=['symbol', 'exchange', 'period', 'time'],
+        set_=dict(
+            open=stmt.excluded.open,
+            high=stmt.excluded.high,
+            low=stmt.excluded.low,
+            close=stmt.excluded.close,
+            buy_vol=stmt.excluded.buy_vol,
+            sell_vol=stmt.excluded.sell_vol
+        )
+    ))
+
+
+def insert_trades(db_session, rows, page_size=1000):
+    """
+    insert trades, skipping any already stored with the same trade_id, does not commit.
+    the ticker receives trades again after a reconnect.
+
+    :param rows: list of dicts of Trades column values
+    :param page_size: rows per INSERT, at most the psycopg2 executemany page size
+    :return: number of rows inserted
+    """
+    if not rows:
+        return 0
+
+    # executemany, which psycopg2 sends as a multi-row VALUES without compiling a statement per batch.
+    # one page per call, the rowcount only covers the last page.
+    stmt = insert(Trades.__table__).on_conflict_do_nothing(index_elements=['symbol', 'exchange', 'trade_id'])
+    inserted = 0
+    for i in range(0, len(rows), page_size):
+        inserted += db_session.execute(stmt, rows[i:i + page_size]).rowcount
+    return inserted
+
+
+def trades_channel(symbol, exchange):
+    """
+    name of the channel notified when trades of a market are stored
+    """
+    return 'trades:{}:{}'.format(exchange, symbol)
+
+
+def notify_trades(db_session, rows):
+    """
+    notify the channel of every market in rows, does not commit.
+    listeners get the notifications once the transaction commits.
+
+    :param rows: list of dicts of Trades column values
+    """
+    channels = sorted(set(trades_channel(row['symbol'], row['exchange']) for row in rows))
+    db_session.execute(
+        text("SELECT pg_notify(channel, '') FROM unnest(CAST(:channels AS text[])) AS channel"),
+        dict(channels=channels)
+    )
+
 
-def setup_db(host, port, db_name, username, password):
+class TradeWriter(object):
+    """
+    Write-behind buffer for the trades table. Rows are grouped and written with a single
+    multi-row INSERT once flush_rows are queued or flush_ms has passed, whichever comes first.
+    Trades already stored are skipped.
+    """
+
+    def __init__(self, db_session, flush_rows=500, flush_ms=250, max_rows=50000, notify=True):
+        """
+        :param db_session: a session to the backend database, only used by the writer thread
+        :param flush_rows: write as soon as this many rows are queued
+        :param flush_ms: write queued rows at least this often
+        :param max_rows: upper bound on queued rows, add() blocks while the buffer is full
+        :param notify: notify the trades_channel of each market written, for engines listening in other processes
+        """
+        self.db_session = db_session
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_ms / 1000.0
+        self.max_rows = max(max_rows, flush_rows)
+        self.notify = notify
+
+        self.buffer = list()
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.closed = False
+        self.thread = None
+
+        self.written = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.dropping = False
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='trade-writer', daemon=True)
+        self.thread.start()
+        return self
+
+    def add(self, row, block=True):
+        """
+        Queue a row for insertion.
+
+        :param row: dict of Trades column values
+        :param block: wait while the buffer is full, otherwise drop the row.
+        an event loop must not wait on the writer thread, the lock is only held to swap the buffer.
+        :return: False if the row was dropped
+        """
+        with self.condition:
+            while len(self.buffer) + self.in_flight >= self.max_rows and not self.closed:
+                if not block:
+                    self.dropped += 1
+                    if not self.dropping:
+                        logger.warning('trade buffer full ({} rows), dropping trades until a write succeeds'.format(
+                            self.max_rows
+                        ))
+                        self.dropping = True
+                    return False
+
+                logger.warning('trade buffer full ({} rows), waiting for flush'.format(self.max_rows))
+                self.condition.notify_all()
+                self.condition.wait()
+
+            self.buffer.append(row)
+            if len(self.buffer) >= self.flush_rows:
+                self.condition.notify_all()
+        return True
+
+    def flush(self):
+        """write everything queued so far, returns once it is committed"""
+        with self.condition:
+            rows = self._take()
+        self._done(rows, self._write(rows))
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+        self.flush()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _take(self):
+        rows = self.buffer
+        self.buffer = list()
+        self.in_flight += len(rows)
+        return rows
+
+    def _done(self, rows, written):
+        with self.condition:
+            self.in_flight -= len(rows)
+            if not written:
+                # requeue in front of anything that arrived meanwhile
+                self.buffer = rows + self.buffer
+            elif self.dropping and rows:
+                logger.warning('trade buffer writing again, {} trades dropped so far'.format(self.dropped))
+                self.dropping = False
+            self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.closed or len(self.buffer) >= self.flush_rows,
+                    timeout=self.flush_seconds
+                )
+                if self.closed:
+                    return
+                rows = self._take()
+
+            written = self._write(rows)
+            self._done(rows, written)
+
+            if not written:
+                # back off before retrying
+                time.sleep(self.flush_seconds)
+
+    def _write(self, rows):
+        if not rows:
+            return True
+
+        with self.write_lock:
+            try:
+                inserted = insert_trades(self.db_session, rows)
+                if inserted and self.notify:
+                    notify_trades(self.db_session, rows)
+                self.db_session.commit()
+            except Exception as e:
+                logger.error('failed to write {} trades: {}'.format(len(rows), e))
+                self.db_session.rollback()
+                return False
+
+            self.written += inserted
+            self.duplicates += len(rows) - inserted
+
+        logger.debug('wrote {} trades, skipped {} already stored'.format(inserted, len(rows) - inserted))
+        return True
+
+
+def add_columns(engine):
+    """
+    create_all only creates columns together with a new table,
+    add any column that is missing from an existing table.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = set(c['name'] for c in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in existing:
+                logger.info('adding column {}.{}'.format(table.name, column.name))
+                engine.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name, column.type.compile(engine.dialect)
+                ))
+
+
+def create_indexes(engine):
+    """
+    create_all only creates indexes together with a new table,
+    add any index that is missing from an existing table and drop those it replaces.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = set(i['name'] for i in inspector.get_indexes(table.name))
+        for name in REPLACED_INDEXES.get(table.name, ()):
+            if name in existing:
+                logger.info('dropping index {}'.format(name))
+                engine.execute('DROP INDEX {}'.format(name))
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info('creating index {}'.format(index.name))
+                index.create(engine)
+
+
+def new_session(db_session):
+    """
+    a new session on the same database as db_session, checking out its own connection from the pool.
+    sessions are not thread safe, so each thread needs one of these.
+    """
+    return sessionmaker(bind=db_session.bind)()
+
+
+def setup_db(host, port, db_name, username, password, pool_size=5):
+    """
+    :param pool_size: connections kept open, a backfilling engine holds one until it is done.
+    main.run_engines raises it to at least one per engine plus one per query thread
+    """
     logger.info('setting up database {}:{}/{}'.format(host, port, db_name))
     engine = create_engine('postgresql://{username}:{password}@{host}:{port}/{db_name}'.format(
         host=host,
@@ -31,8 +387,10 @@ def setup_db(host, port, db_name, username, password):
         db_name=db_name,
         username=username,
         password=password
-    ))
+    ), pool_size=int(pool_size))
     Base.metadata.create_all(engine)
+    add_columns(engine)
+    create_indexes(engine)
 
     sm = sessionmaker(bind=engine)
     session = sm()
@@ -1,17 +1,31 @@
+import os
+import time
 import asyncio
 import logging
+import calendar
+import functools
+import itertools
+import collections
+import concurrent.futures
 from datetime import datetime, timedelta
 
+import numpy as np
+
 import core.candle
+import core.levels
 import core.trend
 import core.trade
 import core.schedule
 import core.exchange
+import core.util
 
-from core.database import Trades
+from core.database import trade_history_query, trades_after_query, last_trade_id, cached_candles_query, save_candles, \
+    new_session
 
 logger = logging.getLogger(__name__)
 
+EPOCH = datetime(1970, 1, 1)
+
 
 class BaseEngine(object):
     """
@@ -19,15 +33,21 @@ class BaseEngine(object):
     maybe implemented, and strategies created.
     """
 
-    def __init__(self, db_session, ledger, symbol, exchange_id, config):
+    def __init__(self, db_session, ledger, symbol, exchange_id, config, executor=None, bus=None, listener=None):
         """
-        :param db_session: a session to the backend database
+        :param db_session: a session to the backend database, the engine opens its own session on the same database
         :param ledger: the core.ledger.Ledger object for this COIN/BASE/EXCHANGE
         :param symbol: COIN/BASE symbol for the market.
         :param exchange_id: coinigy exchange id
         :param config: config from trade.conf generated by core.util.config_to_dict
+        :param executor: concurrent.futures.Executor the engine runs its queries on, may be shared between engines.
+        a single thread of its own if not given
+        :param bus: core.bus.TradeBus to take new trades from as they arrive, optional.
+        the database is still read every bus_sync_seconds, for the watermark and any trade the bus missed.
+        :param listener: core.notify.TradeListener to wait on for new trades instead of polling, optional.
+        the database is still read every notify_poll_seconds in case notifications stop.
         """
-        self.db_session = db_session
+        self.db_session = new_session(db_session) if db_session is not None else None
         self.ledger = ledger
         self.symbol = symbol
         self.coin, self.base = symbol.split('/')
@@ -41,27 +61,90 @@ class BaseEngine(object):
         self.position_mult = float(self.config['symbols'][self.symbol]['position_mult'])
         self.trade_frequency = int(self.config['symbols'][self.symbol]['trade_frequency'])
         self.paper = bool(self.config['symbols'][self.symbol]['paper'])
+        self.batch_size = int(self.config['symbols'][self.symbol].get('monitor_batch_size', 1000))
+        self.chunk_size = int(self.config['symbols'][self.symbol].get('backfill_chunk_size', 10000))
+        self.candle_capacity = int(self.config['symbols'][self.symbol].get('candle_capacity', 10000))
+        self.candle_cache = self.config['symbols'][self.symbol].get('candle_cache') == '1'
+        self.bus_sync_seconds = float(self.config['symbols'][self.symbol].get('bus_sync_seconds', 10))
+        self.dedup_seconds = float(self.config['symbols'][self.symbol].get('dedup_seconds', 600))
+        self.notify_poll_seconds = float(self.config['symbols'][self.symbol].get('notify_poll_seconds', 30))
+        self.candle_periods = [
+            int(p) for p in self.config['symbols'][self.symbol].get('candle_periods', '').split(',') if p.strip()
+        ]
+
+        self.snapshot_path = None
+        if self.config['snapshot']['path']:
+            self.snapshot_path = os.path.join(self.config['snapshot']['path'], '{}-{}.snapshot'.format(
+                self.symbol.replace('/', '_'), self.exchange_id
+            ))
+        self.snapshot_interval = int(self.config['snapshot']['interval_seconds'])
 
         self.candle = self.get_candle_manager()
+        self.rollup = self.get_candle_rollup(self.candle)
+        self.levels = self.get_level_generator()
         self.trend = self.get_trend_manager()
         self.trade = self.get_trade_manager()
         self.schedule = self.get_schedule_manager()
 
         self.backfill = True
 
-    def get_trade_history(self, start_at, stop_at):
-        query = self.db_session.query(Trades)\
-            .filter(Trades.symbol == self.symbol)\
-            .filter(Trades.exchange == self.exchange_id)\
-            .order_by(Trades.time.desc())
+        # id of the last trade passed to the candle manager
+        self.watermark = 0
+
+        # created_at of the last trade read from the database
+        self.stored_until = None
+
+        # epoch of the newest trade passed to the candle manager, older trades from the bus are skipped
+        self.ticked_until = 0
+        self.late = 0
+
+        self.bus = bus
+        self.subscription = None
+
+        # reading from the database after the bus dropped trades, until it reaches a new subscription
+        self.catching_up = False
+
+        self.listener = listener
+        self.notification = None
+
+        # trade_id -> created_at of the trades taken from the bus, and of those read from the database
+        # while using the bus, so a trade is only counted once whichever way it comes in
+        self.seen = collections.OrderedDict()
+
+        # closed candles waiting to be written to the candle cache
+        self.pending_candles = list()
+        self.cached_until = None
+
+        # queries run off the event loop, so a slow query only holds up this engine
+        self.own_executor = executor is None
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='db-{}-{}'.format(self.symbol, self.exchange_id)
+        )
+
+    def run_in_db(self, func, *args):
+        """
+        run func(*args) on the engine executor. the engine session is not thread safe, callers await
+        each call before making the next, so there is never more than one at a time per engine
+
+        :return: awaitable result of func
+        """
+        return asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(func, *args))
 
-        if start_at:
-            query = query.filter(Trades.time >= start_at)
-        if stop_at:
-            query = query.filter(Trades.time <= stop_at)
+    def get_trade_history(self, start_at, stop_at):
+        """
+        yields lists of up to chunk_size (id, epoch, price, type, quantity) rows, oldest first
+        """
+        query = trade_history_query(
+            self.db_session, self.symbol, self.exchange_id, start_at, stop_at,
+            max_id=self.watermark, chunk_size=self.chunk_size
+        )
 
-        for trade in reversed([i for i in query]):
-            yield trade
+        trades = iter(query)
+        while True:
+            chunk = list(itertools.islice(trades, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
 
     @staticmethod
     def get_volume(trade):
@@ -74,6 +157,230 @@ class BaseEngine(object):
             sell_vol = trade.quantity
         return buy_vol, sell_vol
 
+    def tick_many(self, trades):
+        """
+        feed a chunk of trade rows to the candle manager in one vectorized pass
+
+        :param trades: list of (id, epoch, price, type, quantity) rows
+        :return:
+        """
+        _, timestamps, prices, types, quantities = zip(*trades)
+
+        quantities = np.array(quantities, dtype=float)
+        types = np.array(types)
+
+        self.candle.tick_many(
+            timestamps=np.array(timestamps, dtype=float),
+            prices=np.array(prices, dtype=float),
+            buy_vols=np.where(types == 'BUY', quantities, 0.0),
+            sell_vols=np.where(types == 'SELL', quantities, 0.0)
+        )
+
+    def fetch_new_trades(self):
+        """
+        the next batch of trades stored after the watermark, runs on the engine executor
+        """
+        trades = trades_after_query(
+            self.db_session, self.symbol, self.exchange_id, self.watermark, self.batch_size
+        ).all()
+
+        # end the read transaction, an idle engine should not keep a connection checked out
+        self.db_session.commit()
+        return trades
+
+    async def get_new_trades(self):
+        """
+        process the next batch of trades stored after the watermark, skipping those already taken from the bus
+
+        :return: the number of trades read
+        """
+        trades = await self.run_in_db(self.fetch_new_trades)
+
+        for trade in trades:
+            if trade.trade_id is not None and trade.trade_id in self.seen:
+                continue
+            if self.bus and trade.trade_id is not None:
+                self.seen[trade.trade_id] = trade.created_at
+
+            buy_vol, sell_vol = self.get_volume(trade)
+
+            self.candle.tick(timestamp=trade.epoch, price=trade.price, buy_vol=buy_vol, sell_vol=sell_vol)
+            self.ticked_until = max(self.ticked_until, trade.epoch)
+
+        if trades:
+            self.watermark = trades[-1].id
+            self.stored_until = trades[-1].created_at
+            self.forget_seen(trades[-1].created_at)
+        return len(trades)
+
+    async def get_bus_trades(self, timeout):
+        """
+        process the trades published on the bus since the last call, waiting up to timeout for one
+
+        :return: the number of trades taken from the bus
+        """
+        trades = await self.subscription.get(self.batch_size, timeout)
+        try:
+            for trade in trades:
+                self.tick_trade(trade)
+        finally:
+            self.subscription.done(len(trades))
+        return len(trades)
+
+    def tick_trade(self, trade):
+        """
+        pass a trade received by the ticker to the candle manager, unless it was already counted
+
+        :param trade: dict of core.database.Trades column values, as made by core.feed.decode_trade
+        :return: False if the trade was skipped
+        """
+        # delivered again after a ticker reconnect, or already read from the database
+        if trade['trade_id'] in self.seen:
+            return False
+        self.seen[trade['trade_id']] = trade['created_at']
+
+        # newer trades were read from the database meanwhile, e.g. this one was never stored.
+        # ticking it now would close the live candle and open one back in time
+        timestamp = (trade['time'] - EPOCH).total_seconds()
+        if timestamp < self.ticked_until:
+            self.late += 1
+            logger.debug('skipping trade {} older than the last one ticked'.format(trade['trade_id']),
+                         extra=self.logger_extra)
+            return False
+        self.ticked_until = timestamp
+
+        self.candle.tick(
+            timestamp=timestamp,
+            price=trade['price'],
+            buy_vol=trade['quantity'] if trade['type'] == 'BUY' else 0,
+            sell_vol=trade['quantity'] if trade['type'] == 'SELL' else 0
+        )
+        return True
+
+    async def wait_for_trades(self, interval):
+        """
+        wait until trades of this market are stored, at most notify_poll_seconds.
+        polls every interval without a listener, or while it is not connected.
+        """
+        if self.notification is None or not self.listener.listening:
+            await asyncio.sleep(interval)
+            return
+
+        try:
+            await asyncio.wait_for(self.notification.wait(), self.notify_poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def resubscribe(self):
+        """
+        replace a subscription that dropped trades. the dropped trades, and any published until the
+        new subscription starts, are read from the database in the order they were received
+        before taking trades from the bus again, so they are never ticked after newer ones.
+        """
+        logger.warning('trade bus dropped {} trades, reading from the database until it catches up'.format(
+            self.subscription.dropped
+        ), extra=self.logger_extra)
+
+        self.subscription.close()
+        self.subscription = self.bus.subscribe(self.symbol, self.exchange_id)
+        self.catching_up = True
+
+    def caught_up(self):
+        """
+        whether the database has been read up to where the subscription starts. the first trade
+        queued may never be stored, e.g. when the writer dropped it, so reading any trade received
+        at the same time or later is enough
+        """
+        if self.subscription.first_trade_id is None:
+            return False
+        if self.subscription.first_trade_id in self.seen:
+            return True
+        return self.stored_until is not None and self.stored_until >= self.subscription.started_at
+
+    def forget_seen(self, stored_at):
+        """
+        forget trades received dedup_seconds before the last one read from the database,
+        they will not be read or delivered again
+        """
+        if stored_at is None:
+            return
+
+        before = stored_at - timedelta(seconds=self.dedup_seconds)
+        while self.seen:
+            trade_id, created_at = next(iter(self.seen.items()))
+            if created_at >= before:
+                break
+            self.seen.popitem(last=False)
+
+    def fetch_cached_candles(self, start_at, stop_at):
+        """
+        cached candles between start_at and stop_at, runs on the engine executor
+        """
+        return cached_candles_query(
+            self.db_session, self.symbol, self.exchange_id, self.period_seconds,
+            start_at=calendar.timegm(start_at.utctimetuple()) if start_at else None,
+            stop_at=calendar.timegm(stop_at.utctimetuple()) if stop_at else None
+        ).yield_per(self.chunk_size).all()
+
+    async def load_cached_candles(self, start_at, stop_at):
+        """
+        replay cached candles through the candle manager
+
+        :param start_at: datetime of the first candle to load, optional
+        :param stop_at: datetime of the last candle to load, optional
+        :return: datetime to resume reading trades from, start_at if nothing was cached
+        """
+        last = None
+        for last in await self.run_in_db(self.fetch_cached_candles, start_at, stop_at):
+            self.candle.tick_candle(core.candle.Candle.from_state(self.symbol, self.exchange_id, (
+                last.time, last.open, last.high, last.low, last.close, last.sell_vol, last.buy_vol
+            )))
+
+        if last is None:
+            return start_at
+
+        self.cached_until = last.time
+        logger.info('loaded cached candles up to {}'.format(datetime.utcfromtimestamp(last.time)),
+                    extra=self.logger_extra)
+        return datetime.utcfromtimestamp(last.time + self.period_seconds)
+
+    def cache_candle(self, candle):
+        self.pending_candles.append(dict(
+            symbol=self.symbol,
+            exchange=self.exchange_id,
+            period=self.period_seconds,
+            time=candle.time,
+            open=candle.open,
+            high=candle.high,
+            low=candle.low,
+            close=candle.close,
+            buy_vol=candle.total_buy_vol,
+            sell_vol=candle.total_sell_vol
+        ))
+
+    async def save_cached_candles(self, commit):
+        """
+        write pending candles to the candle cache on the engine executor.
+        while backfilling, committing would close the streaming trade cursor.
+        """
+        rows = self.pending_candles
+        self.pending_candles = list()
+        await self.run_in_db(self.write_cached_candles, rows, commit)
+
+    def write_cached_candles(self, rows, commit):
+        save_candles(self.db_session, rows)
+        if commit:
+            self.db_session.commit()
+
+    def on_candle_close(self, candle):
+        if self.candle_cache and (self.cached_until is None or candle.time > self.cached_until):
+            self.cache_candle(candle)
+        if self.levels:
+            levels = self.levels.update(self.candle.candles)
+            if levels is not None:
+                self.trend.set_trends(levels)
+        self.candle_close(candle)
+
     async def run(self, interval, start_at, stop_at):
         """
         Main loop for candle generation and event handling
@@ -85,52 +392,207 @@ class BaseEngine(object):
         :return:
         """
         logger.debug('engine started', extra=self.logger_extra)
+        try:
+            await self.process(interval, start_at, stop_at)
+        finally:
+            if self.subscription:
+                self.subscription.close()
+                self.subscription = None
+            if self.own_executor:
+                self.executor.shutdown(wait=False)
+
+    async def process(self, interval, start_at, stop_at):
+        if self.bus and not stop_at:
+            # before the watermark is taken, so no trade falls between the database and the bus
+            self.subscription = self.bus.subscribe(self.symbol, self.exchange_id)
+        elif self.listener and not stop_at:
+            self.notification = self.listener.listen(self.symbol, self.exchange_id)
+
+        if not stop_at and self.restore_snapshot():
+            logger.info('restored snapshot, resuming after trade {}'.format(self.watermark), extra=self.logger_extra)
+        else:
+            logger.info('get trade history', extra=self.logger_extra)
+
+            # trades stored after this point are left to the monitor loop
+            self.watermark = await self.run_in_db(last_trade_id, self.db_session, self.symbol, self.exchange_id)
+
+            if self.candle_cache:
+                start_at = await self.load_cached_candles(start_at, stop_at)
+
+            # each chunk is read on the engine executor, the other engines run meanwhile
+            chunks = self.get_trade_history(start_at, stop_at)
+            while True:
+                trades = await self.run_in_db(next, chunks, None)
+                if trades is None:
+                    break
+                self.tick_many(trades)
+                self.ticked_until = max(self.ticked_until, trades[-1][1])
+
+                if self.candle_cache and len(self.pending_candles) >= self.batch_size:
+                    await self.save_cached_candles(commit=False)
+
+            if self.candle_cache:
+                await self.save_cached_candles(commit=True)
+
+            logger.info('completed trade history', extra=self.logger_extra)
+
+            if stop_at:
+                logger.debug('stop_at time reached, stopping', extra=self.logger_extra)
+                return
 
-        logger.info('get trade history', extra=self.logger_extra)
-
-        for trade in self.get_trade_history(start_at, stop_at):
-
-            buy_vol, sell_vol = self.get_volume(trade)
-
-            self.candle.tick(timestamp=trade.time, price=trade.price, buy_vol=buy_vol, sell_vol=sell_vol)
+        # we're done backfilling
+        self.backfill = False
 
-        logger.info('completed trade history', extra=self.logger_extra)
+        logger.info('monitoring{}'.format(' the trade bus' if self.subscription else ''), extra=self.logger_extra)
+        last_snapshot = time.monotonic()
+        last_sync = None
+        try:
+            while True:
+                if self.subscription is None:
+                    if self.notification:
+                        # a notification arriving while reading means another batch is stored
+                        self.notification.clear()
+                    count = await self.get_new_trades()
+                    idle = count < self.batch_size
+                elif self.subscription.lost:
+                    if self.catching_up or self.subscription.queue.empty():
+                        self.resubscribe()
+                    else:
+                        # queued before the first dropped trade, still in order
+                        await self.get_bus_trades(timeout=None)
+                    idle = False
+                elif self.catching_up:
+                    count = await self.get_new_trades()
+                    self.catching_up = not self.caught_up()
+                    if not self.catching_up:
+                        logger.info('caught up with the trade bus', extra=self.logger_extra)
+                    idle = self.catching_up and count < self.batch_size
+                elif last_sync is None or time.monotonic() - last_sync >= self.bus_sync_seconds:
+                    # catch up with the database first, then move the watermark past what the bus delivered
+                    while await self.get_new_trades() == self.batch_size:
+                        pass
+                    last_sync = time.monotonic()
+                    idle = False
+                else:
+                    await self.get_bus_trades(timeout=max(0, self.bus_sync_seconds - (time.monotonic() - last_sync)))
+                    idle = False
+
+                if self.pending_candles:
+                    await self.save_cached_candles(commit=True)
+
+                if idle:
+                    await self.wait_for_trades(interval)
+
+                if time.monotonic() - last_snapshot >= self.snapshot_interval:
+                    self.save_snapshot()
+                    last_snapshot = time.monotonic()
+        except asyncio.CancelledError:
+            # only saved between batches, when the state matches the watermark and seen trades
+            self.save_snapshot()
+            raise
+
+    def get_state(self):
+        """
+        everything needed to resume after the watermark without replaying history.
+        strategies keeping state of their own should extend this and set_state.
+        """
+        return dict(
+            symbol=self.symbol,
+            exchange_id=self.exchange_id,
+            period_seconds=self.period_seconds,
+            watermark=self.watermark,
+            seen=list(self.seen.items()),
+            cached_until=self.cached_until,
+            candles=dict((period, cm.get_state()) for period, cm in self.rollup.managers.items()),
+            levels=self.levels.get_state() if self.levels else None,
+            trend=self.trend.get_state(),
+            trade=self.trade.get_state(),
+            schedule=self.schedule.get_state()
+        )
 
-        if stop_at:
-            logger.debug('stop_at time reached, stopping', extra=self.logger_extra)
+    def set_state(self, state):
+        self.watermark = state['watermark']
+        self.seen = collections.OrderedDict(state.get('seen', ()))
+        self.cached_until = state['cached_until']
+        for period, cm in self.rollup.managers.items():
+            if period in state['candles']:
+                cm.set_state(state['candles'][period])
+        if self.levels and state.get('levels'):
+            self.levels.set_state(state['levels'])
+            self.trend.set_trends(self.levels.levels)
+        self.trend.set_state(state['trend'])
+        self.trade.set_state(state['trade'])
+        self.schedule.set_state(state['schedule'])
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
             return
 
-        # we're done backfilling
-        self.backfill = False
+        core.util.write_snapshot(self.snapshot_path, self.get_state())
+        logger.debug('saved snapshot at trade {}'.format(self.watermark), extra=self.logger_extra)
 
-        logger.info('monitoring', extra=self.logger_extra)
-        while True:
-            now = datetime.utcnow()
-            for trade in self.db_session.query(Trades) \
-                    .filter(Trades.symbol == self.symbol) \
-                    .filter(Trades.exchange == self.exchange_id) \
-                    .filter(Trades.created_at > now - timedelta(seconds=interval)) \
-                    .order_by(Trades.time):
+    def restore_snapshot(self):
+        """
+        :return: True if the engine state was restored from a snapshot
+        """
+        if not self.snapshot_path:
+            return False
 
-                buy_vol, sell_vol = self.get_volume(trade)
+        state = core.util.read_snapshot(self.snapshot_path)
+        if not state:
+            return False
 
-                self.candle.tick(timestamp=trade.time, price=trade.price, buy_vol=buy_vol, sell_vol=sell_vol)
+        if (state['symbol'], state['exchange_id'], state['period_seconds']) != \
+                (self.symbol, self.exchange_id, self.period_seconds):
+            logger.warning('ignoring snapshot {} taken for a different market or period'.format(self.snapshot_path),
+                           extra=self.logger_extra)
+            return False
 
-            await asyncio.sleep(interval)
+        self.set_state(state)
+        return True
 
     def get_candle_manager(self):
-        cm = core.candle.CandleManager(self.symbol, self.exchange_id, self.period_seconds)
-        cm.register('candle_open', self.candle_open)
-        cm.register('candle_close', self.candle_close)
-        cm.register('candle_update', self.candle_update)
+        cm = core.candle.CandleManager(self.symbol, self.exchange_id, self.period_seconds, self.candle_capacity)
 
         return cm
 
+    def get_candle_rollup(self, cm):
+        rollup = core.candle.CandleRollup(cm, self.candle_periods, self.candle_capacity)
+        rollup.register(self.period_seconds, 'candle_open', self.candle_open)
+        rollup.register(self.period_seconds, 'candle_close', self.on_candle_close)
+        rollup.register(self.period_seconds, 'candle_update', self.candle_update)
+
+        for period in rollup.managers:
+            if period != self.period_seconds:
+                rollup.register(period, 'candle_open', functools.partial(self.timeframe_candle_open, period))
+                rollup.register(period, 'candle_close', functools.partial(self.timeframe_candle_close, period))
+                rollup.register(period, 'candle_update', functools.partial(self.timeframe_candle_update, period))
+
+        return rollup
+
+    def get_level_generator(self):
+        """
+        :return: core.levels.LevelGenerator if the trends are found automatically, else None
+        """
+        if self.trends != 'auto':
+            return None
+
+        options = self.config['symbols'][self.symbol]
+        return core.levels.LevelGenerator(
+            self.symbol,
+            self.exchange_id,
+            window=int(options.get('level_window', 5)),
+            tolerance=float(options.get('level_tolerance', 0.005)),
+            min_touches=int(options.get('level_min_touches', 2)),
+            max_levels=int(options.get('level_max', 20)),
+            lookback=int(options.get('level_lookback', 10000))
+        )
+
     def get_trend_manager(self):
         tm = core.trend.TrendManager(
             self.symbol,
             self.exchange_id,
-            trends=self.trends,
+            trends=self.levels.levels if self.levels else self.trends,
         )
         tm.register('trend_up', self.trend_up)
         tm.register('trend_down', self.trend_down)
@@ -176,6 +638,33 @@ class BaseEngine(object):
     def candle_update(self, candle):
         raise NotImplementedError()
 
+    def timeframe_candle_open(self, period, candle):
+        """
+        called when a candle opens on one of the longer timeframes in candle_periods
+        :param period: the timeframe in seconds
+        :param candle: core.candle.Candle
+        :return:
+        """
+        raise NotImplementedError()
+
+    def timeframe_candle_close(self, period, candle):
+        """
+        called when a candle closes on one of the longer timeframes in candle_periods
+        :param period: the timeframe in seconds
+        :param candle: core.candle.Candle
+        :return:
+        """
+        raise NotImplementedError()
+
+    def timeframe_candle_update(self, period, candle):
+        """
+        called when a closed base candle is rolled into a longer timeframe candle
+        :param period: the timeframe in seconds
+        :param candle: core.candle.Candle
+        :return:
+        """
+        raise NotImplementedError()
+
     def trend_up(self):
         """
         called when the price of a market is trending upward
@@ -1,69 +1,274 @@
+import time
+import heapq
 import asyncio
 import logging
+import itertools
 
-import requests
+import aiohttp
 
 logger = logging.getLogger(__name__)
 
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
 
 class Exchange(object):
 
-    def __init__(self, symbol, exchange_id, api_key, api_secret):
-        self.symbol = symbol
+    def __init__(self, exchange_id, api_key, api_secret, session, url='https://api.coinigy.com/api/v1/'):
+        """
+        :param exchange_id: coinigy exchange id
+        :param session: aiohttp.ClientSession, shared so every exchange draws from one connection pool
+        :param url: base url of the coinigy api
+        """
         self.exchange_id = exchange_id
-        self.logger_extra = dict(symbol=self.symbol, exchange_id=self.exchange_id)
+        self.logger_extra = dict(symbol=None, exchange_id=self.exchange_id)
 
-        self.api_key = api_key
-        self.api_secret = api_secret
-        self.session = requests.Session()
-        self.session.headers = {
+        self.session = session
+        self.url = url
+        self.headers = {
             'Content-Type': 'application/json',
-            'X-API-KEY': self.api_key,
-            'X-API-SECRET': self.api_secret
+            'X-API-KEY': api_key,
+            'X-API-SECRET': api_secret
         }
 
-    def fetch_ticker(self, symbol):
+        # cleared once the api refuses a ticker request for the whole exchange
+        self.batch_tickers = True
+
+    async def post(self, path, values):
+        async with self.session.post(self.url + path, json=values, headers=self.headers) as resp:
+            resp.raise_for_status()
+            return (await resp.json())['data']
+
+    async def fetch_ticker(self, symbol):
         values = dict(
             exchange_code=self.exchange_id,
             exchange_market=symbol
         )
         logger.debug('fetch_ticker: {}'.format(values), extra=self.logger_extra)
-        resp = self.session.post(
-            'https://api.coinigy.com/api/v1/ticker',
-            json=values
-        )
+        return (await self.post('ticker', values))[0]
+
+    async def fetch_tickers(self, symbols):
+        """
+        tickers of several markets in a single request for the whole exchange. the api does not document
+        this, markets it leaves out have to be fetched one at a time with fetch_ticker.
+
+        :param symbols: tuple of COIN/BASE symbols
+        :return: dict of symbol to ticker, of those symbols in the reply
+        """
+        values = dict(exchange_code=self.exchange_id)
+        logger.debug('fetch_tickers: {}'.format(values), extra=self.logger_extra)
+        try:
+            reply = await self.post('ticker', values)
+        except aiohttp.ClientResponseError as e:
+            if not 400 <= e.status < 500:
+                raise
+            logger.warning('ticker request for the whole exchange refused ({}), fetching markets one at a time'
+                           .format(e.status), extra=self.logger_extra)
+            self.batch_tickers = False
+            return dict()
+
+        tickers = dict((t['market'], t) for t in reply if isinstance(t, dict) and 'market' in t)
+        return dict((symbol, tickers[symbol]) for symbol in symbols if symbol in tickers)
+
+
+class TokenBucket(object):
+    """
+    allows rate requests per second on average, and bursts of up to capacity requests
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class TickerCache(object):
+    """
+    Latest tickers of one exchange. Every market asked for is refreshed together once its ticker
+    is older than ttl, so one request serves every caller on the exchange.
+    The engines take prices from the trades they tick, nothing in the trading path reads it yet.
+    """
+
+    def __init__(self, limiter, ttl):
+        """
+        :param limiter: ExchangeLimiter of the exchange
+        :param ttl: seconds a ticker is served from the cache
+        """
+        self.limiter = limiter
+        self.ttl = ttl
+
+        # symbol -> (fetched_at, ticker)
+        self.tickers = dict()
+        self.symbols = set()
+        self.lock = asyncio.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def fresh(self, symbol):
+        entry = self.tickers.get(symbol)
+        return entry is not None and time.monotonic() - entry[0] < self.ttl
 
-        resp.raise_for_status()
-        return resp.json()['data'][0]
+    async def get(self, symbol, priority=PRIORITY_NORMAL):
+        """
+        :return: ticker of symbol, at most ttl seconds old
+        """
+        self.symbols.add(symbol)
+        if self.fresh(symbol):
+            self.hits += 1
+            return self.tickers[symbol][1]
+
+        self.misses += 1
+
+        # let markets asking at the same time add themselves to this refresh
+        await asyncio.sleep(0)
+        async with self.lock:
+            # a refresh may have finished while waiting for the lock
+            if not self.fresh(symbol):
+                await self.refresh(priority)
+        return self.tickers[symbol][1]
+
+    async def refresh(self, priority=PRIORITY_NORMAL):
+        stale = tuple(sorted(s for s in self.symbols if not self.fresh(s)))
+
+        tickers = dict()
+        if len(stale) > 1 and self.limiter.exchange.batch_tickers:
+            tickers = await self.limiter('fetch_tickers', stale, priority=priority)
+
+        # whatever the batch left out, each request taking its turn in the token bucket
+        missing = [s for s in stale if s not in tickers]
+        tickers.update(zip(missing, await asyncio.gather(*[
+            self.limiter('fetch_ticker', s, priority=priority) for s in missing
+        ])))
+
+        fetched_at = time.monotonic()
+        for symbol, ticker in tickers.items():
+            self.tickers[symbol] = (fetched_at, ticker)
 
 
 class ExchangeLimiter(object):
+    """
+    Request scheduler for one exchange, shared by every market on it.
+    Requests are sent in priority order as the token bucket allows, identical requests
+    that are queued or in flight share one response.
+    """
 
-    def __init__(self, symbol, exchange_id, api_key, api_secret, rate_limit_seconds):
-        self.symbol = symbol
+    def __init__(self, exchange_id, api_key, api_secret, rate_limit_seconds, session, burst=1, ticker_ttl=10,
+                 url='https://api.coinigy.com/api/v1/'):
+        """
+        :param exchange_id: coinigy exchange id
+        :param rate_limit_seconds: average seconds between requests
+        :param session: aiohttp.ClientSession the requests are sent with
+        :param burst: requests that may be sent back to back after a quiet period
+        :param ticker_ttl: seconds tickers are served from the TickerCache
+        :param url: base url of the coinigy api
+        """
         self.exchange_id = exchange_id
-        self.logger_extra = dict(symbol=self.symbol, exchange_id=self.exchange_id)
+        self.logger_extra = dict(symbol=None, exchange_id=self.exchange_id)
+
+        self.exchange = Exchange(exchange_id, api_key, api_secret, session, url=url)
+        self.bucket = TokenBucket(1.0 / rate_limit_seconds, burst)
 
-        self.exchange = Exchange(symbol, exchange_id, api_key, api_secret)
+        # (priority, sequence, key) heap, a key may be pushed again with a better priority
         self.queue = list()
-        self.rate_limit_seconds = rate_limit_seconds
+        self.sequence = itertools.count()
+        self.requests = dict()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+        self.sent = 0
+        self.coalesced = 0
+
+        self.tickers = TickerCache(self, ticker_ttl)
+
+    async def __call__(self, attr, *args, priority=PRIORITY_NORMAL, **kwargs):
+        """
+        queue a call to Exchange.attr and wait for its result
 
-    async def __call__(self, future, attr, *args, **kwargs):
-        request = (future, attr, args, kwargs)
-        self.queue.append(request)
+        :param priority: PRIORITY_HIGH requests are sent before PRIORITY_NORMAL and PRIORITY_LOW
+        """
+        key = (attr, args, tuple(sorted(kwargs.items())))
+
+        request = self.requests.get(key)
+        if request is None:
+            request = self.requests[key] = dict(future=asyncio.get_event_loop().create_future(), priority=priority)
+            self.push(key, priority)
+        else:
+            self.coalesced += 1
+            if priority < request['priority'] and 'sending' not in request:
+                request['priority'] = priority
+                self.push(key, priority)
+
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+        # one caller giving up does not cancel the request for the others
+        return await asyncio.shield(request['future'])
+
+    def push(self, key, priority):
+        heapq.heappush(self.queue, (priority, next(self.sequence), key))
+        self.wakeup.set()
 
     async def run(self):
-        while len(self.queue):
-            logger.debug("{} request queue: {}".format(self.exchange_id, len(self.queue)), extra=self.logger_extra)
-            future, attr, args, kwargs = self.queue.pop(0)
-            try:
-                result = getattr(self.exchange, attr)(*args, **kwargs)
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                logger.error("exchange error: {}".format(e), extra=self.logger_extra)
-                await asyncio.sleep(self.rate_limit_seconds)
+        while True:
+            while not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+
+            priority, _, key = heapq.heappop(self.queue)
+            request = self.requests.get(key)
+            if request is None or 'sending' in request or request['priority'] != priority:
+                # already sent, or pushed again with a better priority
                 continue
 
+            await self.bucket.acquire()
+            logger.debug('{} request queue: {}'.format(self.exchange_id, len(self.queue)), extra=self.logger_extra)
+
+            request['sending'] = asyncio.ensure_future(self.send(key, request['future']))
+
+    async def send(self, key, future):
+        attr, args, kwargs = key
+        try:
+            result = await getattr(self.exchange, attr)(*args, **dict(kwargs))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            logger.error('exchange error: {}'.format(e), extra=self.logger_extra)
+            future.set_exception(e)
+        else:
             future.set_result(result)
-            await asyncio.sleep(self.rate_limit_seconds)
+        finally:
+            self.sent += 1
+            del self.requests[key]
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+        sending = [r['sending'] for r in self.requests.values() if 'sending' in r]
+        for task in sending:
+            task.cancel()
+        await asyncio.gather(*sending, return_exceptions=True)
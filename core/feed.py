@@ -0,0 +1,47 @@
+import hashlib
+from datetime import datetime
+
+
+def parse_time(value):
+    """
+    :param value: UTC time as YYYY-MM-DDTHH:MM:SS, the only format the trade channels send
+    :return: datetime
+    """
+    return datetime(
+        int(value[0:4]), int(value[5:7]), int(value[8:10]),
+        int(value[11:13]), int(value[14:16]), int(value[17:19])
+    )
+
+
+def trade_key(data):
+    """
+    unique key of a trade message, the exchange trade id where there is one,
+    otherwise a hash of the message content
+
+    :param data: decoded TRADE channel message
+    """
+    trade_id = data.get('tradeid')
+    if trade_id is not None:
+        return str(trade_id)
+
+    content = '{exchange}|{label}|{time}|{type}|{price}|{quantity}'.format(**data)
+    return 'sha1:' + hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def decode_trade(data, received_at):
+    """
+    :param data: decoded TRADE channel message
+    :param received_at: datetime the message was received
+    :return: dict of core.database.Trades column values
+    """
+    return dict(
+        symbol=data['label'],
+        exchange=data['exchange'],
+        trade_id=trade_key(data),
+        price=float(data['price']),
+        type=data['type'],
+        quantity=float(data['quantity']),
+        total=float(data['total']),
+        time=parse_time(data['time']),
+        created_at=received_at
+    )
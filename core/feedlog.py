@@ -0,0 +1,168 @@
+import os
+import glob
+import gzip
+import json
+import time
+import zlib
+import heapq
+import logging
+import itertools
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.jsonl.gz'
+
+LOGGER_EXTRA = dict(symbol=None, exchange_id=None)
+
+EPOCH = datetime(1970, 1, 1)
+
+# json.dumps builds a new encoder per call when given separators
+ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+
+class FeedRecorder(object):
+    """
+    Append-only log of the raw messages the ticker receives, one JSON line of
+    [received at epoch, channel, message data] each, in gzip segments rotated by age and size.
+    Segment names sort in the order they were written.
+    flush_if_due() has to be called on a timer as well, so a lull in messages does not hold
+    buffered lines back or keep a segment open past its age.
+    """
+
+    def __init__(self, path, prefix='feed', segment_seconds=3600, segment_bytes=64 * 1024 * 1024,
+                 flush_seconds=1, buffer_bytes=64 * 1024, compresslevel=6):
+        """
+        :param path: directory the segments are written to
+        :param prefix: segment name prefix, each ticker process writing to path needs its own
+        :param segment_seconds: start a new segment after this long
+        :param segment_bytes: start a new segment after this many uncompressed bytes
+        :param flush_seconds: write compressed data out at least this often, a crash loses at most this much
+        :param buffer_bytes: lines are compressed in batches of about this many bytes
+        """
+        self.path = path
+        self.prefix = prefix
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.flush_seconds = flush_seconds
+        self.buffer_bytes = buffer_bytes
+        self.compresslevel = compresslevel
+
+        self.file = None
+        self.segment_path = None
+        self.opened_at = 0.0
+        self.flushed_at = 0.0
+        self.segment_written = 0
+        self.buffer = list()
+        self.buffered = 0
+        self.unflushed = False
+
+        self.messages = 0
+        self.segments = 0
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.segment_path = os.path.join(self.path, '{}-{:%Y%m%dT%H%M%S%f}{}'.format(
+            self.prefix, datetime.utcnow(), SUFFIX
+        ))
+        self.file = gzip.open(self.segment_path, 'wb', compresslevel=self.compresslevel)
+        self.opened_at = self.flushed_at = time.monotonic()
+        self.segment_written = 0
+        self.segments += 1
+        logger.info('recording feed to {}'.format(self.segment_path), extra=LOGGER_EXTRA)
+
+    def record(self, channel, data, received_at):
+        """
+        :param channel: channel the message was published on
+        :param data: decoded message data
+        :param received_at: datetime the message was received
+        """
+        if self.file is None:
+            self.open()
+
+        line = ENCODER.encode([(received_at - EPOCH).total_seconds(), channel, data]) + '\n'
+        self.buffer.append(line)
+        self.buffered += len(line)
+        self.segment_written += len(line)
+        self.unflushed = True
+        self.messages += 1
+
+        if self.buffered >= self.buffer_bytes:
+            self.write()
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """
+        write out buffered lines once flush_seconds have passed, and close the segment once it is due
+        for rotation. the next message opens a new one.
+        """
+        if self.file is None:
+            return
+
+        now = time.monotonic()
+        if now - self.opened_at >= self.segment_seconds or self.segment_written >= self.segment_bytes:
+            self.close()
+        elif self.unflushed and now - self.flushed_at >= self.flush_seconds:
+            self.write()
+            self.file.flush()
+            self.flushed_at = now
+            self.unflushed = False
+
+    def write(self):
+        if self.buffer:
+            self.file.write(''.join(self.buffer).encode('utf-8'))
+            self.buffer = list()
+            self.buffered = 0
+
+    def close(self):
+        if self.file is not None:
+            self.write()
+            self.file.close()
+            self.file = None
+            self.unflushed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def segments(path):
+    """
+    :param path: directory written by FeedRecorder
+    :return: dict of prefix -> segment paths in the order they were written
+    """
+    by_prefix = dict()
+    for segment_path in sorted(glob.glob(os.path.join(path, '*' + SUFFIX))):
+        prefix = os.path.basename(segment_path).rsplit('-', 1)[0]
+        by_prefix.setdefault(prefix, list()).append(segment_path)
+    return by_prefix
+
+
+def read_segment(segment_path):
+    """
+    yields (received at epoch, channel, data) from one segment.
+    a segment cut short, when the recording process died, is read up to where it ends.
+    """
+    try:
+        with gzip.open(segment_path, 'rb') as f:
+            for line in f:
+                try:
+                    yield tuple(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    logger.warning('skipping partial line in {}'.format(segment_path), extra=LOGGER_EXTRA)
+    except (EOFError, OSError, zlib.error) as e:
+        logger.warning('{} ends early: {}'.format(segment_path, e), extra=LOGGER_EXTRA)
+
+
+def read_feed(path):
+    """
+    yields (received at epoch, channel, data) of every message recorded in path, in the order received,
+    merging the segments of several ticker processes
+    """
+    streams = [
+        itertools.chain.from_iterable(read_segment(p) for p in segment_paths)
+        for segment_paths in segments(path).values()
+    ]
+    return heapq.merge(*streams, key=lambda message: message[0])
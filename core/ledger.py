@@ -1,38 +1,82 @@
 import logging
 import asyncio
+import threading
+
+import aiohttp
+
 import core.exchange
+import core.util
 
 logger = logging.getLogger(__name__)
 
 
 class LedgerManager(object):
 
-    def __init__(self, api_key, api_secret, exchange_limit=1):
+    def __init__(self, api_key, api_secret, exchange_limit=1, snapshot_path=None, connection_limit=10, ticker_ttl=10):
+        """
+        :param api_key: coinigy api key
+        :param api_secret: coinigy api secret
+        :param exchange_limit: average seconds between requests to each exchange
+        :param snapshot_path: file the coin balances are saved to and restored from, optional
+        :param connection_limit: open http connections shared by all exchanges
+        :param ticker_ttl: seconds a ticker is served from the per exchange cache
+        """
         self.api_key = api_key
         self.api_secret = api_secret
         self.exchange_limit = exchange_limit
+        self.snapshot_path = snapshot_path
+        self.connection_limit = connection_limit
+        self.ticker_ttl = ticker_ttl
 
         self.logger_extra = dict(symbol=None, exchange_id=None)
 
         self.ledger_list = dict()
+        self.exchanges = dict()
+        self.session = None
 
     async def run(self, interval):
-        while True:
-            for ledger in self.ledger_list.values():
-                ledger.tick()
-            await asyncio.sleep(interval)
+        try:
+            while True:
+                for ledger in self.ledger_list.values():
+                    ledger.tick()
+                for exchange in self.exchanges.values():
+                    logger.debug('{} ticker cache hit rate {:.1%} ({} hits, {} misses), {} requests sent'.format(
+                        exchange.exchange_id, exchange.tickers.hit_rate, exchange.tickers.hits,
+                        exchange.tickers.misses, exchange.sent
+                    ), extra=self.logger_extra)
+                self.save()
+                await asyncio.sleep(interval)
+        finally:
+            await self.close()
+
+    async def close(self):
+        for exchange in self.exchanges.values():
+            await exchange.close()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def get_exchange(self, exchange_id):
+        """
+        :return: the core.exchange.ExchangeLimiter every market on exchange_id shares
+        """
+        if exchange_id not in self.exchanges:
+            if self.session is None:
+                self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.connection_limit))
+
+            self.exchanges[exchange_id] = core.exchange.ExchangeLimiter(
+                exchange_id, self.api_key, self.api_secret, self.exchange_limit, self.session,
+                ticker_ttl=self.ticker_ttl
+            )
+        return self.exchanges[exchange_id]
 
     def get_or_create(self, symbol, exchange_id):
-        exchange = core.exchange.ExchangeLimiter(
-            symbol, exchange_id, self.api_key, self.api_secret, self.exchange_limit
-        )
-
         ledger_name = '{}-{}'.format(symbol, exchange_id)
 
         if ledger_name not in self.ledger_list:
             logger.debug('created ledger {}'.format(ledger_name), extra=dict(symbol=symbol, exchange_id=exchange_id))
             self.ledger_list.update({
-                ledger_name: Ledger(symbol, exchange_id, exchange)
+                ledger_name: Ledger(symbol, exchange_id, self.get_exchange(exchange_id))
             })
 
         ledger = self.ledger_list[ledger_name]
@@ -46,10 +90,27 @@ class LedgerManager(object):
         self.save()
 
     def load(self):
-        pass
+        if not self.snapshot_path:
+            return
+
+        state = core.util.read_snapshot(self.snapshot_path)
+        if not state:
+            return
+
+        for coin_id, supply in state['coins'].items():
+            if Coin.book.exists(coin_id):
+                Coin.book.set(coin_id, supply)
+            else:
+                Coin.book.create(coin_id, supply)
+        logger.info('restored {} coin balances'.format(len(state['coins'])), extra=self.logger_extra)
 
     def save(self):
-        pass
+        if not self.snapshot_path:
+            return
+
+        core.util.write_snapshot(self.snapshot_path, dict(
+            coins=Coin.book.supplies()
+        ))
 
 
 class Ledger(object):
@@ -82,32 +143,88 @@ class Ledger(object):
         logger.debug('ledger short added {}'.format(price), extra=self.logger_extra)
 
 
+class CoinBook(object):
+    """
+    Supply of every coin, keyed by COIN:EXCHANGE.
+    The supervisor serves its book to the worker processes (core.supervisor), so every method
+    takes and returns plain values and the book is the only place balances are kept.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.coins = dict()
+
+    def create(self, coin_id, supply):
+        with self.lock:
+            if coin_id in self.coins:
+                raise Exception('coin {} already exists'.format(coin_id))
+            self.coins[coin_id] = supply
+
+    def exists(self, coin_id):
+        return coin_id in self.coins
+
+    def get(self, coin_id):
+        return self.coins[coin_id]
+
+    def set(self, coin_id, supply):
+        with self.lock:
+            self.coins[coin_id] = supply
+
+    def adjust(self, coin_id, amount):
+        """
+        add amount to the supply of a coin, negative to remove
+
+        :return: the new supply
+        """
+        with self.lock:
+            self.coins[coin_id] += amount
+            return self.coins[coin_id]
+
+    def supplies(self):
+        with self.lock:
+            return dict(self.coins)
+
+
 class Coin(object):
+    """
+    A coin on an exchange, its supply is read from and written to Coin.book.
+    """
 
-    __coins__ = dict()
+    book = CoinBook()
 
-    def __init__(self, coin, exchange_id, supply):
+    def __init__(self, coin, exchange_id):
         self.coin = coin
         self.exchange_id = exchange_id
-        self.supply = supply
+        self.coin_id = '{}:{}'.format(coin, exchange_id)
 
         self.logger_extra = dict(symbol=self.coin, exchange_id=self.exchange_id)
 
-        logger.info('coin initialied at {}'.format(self.supply), extra=self.logger_extra)
+    @property
+    def supply(self):
+        return Coin.book.get(self.coin_id)
+
+    @supply.setter
+    def supply(self, supply):
+        Coin.book.set(self.coin_id, supply)
 
     @staticmethod
-    def create(coin, exchange_id, supply):
-        coin_id = '{}:{}'.format(coin, exchange_id)
-        if coin_id in Coin.__coins__:
-            raise Exception('coin {} already exists'.format(coin_id))
+    def use(book):
+        """
+        keep balances in book from now on, e.g. a proxy to the supervisor book in a worker process
+        """
+        Coin.book = book
 
-        Coin.__coins__.update({
-            coin_id: Coin(coin, exchange_id, supply)
-        })
+    @staticmethod
+    def create(coin, exchange_id, supply):
+        coin = Coin(coin, exchange_id)
+        Coin.book.create(coin.coin_id, supply)
 
-        return Coin.__coins__[coin_id]
+        logger.info('coin initialied at {}'.format(supply), extra=coin.logger_extra)
+        return coin
 
     @staticmethod
     def get(coin, exchange_id):
-        coin_id = '{}:{}'.format(coin, exchange_id)
-        return Coin.__coins__[coin_id]
+        coin = Coin(coin, exchange_id)
+        if not Coin.book.exists(coin.coin_id):
+            raise KeyError(coin.coin_id)
+        return coin
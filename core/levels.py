@@ -0,0 +1,191 @@
+import math
+import logging
+import collections
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def pivots(values, window):
+    """
+    indexes of the swing highs in values: higher than the window values before it,
+    and at least as high as the window values after it. pass -lows for swing lows.
+
+    :param values: numpy array
+    :param window: candles on each side
+    :return: numpy array of indexes
+    """
+    n = len(values)
+    if n < 2 * window + 1:
+        return np.empty(0, dtype=np.int64)
+
+    center = values[window:n - window]
+    mask = np.ones(len(center), dtype=bool)
+    for k in range(1, window + 1):
+        mask &= center > values[window - k:n - window - k]
+        mask &= center >= values[window + k:n - window + k]
+    return np.flatnonzero(mask) + window
+
+
+class LevelGenerator(object):
+    """
+    Support and resistance levels from the candle history.
+
+    Swing highs and lows (pivots) are counted in price bins tolerance wide, a bin touched
+    at least min_touches times, and more often than the bins next to it, becomes a level at
+    the middle of the bin. Pivots are confirmed window candles after they happen, so update()
+    only has to look at the latest 2 * window + 1 candles on each close.
+    """
+
+    def __init__(self, symbol, exchange_id, window=5, tolerance=0.005, min_touches=2, max_levels=20,
+                 lookback=10000):
+        """
+        :param symbol: COIN/BASE symbol for the market.
+        :param exchange_id: coinigy exchange id
+        :param window: candles on each side of a pivot
+        :param tolerance: width of a price bin, relative to price
+        :param min_touches: pivots needed for a level
+        :param max_levels: keep the levels with the most touches
+        :param lookback: candles a pivot counts for
+        """
+        self.logger_extra = dict(symbol=symbol, exchange_id=exchange_id, candle_time=None)
+        self.window = window
+        self.tolerance = tolerance
+        self.min_touches = min_touches
+        self.max_levels = max_levels
+        self.lookback = lookback
+        self.log_step = math.log1p(tolerance)
+
+        # candles seen so far, pivots are (candle number, price) oldest first
+        self.count = 0
+        self.pivots = collections.deque()
+        self.touches = collections.Counter()
+        self.levels = list()
+
+    def fit(self, highs, lows):
+        """
+        find the levels of a whole candle history at once, replacing any pivots seen so far
+
+        :param highs: numpy array of candle highs, oldest first
+        :param lows: numpy array of candle lows, oldest first
+        :return: levels, highest first
+        """
+        high_pivots = pivots(highs, self.window)
+        low_pivots = pivots(-lows, self.window)
+        found = np.concatenate((high_pivots, low_pivots))
+        prices = np.concatenate((highs[high_pivots], lows[low_pivots]))
+
+        # same order update() would have added them in
+        order = np.argsort(found, kind='stable')
+        found, prices = found[order], prices[order]
+
+        self.count = len(highs)
+        recent = found >= self.count - self.lookback
+        found, prices = found[recent], prices[recent]
+
+        self.pivots = collections.deque(zip(found.tolist(), prices.tolist()))
+        bins, touches = np.unique(self.bins(prices), return_counts=True)
+        self.touches = collections.Counter(dict(zip(bins.tolist(), touches.tolist())))
+        self.levels = self.find_levels(bins, touches)
+        return self.levels
+
+    def update(self, candles):
+        """
+        call once for every closed candle
+
+        :param candles: core.candle.CandleStore, ending with the closed candle
+        :return: the new levels, or None if they did not change
+        """
+        self.count += 1
+        changed = self._prune()
+
+        span = 2 * self.window + 1
+        if len(candles) >= span:
+            # the candle window candles back now has enough candles after it to be confirmed
+            # plain floats, numpy calls cost more than they save on a few values
+            number = self.count - 1 - self.window
+            highs = candles.column('high')[-span:].tolist()
+            lows = candles.column('low')[-span:].tolist()
+            high, low = highs[self.window], lows[self.window]
+
+            if high > max(highs[:self.window]) and high >= max(highs[self.window + 1:]):
+                self.add_pivot(number, high)
+                changed = True
+            if low < min(lows[:self.window]) and low <= min(lows[self.window + 1:]):
+                self.add_pivot(number, low)
+                changed = True
+
+        if not changed:
+            return None
+
+        bins = np.array(sorted(self.touches), dtype=np.int64)
+        levels = self.find_levels(bins, np.array([self.touches[b] for b in bins.tolist()], dtype=np.int64))
+        if levels == self.levels:
+            return None
+
+        self.levels = levels
+        logger.debug('levels: {}'.format(levels), extra=self.logger_extra)
+        return levels
+
+    def bins(self, prices):
+        """
+        :param prices: numpy array of prices
+        :return: numpy array of price bins
+        """
+        return np.floor(np.log(prices) / self.log_step).astype(np.int64)
+
+    def bin(self, price):
+        return int(math.floor(math.log(price) / self.log_step))
+
+    def add_pivot(self, number, price):
+        self.pivots.append((number, price))
+        self.touches[self.bin(price)] += 1
+
+    def find_levels(self, bins, touches):
+        """
+        :param bins: numpy array of price bins, ascending
+        :param touches: numpy array of pivots in each bin
+        :return: levels, highest first
+        """
+        if not len(bins):
+            return list()
+
+        # touches of the bins either side, zero where the next bin is empty
+        below = np.zeros_like(touches)
+        above = np.zeros_like(touches)
+        adjacent = np.diff(bins) == 1
+        below[1:] = np.where(adjacent, touches[:-1], 0)
+        above[:-1] = np.where(adjacent, touches[1:], 0)
+
+        peaks = (touches >= self.min_touches) & (touches >= below) & (touches > above)
+        bins, touches = bins[peaks], touches[peaks]
+        if len(bins) > self.max_levels:
+            bins = np.sort(bins[np.argsort(-touches, kind='stable')[:self.max_levels]])
+
+        levels = np.exp((bins + 0.5) * self.log_step)
+        return levels[::-1].tolist()
+
+    def _prune(self):
+        """
+        :return: True if pivots older than lookback were dropped
+        """
+        oldest = self.count - self.lookback
+        pruned = False
+        while self.pivots and self.pivots[0][0] < oldest:
+            _, price = self.pivots.popleft()
+            b = self.bin(price)
+            self.touches[b] -= 1
+            if not self.touches[b]:
+                del self.touches[b]
+            pruned = True
+        return pruned
+
+    def get_state(self):
+        return dict(count=self.count, pivots=list(self.pivots), levels=self.levels)
+
+    def set_state(self, state):
+        self.count = state['count']
+        self.pivots = collections.deque(state['pivots'])
+        self.touches = collections.Counter(self.bin(price) for _, price in self.pivots)
+        self.levels = state['levels']
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+
+from core.database import trades_channel
+
+logger = logging.getLogger(__name__)
+
+
+class TradeListener(object):
+    """
+    Wakes engines when trades of their market are stored, from the notifications core.database.TradeWriter
+    sends with every write. A single connection in LISTEN mode serves all the engines of a process,
+    and is read from the event loop whenever the socket has data.
+    """
+
+    def __init__(self, db_session, reconnect_seconds=5):
+        """
+        :param db_session: a session to the backend database, the listener opens a connection of its own
+        :param reconnect_seconds: wait between connection attempts
+        """
+        self.engine = db_session.bind
+        self.reconnect_seconds = reconnect_seconds
+        self.logger_extra = dict(symbol=None, exchange_id=None)
+
+        self.connection = None
+        self.listening = False
+
+        # channel -> asyncio.Event set on each notification
+        self.events = dict()
+        self.notifications = 0
+
+    def listen(self, symbol, exchange_id):
+        """
+        :return: asyncio.Event set whenever trades of the market are stored, and while the listener
+        is not connected. the caller clears it before reading the trades.
+        """
+        channel = trades_channel(symbol, exchange_id)
+        event = self.events.get(channel)
+        if event is None:
+            event = self.events[channel] = asyncio.Event()
+            if self.listening:
+                self._listen([channel])
+        return event
+
+    async def run(self):
+        """
+        stay connected until cancelled
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                self.connection = await loop.run_in_executor(None, self._connect)
+                self._listen(self.events)
+            except Exception as e:
+                logger.error('listener connection error: {}'.format(e), extra=self.logger_extra)
+                self._close()
+                await asyncio.sleep(self.reconnect_seconds)
+                continue
+
+            lost = loop.create_future()
+            fileno = self.connection.fileno()
+            loop.add_reader(fileno, self._read, lost)
+            self.listening = True
+            logger.info('listening for trades of {} markets'.format(len(self.events)), extra=self.logger_extra)
+
+            # trades stored while not listening were never notified
+            self._wake()
+            try:
+                await lost
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error('listener connection lost: {}'.format(e), extra=self.logger_extra)
+            finally:
+                self.listening = False
+                loop.remove_reader(fileno)
+                self._close()
+
+                # back to polling until connected again
+                self._wake()
+
+            await asyncio.sleep(self.reconnect_seconds)
+
+    def _connect(self):
+        # taken out of the pool, it is never returned with the LISTENs still active
+        connection = self.engine.raw_connection()
+        connection.detach()
+        connection = connection.connection
+        connection.autocommit = True
+        return connection
+
+    def _listen(self, channels):
+        with self.connection.cursor() as cursor:
+            for channel in channels:
+                cursor.execute('LISTEN "{}"'.format(channel.replace('"', '""')))
+
+    def _read(self, lost):
+        try:
+            self.connection.poll()
+        except Exception as e:
+            if not lost.done():
+                lost.set_exception(e)
+            return
+
+        for notification in self.connection.notifies:
+            event = self.events.get(notification.channel)
+            if event is not None:
+                event.set()
+        self.notifications += len(self.connection.notifies)
+        del self.connection.notifies[:]
+
+    def _wake(self):
+        for event in self.events.values():
+            event.set()
+
+    def _close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
@@ -1,4 +1,6 @@
+import heapq
 import logging
+import itertools
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +31,22 @@ class ScheduleManager(object):
         self.allocations = dict()
         self.distributions = dict()
 
+        # ticks so far, schedule counters are derived from it
+        self.ticks = 0
+        self.sequence = itertools.count()
+
+        # (start_price, sequence, allocation) and (-start_price, sequence, distribution) heaps,
+        # the schedules nearest to being cancelled on top. removed schedules are skipped when popped.
+        self.allocation_starts = list()
+        self.distribution_starts = list()
+
+        # (tick, kind, sequence, schedule) heap of the next execution of each schedule,
+        # kind 0 for allocations and 1 for distributions keeps the order of the tick loop
+        self.due = list()
+
+        # schedules that executed their last position, removed on the next tick
+        self.finished = list()
+
     def calculate_profit_position(self):
         positions = self.distribution_positions + self.allocation_positions
         if len(positions):
@@ -60,17 +78,15 @@ class ScheduleManager(object):
         if not self.profit_position or curr_price < self.profit_position:
             self.update_allocation_position_count()
             if trend_price not in self.allocations:
-                self.allocations.update({
-                    trend_price: Allocation(
-                        self.symbol,
-                        self.exchange_id,
-                        self.trade,
-                        trend_price,
-                        curr_price,
-                        self.allocation_position_count,
-                        self.frequency
-                    )
-                })
+                self.add(Allocation(
+                    self.symbol,
+                    self.exchange_id,
+                    self.trade,
+                    trend_price,
+                    curr_price,
+                    self.allocation_position_count,
+                    self.frequency
+                ))
                 logger.debug(
                     'created allocation schedule: Price: {}, '
                     'Trend: {}, Pos Count: {}'.format(
@@ -85,17 +101,15 @@ class ScheduleManager(object):
         if not self.profit_position or curr_price > self.profit_position:
             self.update_distribution_position_count()
             if trend_price not in self.distributions:
-                self.distributions.update({
-                    trend_price: Distribution(
-                        self.symbol,
-                        self.exchange_id,
-                        self.trade,
-                        trend_price,
-                        curr_price,
-                        self.distribution_position_count,
-                        self.frequency
-                    )
-                })
+                self.add(Distribution(
+                    self.symbol,
+                    self.exchange_id,
+                    self.trade,
+                    trend_price,
+                    curr_price,
+                    self.distribution_position_count,
+                    self.frequency
+                ))
                 logger.debug(
                     'created distribution schedule: Price: {}, '
                     'Trend: {}, Pos Count: {}'.format(
@@ -106,28 +120,121 @@ class ScheduleManager(object):
             logger.debug('not distributing as price is below profit: {} <= {}'.format(curr_price, self.profit_position),
                          extra=self.logger_extra)
 
+    def add(self, schedule, counter=0):
+        """
+        :param schedule: new Allocation or Distribution
+        :param counter: ticks the schedule has already run for
+        """
+        sequence = next(self.sequence)
+        schedule.started = self.ticks - counter
+
+        if isinstance(schedule, Allocation):
+            kind = 0
+            self.allocations[schedule.trend_price] = schedule
+            heapq.heappush(self.allocation_starts, (schedule.start_price, sequence, schedule))
+        else:
+            kind = 1
+            self.distributions[schedule.trend_price] = schedule
+            heapq.heappush(self.distribution_starts, (-schedule.start_price, sequence, schedule))
+
+        if schedule.positions_executed >= schedule.position_count:
+            self.finished.append(schedule)
+        else:
+            due = self.ticks + schedule.frequency - counter % schedule.frequency
+            heapq.heappush(self.due, (due, kind, sequence, schedule))
+
+    def live(self, schedule):
+        schedules = self.allocations if isinstance(schedule, Allocation) else self.distributions
+        return schedules.get(schedule.trend_price) is schedule
+
+    def remove(self, schedule):
+        schedules = self.allocations if isinstance(schedule, Allocation) else self.distributions
+        schedules.pop(schedule.trend_price)
+
+    def get_state(self):
+        return dict(
+            allocation_positions=list(self.allocation_positions),
+            distribution_positions=list(self.distribution_positions),
+            allocation_position_count=self.allocation_position_count,
+            distribution_position_count=self.distribution_position_count,
+            profit_position=self.profit_position,
+            allocations=[a.get_state(self.ticks) for a in self.allocations.values()],
+            distributions=[d.get_state(self.ticks) for d in self.distributions.values()]
+        )
+
+    def set_state(self, state):
+        self.allocation_positions = list(state['allocation_positions'])
+        self.distribution_positions = list(state['distribution_positions'])
+        self.allocation_position_count = state['allocation_position_count']
+        self.distribution_position_count = state['distribution_position_count']
+        self.profit_position = state['profit_position']
+
+        self.allocations = dict()
+        self.distributions = dict()
+        self.allocation_starts = list()
+        self.distribution_starts = list()
+        self.due = list()
+        self.finished = list()
+
+        for a in state['allocations']:
+            allocation, counter = Allocation.from_state(self.symbol, self.exchange_id, self.trade, a)
+            self.add(allocation, counter)
+
+        for d in state['distributions']:
+            distribution, counter = Distribution.from_state(self.symbol, self.exchange_id, self.trade, d)
+            self.add(distribution, counter)
+
     def tick(self, price, latest_candle_time):
+        """
+        Cancels allocations started below price and distributions started above it, removes the
+        schedules that finished on the last tick, and executes the schedules due on this tick.
+        Only the schedules affected are touched, the outcome and order of executions are
+        the same as ticking every schedule in turn.
+        """
         self.logger_extra.update(dict(candle_time=latest_candle_time))
+        self.ticks += 1
 
-        for allocation in list(self.allocations.values()):
-            if price > allocation.start_price:
+        while self.allocation_starts and self.allocation_starts[0][0] < price:
+            _, _, allocation = heapq.heappop(self.allocation_starts)
+            if self.live(allocation):
                 allocation.cancel()
-                self.allocations.pop(allocation.trend_price)
-            elif allocation.positions_executed >= allocation.position_count:
-                allocation.done()
-                self.allocations.pop(allocation.trend_price)
-            else:
-                allocation.tick(price, latest_candle_time)
+                self.remove(allocation)
 
-        for distribution in list(self.distributions.values()):
-            if price < distribution.start_price:
+        while self.distribution_starts and -self.distribution_starts[0][0] > price:
+            _, _, distribution = heapq.heappop(self.distribution_starts)
+            if self.live(distribution):
                 distribution.cancel()
-                self.distributions.pop(distribution.trend_price)
-            elif distribution.positions_executed >= distribution.position_count:
-                distribution.done()
-                self.distributions.pop(distribution.trend_price)
+                self.remove(distribution)
+
+        for schedule in self.finished:
+            if self.live(schedule):
+                schedule.done()
+                self.remove(schedule)
+        self.finished = list()
+
+        due = list()
+        while self.due and self.due[0][0] <= self.ticks:
+            entry = heapq.heappop(self.due)
+            if self.live(entry[3]):
+                due.append(entry)
+
+        # every schedule used to tick the trade after its own execution, the trade only changes on the
+        # first of those, right after the first schedule in the tick order
+        first = next(iter(self.allocations.values()), None) or next(iter(self.distributions.values()), None)
+        if first is not None and not (due and due[0][3] is first):
+            self.trade.tick(price, latest_candle_time)
+
+        for _, kind, sequence, schedule in due:
+            schedule.execute_next(price, latest_candle_time)
+            if schedule is first:
+                self.trade.tick(price, latest_candle_time)
+
+            if schedule.positions_executed >= schedule.position_count:
+                self.finished.append(schedule)
             else:
-                distribution.tick(price, latest_candle_time)
+                heapq.heappush(self.due, (self.ticks + schedule.frequency, kind, sequence, schedule))
+
+        self._compact()
 
         if len(self.allocations) or len(self.distributions):
             logger.info('Allocation Schedules: {}, Distribution Schedules: {}, Profit Pos: {}'.format(
@@ -136,8 +243,25 @@ class ScheduleManager(object):
 
         self.calculate_profit_position()
 
+    def _compact(self):
+        """
+        drop removed schedules from the heaps once they make up most of them
+        """
+        live = len(self.allocations) + len(self.distributions)
+        if len(self.allocation_starts) + len(self.distribution_starts) + len(self.due) <= 4 * live + 64:
+            return
+
+        self.allocation_starts = [e for e in self.allocation_starts if self.live(e[2])]
+        self.distribution_starts = [e for e in self.distribution_starts if self.live(e[2])]
+        self.due = [e for e in self.due if self.live(e[3])]
+        heapq.heapify(self.allocation_starts)
+        heapq.heapify(self.distribution_starts)
+        heapq.heapify(self.due)
+
 
 class Schedule(object):
+    __slots__ = ('symbol', 'exchange_id', 'candle_time', 'trade', 'trend_price', 'start_price', 'position_count',
+                 'frequency', 'started', 'positions_executed')
 
     def __init__(self, symbol, exchange_id, trade, trend_price, curr_price, position_count, frequency):
         """
@@ -150,7 +274,7 @@ class Schedule(object):
         """
         self.symbol = symbol
         self.exchange_id = exchange_id
-        self.logger_extra = dict(symbol=self.symbol, exchange_id=self.exchange_id, candle_time=None)
+        self.candle_time = None
 
         self.trade = trade
         self.trend_price = trend_price
@@ -158,9 +282,31 @@ class Schedule(object):
         self.position_count = position_count
         self.frequency = frequency
 
-        self.counter = 0
+        # ScheduleManager tick the schedule was created at, the schedule counts the ticks since
+        self.started = 0
         self.positions_executed = 0
 
+    @property
+    def logger_extra(self):
+        return dict(symbol=self.symbol, exchange_id=self.exchange_id, candle_time=self.candle_time)
+
+    def get_state(self, ticks):
+        """
+        :param ticks: ScheduleManager ticks so far
+        """
+        return (self.trend_price, self.start_price, self.position_count, self.frequency,
+                ticks - self.started, self.positions_executed)
+
+    @classmethod
+    def from_state(cls, symbol, exchange_id, trade, state):
+        """
+        :return: the schedule, and the ticks it has run for
+        """
+        trend_price, start_price, position_count, frequency, counter, positions_executed = state
+        schedule = cls(symbol, exchange_id, trade, trend_price, start_price, position_count, frequency)
+        schedule.positions_executed = positions_executed
+        return schedule, counter
+
     def cancel(self):
         logger.debug('cancelling {}-{} {}/{} from trend: {}'.format(
             self, self.start_price, self.positions_executed, self.position_count,
@@ -173,25 +319,26 @@ class Schedule(object):
             self.trend_price
         ), extra=self.logger_extra)
 
-    def tick(self, price, latest_candle_time):
-        self.logger_extra.update(dict(candle_time=latest_candle_time))
+    def execute_next(self, price, latest_candle_time):
+        """
+        execute the next position, called by ScheduleManager every frequency ticks
+        """
+        self.candle_time = latest_candle_time
 
-        self.counter += 1
-        if self.counter % self.frequency == 0:
-            self.positions_executed += 1
+        self.positions_executed += 1
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug('executing {}-{} {}/{} at price: {}, trend: {}'.format(
                 self, self.start_price, self.positions_executed, self.position_count,
                 price, self.trend_price
             ), extra=self.logger_extra)
-            self.execute(price)
-
-        self.trade.tick(price, latest_candle_time)
+        self.execute(price)
 
     def execute(self, price):
         raise NotImplementedError()
 
 
 class Allocation(Schedule):
+    __slots__ = ()
 
     def execute(self, price):
         self.trade.long(price)
@@ -201,6 +348,7 @@ class Allocation(Schedule):
 
 
 class Distribution(Schedule):
+    __slots__ = ()
 
     def execute(self, price):
         self.trade.short(price)
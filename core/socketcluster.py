@@ -0,0 +1,155 @@
+import json
+import asyncio
+import logging
+import itertools
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class SocketClusterError(Exception):
+    pass
+
+
+class SocketClusterClient(object):
+    """
+    The part of the SocketCluster protocol the coinigy websocket api needs: handshake,
+    emit with acknowledgement, channel subscriptions and publishes, and ping replies.
+    Reconnects with a backoff, authenticating and subscribing again each time.
+    """
+
+    def __init__(self, url, session, name='socketcluster', on_connect=None, reconnect_seconds=(1, 30)):
+        """
+        :param url: websocket url of the cluster
+        :param session: aiohttp.ClientSession the connection is opened with
+        :param name: connection name for the logs
+        :param on_connect: coroutine function called with the client after every handshake, optional
+        :param reconnect_seconds: first and longest wait between connection attempts
+        """
+        self.url = url
+        self.session = session
+        self.name = name
+        self.on_connect = on_connect
+        self.reconnect_seconds = reconnect_seconds
+        self.logger_extra = dict(symbol=None, exchange_id=None)
+
+        self.ws = None
+        self.cid = itertools.count(1)
+        self.acks = dict()
+        self.auth_token = None
+
+        # channel -> callback(channel, data)
+        self.channels = dict()
+        self.connected = asyncio.Event()
+        self.connects = 0
+
+        # messages that could not be decoded or handled
+        self.errors = 0
+
+    async def subscribe(self, channel, callback):
+        """
+        subscribe now if connected, otherwise on connecting
+
+        :param callback: called with (channel, data) for every message published on channel
+        """
+        self.channels[channel] = callback
+        if self.connected.is_set():
+            await self.emit('#subscribe', dict(channel=channel))
+
+    async def emit(self, event, data, timeout=10):
+        """
+        :return: the data of the acknowledgement
+        :raises SocketClusterError: if the server acknowledges with an error
+        """
+        cid = next(self.cid)
+        future = asyncio.get_event_loop().create_future()
+        self.acks[cid] = future
+        try:
+            await self.ws.send_str(json.dumps(dict(event=event, data=data, cid=cid)))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.acks.pop(cid, None)
+
+    async def run(self):
+        """
+        stay connected until cancelled
+        """
+        wait = self.reconnect_seconds[0]
+        while True:
+            try:
+                await self._connect()
+                wait = self.reconnect_seconds[0]
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error('{} connection error: {}'.format(self.name, e), extra=self.logger_extra)
+
+            self.connected.clear()
+            logger.info('{} reconnecting in {}s'.format(self.name, wait), extra=self.logger_extra)
+            await asyncio.sleep(wait)
+            wait = min(wait * 2, self.reconnect_seconds[1])
+
+    async def _connect(self):
+        async with self.session.ws_connect(self.url, autoping=True, max_msg_size=0) as ws:
+            self.ws = ws
+            reader = asyncio.ensure_future(self._read())
+            try:
+                await self.emit('#handshake', dict(authToken=self.auth_token))
+                self.connects += 1
+                logger.info('{} connected to {}'.format(self.name, self.url), extra=self.logger_extra)
+
+                if self.on_connect:
+                    await self.on_connect(self)
+                await asyncio.gather(*[self.emit('#subscribe', dict(channel=c)) for c in self.channels])
+                self.connected.set()
+
+                await reader
+            finally:
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+                for future in self.acks.values():
+                    if not future.done():
+                        future.set_exception(SocketClusterError('{} disconnected'.format(self.name)))
+                self.ws = None
+
+    async def _read(self):
+        async for msg in self.ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                if msg.type == aiohttp.WSMsgType.ERROR:
+                    raise SocketClusterError('{} websocket error: {}'.format(self.name, self.ws.exception()))
+                continue
+
+            if msg.data == '#1':
+                await self.ws.send_str('#2')
+                continue
+
+            try:
+                self.handle(json.loads(msg.data))
+            except Exception:
+                # skip it, closing the connection would resubscribe every channel on it
+                self.errors += 1
+                logger.exception('{} could not handle message: {:.200}'.format(self.name, msg.data),
+                                 extra=self.logger_extra)
+
+    def handle(self, message):
+        event = message.get('event')
+        if event == '#publish':
+            data = message['data']
+            callback = self.channels.get(data['channel'])
+            if callback:
+                callback(data['channel'], data['data'])
+
+        elif 'rid' in message:
+            future = self.acks.get(message['rid'])
+            if future is not None and not future.done():
+                if message.get('error'):
+                    future.set_exception(SocketClusterError(message['error']))
+                else:
+                    future.set_result(message.get('data'))
+
+        elif event == '#setAuthToken':
+            self.auth_token = message['data']['token']
+
+        elif event == '#removeAuthToken':
+            self.auth_token = None
@@ -0,0 +1,208 @@
+import os
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+import multiprocessing
+from multiprocessing.managers import BaseManager
+
+from core.ledger import Coin
+
+logger = logging.getLogger(__name__)
+
+
+class BookManager(BaseManager):
+    """serves the supervisor core.ledger.CoinBook to the worker processes"""
+    pass
+
+
+BookManager.register('book', callable=lambda: Coin.book)
+
+
+def connect_book(address, authkey):
+    """
+    :return: proxy to the supervisor coin book, to be passed to core.ledger.Coin.use
+    """
+    manager = BookManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.book()
+
+
+def forward_logs(log_queue):
+    """
+    send every log record of this process to the supervisor instead of the handlers from logging.conf,
+    logger levels are kept so records are still filtered in the worker
+    """
+    loggers = [logging.getLogger()] + [
+        logging.getLogger(name) for name in list(logging.Logger.manager.loggerDict)
+    ]
+    for log in loggers:
+        for handler in list(log.handlers):
+            log.removeHandler(handler)
+            handler.close()
+        log.propagate = True
+
+    logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+class Worker(object):
+
+    def __init__(self, index, symbols):
+        self.index = index
+        self.symbols = symbols
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.status = None
+        self.done = False
+
+    @property
+    def name(self):
+        return 'worker-{}'.format(self.index)
+
+
+class Supervisor(object):
+    """
+    Spreads the trading symbols across worker processes, each running its own event loop and engines.
+    Workers share coin balances through the supervisor book, send their log records
+    and status here, and are restarted when they exit.
+    """
+
+    def __init__(self, target, symbols, workers, args=(), ledger_manager=None, status_interval=60,
+                 restart_seconds=5):
+        """
+        :param target: worker entry point, called as target(index, symbols, book_address, authkey,
+        log_queue, status_queue, *args) in a new process, must be importable
+        :param symbols: list of COIN/BASE symbols to trade
+        :param workers: number of worker processes
+        :param args: extra arguments for target
+        :param ledger_manager: core.ledger.LedgerManager that loads and saves the balance snapshot, optional
+        :param status_interval: seconds between status summaries
+        :param restart_seconds: least seconds between restarts of a worker
+        """
+        self.target = target
+        self.args = args
+        self.ledger_manager = ledger_manager
+        self.status_interval = status_interval
+        self.restart_seconds = restart_seconds
+        self.logger_extra = dict(symbol=None, exchange_id=None)
+
+        # round robin, so markets configured next to each other end up in different processes
+        self.workers = [Worker(i, symbols[i::workers]) for i in range(min(workers, len(symbols)))]
+
+        self.context = multiprocessing.get_context('spawn')
+        self.log_queue = self.context.Queue()
+        self.status_queue = self.context.Queue()
+        self.authkey = os.urandom(16)
+        self.address = None
+
+    def run(self):
+        if self.ledger_manager:
+            self.ledger_manager.load()
+
+        server = BookManager(address=('127.0.0.1', 0), authkey=self.authkey).get_server()
+        self.address = server.address
+        threading.Thread(target=server.serve_forever, name='coin-book', daemon=True).start()
+
+        log_thread = threading.Thread(target=self._forward_logs, name='worker-logs', daemon=True)
+        log_thread.start()
+
+        try:
+            for worker in self.workers:
+                self.start(worker)
+            self._supervise()
+        finally:
+            self.stop()
+            self.log_queue.put(None)
+            log_thread.join()
+            if self.ledger_manager:
+                self.ledger_manager.save()
+
+    def start(self, worker):
+        worker.process = self.context.Process(
+            target=self.target,
+            name=worker.name,
+            args=(worker.index, worker.symbols, self.address, self.authkey,
+                  self.log_queue, self.status_queue) + tuple(self.args)
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        logger.info('{} started, pid {}, symbols {}'.format(
+            worker.name, worker.process.pid, ', '.join(worker.symbols)
+        ), extra=self.logger_extra)
+
+    def stop(self, timeout=30):
+        """
+        workers get the same SIGINT as the supervisor on ctrl-c and save their snapshots,
+        terminate anything still running after timeout
+        """
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(max(0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logger.warning('{} did not stop, terminating'.format(worker.name), extra=self.logger_extra)
+                worker.process.terminate()
+                worker.process.join()
+
+    def _supervise(self):
+        last_status = time.monotonic()
+        while not all(worker.done for worker in self.workers):
+            self._read_status(timeout=1)
+
+            for worker in self.workers:
+                if worker.done or worker.process.is_alive():
+                    continue
+
+                if worker.process.exitcode == 0:
+                    # every engine reached its stop_at
+                    logger.info('{} finished'.format(worker.name), extra=self.logger_extra)
+                    worker.done = True
+                    continue
+
+                if time.monotonic() - worker.started_at < self.restart_seconds:
+                    continue
+
+                logger.error('{} exited with code {}, restarting'.format(worker.name, worker.process.exitcode),
+                             extra=self.logger_extra)
+                worker.restarts += 1
+                self.start(worker)
+
+            if time.monotonic() - last_status >= self.status_interval:
+                self.log_status()
+                if self.ledger_manager:
+                    self.ledger_manager.save()
+                last_status = time.monotonic()
+
+    def _read_status(self, timeout):
+        try:
+            status = self.status_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+
+        while status is not None:
+            self.workers[status['worker']].status = status
+            try:
+                status = self.status_queue.get_nowait()
+            except queue.Empty:
+                status = None
+
+    def log_status(self):
+        for worker in self.workers:
+            engines = worker.status['engines'] if worker.status else list()
+            logger.info('{} pid {} alive {} restarts {}: {}'.format(
+                worker.name, worker.process.pid, worker.process.is_alive(), worker.restarts, ', '.join(
+                    '{symbol} {state} at trade {watermark}'.format(
+                        state='backfilling' if e['backfill'] else 'monitoring', **e
+                    ) for e in engines
+                ) or 'no status yet'
+            ), extra=self.logger_extra)
+
+    def _forward_logs(self):
+        while True:
+            record = self.log_queue.get()
+            if record is None:
+                return
+            logging.getLogger(record.name).handle(record)
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import collections
+from datetime import datetime
+
+import aiohttp
+
+from core.feed import decode_trade
+from core.feedlog import FeedRecorder
+from core.socketcluster import SocketClusterClient
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelStats(object):
+    """
+    messages received on a channel, and how far behind the trade time they arrived
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.interval_messages = 0
+        self.interval_lag = 0.0
+        self.max_lag = 0.0
+
+    def add(self, lag):
+        self.messages += 1
+        self.interval_messages += 1
+        self.interval_lag += lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+    def reset(self):
+        self.interval_messages = 0
+        self.interval_lag = 0.0
+        self.max_lag = 0.0
+
+
+def api_credentials(config):
+    return {
+        'apiKey': config['coinigy']['api_key'],
+        'apiSecret': config['coinigy']['api_secret'],
+    }
+
+
+def monitored_tasks(config):
+    """
+    :return: list of dict(exchange, symbol) of the symbols with monitor = 1
+    """
+    tasks = list()
+    for symbol, options in config['symbols'].items():
+        if options['monitor'] == '1':
+            tasks.append(dict(
+                exchange=options['exchange'],
+                symbol=symbol
+            ))
+    return tasks
+
+
+def feed_recorder(config, prefix='feed'):
+    """
+    :param prefix: segment name prefix, unique to the ticker process
+    :return: FeedRecorder logging to the [ticker] record_path, None if not recording
+    """
+    if not config['ticker']['record_path']:
+        return None
+
+    return FeedRecorder(
+        config['ticker']['record_path'],
+        prefix=prefix,
+        segment_seconds=float(config['ticker']['record_segment_seconds']),
+        segment_bytes=int(float(config['ticker']['record_segment_mb']) * 1024 * 1024)
+    )
+
+
+def shard_tasks(tasks, shard, shards):
+    """
+    the tasks one of several ticker processes subscribes to, every process has to be given
+    the same tasks to agree on the split
+
+    :param shard: index of this process, 0 to shards - 1
+    :param shards: number of ticker processes
+    """
+    return sorted(tasks, key=lambda t: (t['exchange'], t['symbol']))[shard::shards]
+
+
+class Ticker(object):
+
+    def __init__(self, tasks, writer, api_credentials, url, connections=1, stats_seconds=60, bus=None,
+                 recorder=None):
+        """
+        :param tasks: list of dict(exchange, symbol) to subscribe to
+        :param writer: core.database.TradeWriter that persists received trades
+        :param api_credentials: coinigy apiKey/apiSecret
+        :param url: websocket url of the coinigy socketcluster
+        :param connections: websocket connections the channels are spread over
+        :param stats_seconds: seconds between channel rate and lag reports
+        :param bus: core.bus.TradeBus received trades are published on, before they are persisted, optional
+        :param recorder: core.feedlog.FeedRecorder the messages are logged to as received, optional
+        """
+        self.tasks = tasks
+        self.writer = writer
+        self.api_credentials = api_credentials
+        self.url = url
+        self.connections = connections
+        self.stats_seconds = stats_seconds
+        self.bus = bus
+        self.recorder = recorder
+        self.logger_extra = dict(symbol=None, exchange_id=None)
+
+        self.stats = collections.defaultdict(ChannelStats)
+
+    @staticmethod
+    def trade_channel(task):
+        coin, base = task['symbol'].split('/')
+        return 'TRADE-{exchange}--{coin}--{base}'.format(exchange=task['exchange'], coin=coin, base=base)
+
+    async def run(self):
+        channels = [self.trade_channel(task) for task in self.tasks]
+
+        async with aiohttp.ClientSession() as session:
+            clients = [
+                SocketClusterClient(self.url, session, name='ticker-{}'.format(i), on_connect=self.authenticate)
+                for i in range(max(1, min(self.connections, len(channels))))
+            ]
+            for i, channel in enumerate(channels):
+                await clients[i % len(clients)].subscribe(channel, self.update_db)
+
+            tasks = [self.report()] + [client.run() for client in clients]
+            if self.recorder:
+                tasks.append(self.flush_recorder())
+            await asyncio.gather(*tasks)
+
+    async def authenticate(self, client):
+        data = await client.emit('auth', self.api_credentials)
+        logger.info('{} authenticated: {}'.format(client.name, data), extra=self.logger_extra)
+
+    def update_db(self, channel, data):
+        received_at = datetime.utcnow()
+        if self.recorder:
+            self.recorder.record(channel, data, received_at)
+
+        trade = decode_trade(data, received_at)
+        self.stats[channel].add((received_at - trade['time']).total_seconds())
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("RESULT {symbol}-{exchange} : {result}".format(
+                symbol=trade['symbol'],
+                exchange=trade['exchange'],
+                result=trade['price']
+            ), extra=self.logger_extra)
+
+        if self.bus:
+            self.bus.publish(trade)
+
+        # never wait for the database here, it would stop every connection reading and answering pings
+        self.writer.add(trade, block=False)
+
+    async def flush_recorder(self):
+        """
+        flush and rotate the feed log while no messages arrive
+        """
+        while True:
+            await asyncio.sleep(self.recorder.flush_seconds)
+            self.recorder.flush_if_due()
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.stats_seconds)
+            for channel, stats in sorted(self.stats.items()):
+                logger.info('{}: {:.1f} msg/s, lag avg {:.2f}s max {:.2f}s, {} messages'.format(
+                    channel,
+                    stats.interval_messages / self.stats_seconds,
+                    stats.interval_lag / stats.interval_messages if stats.interval_messages else 0.0,
+                    stats.max_lag,
+                    stats.messages
+                ), extra=self.logger_extra)
+                stats.reset()
+            logger.info('trades written: {}, already stored: {}, dropped with the buffer full: {}'.format(
+                self.writer.written, self.writer.duplicates, self.writer.dropped
+            ), extra=self.logger_extra)
+            if self.recorder:
+                logger.info('messages recorded: {} in {} segments'.format(
+                    self.recorder.messages, self.recorder.segments
+                ), extra=self.logger_extra)
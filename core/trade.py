@@ -90,6 +90,17 @@ class TradeManager(object):
             if self.active_trade.executed:
                 self.active_trade = None
 
+    def get_state(self):
+        return dict(active_trade=self.active_trade.get_state() if self.active_trade else None)
+
+    def set_state(self, state):
+        self.active_trade = None
+        if state['active_trade']:
+            trade_type = dict(long=Long, short=Short)[state['active_trade']['type']]
+            self.active_trade = trade_type.from_state(self.symbol, self.exchange_id, self.base, self.coin,
+                                                      state['active_trade'])
+            self.register_events(self.active_trade)
+
     def register_events(self, trade):
         trade.register('execute_long', self.schedule.event_long)
         trade.register('execute_short', self.schedule.event_short)
@@ -103,11 +114,13 @@ class TradeManager(object):
 
 
 class Trade(object):
+    __slots__ = ('symbol', 'exchange_id', 'candle_time', 'callbacks', 'type', 'base', 'coin', 'paper',
+                 'position_size', 'retrace_percent', 'executed', 'orig', 'high', 'low', 'current')
 
     def __init__(self, symbol, exchange_id, base, coin, position_size, paper, retrace_percent, price):
         self.symbol = symbol
         self.exchange_id = exchange_id
-        self.logger_extra = dict(symbol=self.symbol, exchange_id=self.exchange_id)
+        self.candle_time = None
         self.callbacks = dict()
         self.type = None
 
@@ -123,8 +136,43 @@ class Trade(object):
         self.low = price
         self.current = price
 
+    @property
+    def logger_extra(self):
+        return dict(symbol=self.symbol, exchange_id=self.exchange_id, candle_time=self.candle_time)
+
+    def get_state(self):
+        return dict(
+            type=self.type,
+            paper=self.paper,
+            position_size=self.position_size,
+            retrace_percent=self.retrace_percent,
+            executed=self.executed,
+            orig=self.orig,
+            high=self.high,
+            low=self.low,
+            current=self.current
+        )
+
+    @classmethod
+    def from_state(cls, symbol, exchange_id, base, coin, state):
+        trade = cls(
+            symbol=symbol,
+            exchange_id=exchange_id,
+            base=base,
+            coin=coin,
+            position_size=state['position_size'],
+            paper=state['paper'],
+            retrace_percent=state['retrace_percent'],
+            price=state['orig']
+        )
+        trade.executed = state['executed']
+        trade.high = state['high']
+        trade.low = state['low']
+        trade.current = state['current']
+        return trade
+
     def tick(self, price, latest_candle_time):
-        self.logger_extra.update(dict(candle_time=latest_candle_time))
+        self.candle_time = latest_candle_time
 
         if price > self.high:
             self.high = price
@@ -156,18 +204,22 @@ class Trade(object):
 
 
 class Long(Trade):
+    __slots__ = ()
 
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
         self.type = 'long'
 
     def eval_price(self):
-        logger.debug('long eval {}: Orig: {}, Low: {}, High: {}, Current: {}'.format(
-            self, self.orig, self.low, self.high, self.current
-        ), extra=self.logger_extra)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug('long eval {}: Orig: {}, Low: {}, High: {}, Current: {}'.format(
+                self, self.orig, self.low, self.high, self.current
+            ), extra=self.logger_extra)
         if self.high > self.current:
             target = self.low + (self.retrace_percent * (self.orig - self.low))
-            logger.debug('long Target: {}, Current: {}'.format(target, self.current), extra=self.logger_extra)
+            if debug:
+                logger.debug('long Target: {}, Current: {}'.format(target, self.current), extra=self.logger_extra)
             if self.current > target:
                 self.execute()
 
@@ -179,18 +231,22 @@ class Long(Trade):
 
 
 class Short(Trade):
+    __slots__ = ()
 
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
         self.type = 'short'
 
     def eval_price(self):
-        logger.debug('short eval {}: Orig: {}, Low: {}, High: {}, Current: {}'.format(
-            self, self.orig, self.low, self.high, self.current
-        ), extra=self.logger_extra)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug('short eval {}: Orig: {}, Low: {}, High: {}, Current: {}'.format(
+                self, self.orig, self.low, self.high, self.current
+            ), extra=self.logger_extra)
         if self.low < self.current:
             target = self.high - (self.retrace_percent * (self.high - self.orig))
-            logger.debug('short Target: {}, Current: {}'.format(target, self.current), extra=self.logger_extra)
+            if debug:
+                logger.debug('short Target: {}, Current: {}'.format(target, self.current), extra=self.logger_extra)
             if self.current < target:
                 self.execute()
 
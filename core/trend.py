@@ -1,3 +1,4 @@
+import bisect
 import logging
 import core.util as util
 
@@ -15,11 +16,15 @@ class TrendManager(object):
             Example: (4500, 4000, 3500)
         """
         self.logger_extra = dict(symbol=symbol, exchange_id=exchange_id, candle_time=None)
+
+        # trend prices in ascending order, for bisect
+        self.levels = list()
         self.trends = self._get_trends(trends)
 
         self.curr_price = None
         self.prev_price = None
         self.curr_trend_price = None
+        self.curr_trend_index = None
         self.upper_watch = None
         self.lower_watch = None
         self.middle_watch = None
@@ -28,14 +33,37 @@ class TrendManager(object):
 
     def _get_trends(self, trends):
         trends_percent = dict()
-        min_t, max_t = (min(trends), max(trends))
-        for t in trends:
-            trends_percent.update({t: util.percent_of_min_max_reversed(min_t, max_t, t)})
-
-        logger.debug("processed trends: {}".format(sorted(trends_percent.items(), key=lambda k: int(k[0]))),
-                     extra=self.logger_extra)
+        if trends:
+            min_t, max_t = (min(trends), max(trends))
+            for t in trends:
+                # a single trend has no range to be placed in
+                percent = util.percent_of_min_max_reversed(min_t, max_t, t) if max_t > min_t else 100.0
+                trends_percent.update({t: percent})
+
+        self.levels = sorted(trends_percent.keys())
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("processed trends: {}".format([(t, trends_percent[t]) for t in self.levels]),
+                         extra=self.logger_extra)
         return trends_percent
 
+    def set_trends(self, trends):
+        """
+        replace the trends while running, the current band is looked up again on the new trends
+
+        :param trends: list of trend prices, as for __init__
+        """
+        self.trends = self._get_trends(trends)
+        self.curr_trend_index = None
+
+        if not self.levels:
+            self.curr_trend_price = None
+            self.upper_watch = None
+            self.lower_watch = None
+            self.middle_watch = None
+        elif self.curr_trend_price is not None:
+            self._get_trend_prices(self.curr_price)
+
     def tick(self, candles, latest_candle_time):
         self.logger_extra.update(dict(candle_time=latest_candle_time))
 
@@ -52,8 +80,12 @@ class TrendManager(object):
             else:
                 self.trigger('trend_none')
 
+            if not self.levels:
+                # no trends yet, see core.levels
+                return
+
             # track our highs and lows, trigger on crossing
-            if not self.curr_trend_price:
+            if self.curr_trend_price is None:
                 self._get_trend_prices(self.curr_price)
 
             if self.curr_price >= self.upper_watch:
@@ -67,18 +99,35 @@ class TrendManager(object):
             elif self.prev_price > self.middle_watch > self.curr_price:
                 self.trigger('trend_retrace_down')
 
+    def _nearest_index(self, price):
+        """
+        index in self.levels of the trend nearest to price, the lower one on a tie
+        """
+        i = bisect.bisect_left(self.levels, price)
+        if i == len(self.levels):
+            return i - 1
+        if i > 0 and price - self.levels[i - 1] <= self.levels[i] - price:
+            return i - 1
+        return i
+
     def _get_trend_prices(self, latest_price):
         """
         identify the nearest trend to the latest price
-        also identify the trend above, and the trend below
+        also identify the trend above, and the trend below,
+        +/-inf past the highest and lowest trends so they are never crossed
         :param latest_price: the latest price
         :return:
         """
-        self.curr_trend_price = util.find_closest(latest_price, list(self.trends.keys()))
-        trends = sorted(list(self.trends.keys()), key=lambda i: float(i))
-        self.upper_watch = trends[trends.index(self.curr_trend_price) + 1]
-        self.middle_watch = trends[trends.index(self.curr_trend_price)]
-        self.lower_watch = trends[trends.index(self.curr_trend_price) - 1]
+        i = self._nearest_index(latest_price)
+        if i == self.curr_trend_index:
+            # still in the same band
+            return
+
+        self.curr_trend_index = i
+        self.curr_trend_price = self.levels[i]
+        self.upper_watch = self.levels[i + 1] if i + 1 < len(self.levels) else float('inf')
+        self.middle_watch = self.levels[i]
+        self.lower_watch = self.levels[i - 1] if i > 0 else float('-inf')
 
         logger.debug('new trend prices: Upper: {}, Lower: {}, Current: {}'.format(
             self.upper_watch,
@@ -86,6 +135,27 @@ class TrendManager(object):
             self.curr_trend_price
         ), extra=self.logger_extra)
 
+    def get_state(self):
+        return dict(
+            curr_price=self.curr_price,
+            prev_price=self.prev_price,
+            curr_trend_price=self.curr_trend_price,
+            upper_watch=self.upper_watch,
+            lower_watch=self.lower_watch,
+            middle_watch=self.middle_watch
+        )
+
+    def set_state(self, state):
+        self.curr_price = state['curr_price']
+        self.prev_price = state['prev_price']
+        self.curr_trend_price = state['curr_trend_price']
+        self.curr_trend_index = None
+        if self.curr_trend_price is not None and self.levels:
+            self.curr_trend_index = self._nearest_index(self.curr_trend_price)
+        self.upper_watch = state['upper_watch']
+        self.lower_watch = state['lower_watch']
+        self.middle_watch = state['middle_watch']
+
     def trigger(self, event):
         if event in self.callbacks:
             self.callbacks[event]()
@@ -1,15 +1,7 @@
+import os
+import pickle
+import tempfile
 import configparser
-import bisect
-
-
-def find_closest(goal, counts):
-    return min(sorted(counts, key=lambda i: float(i)), key=lambda x: abs(x - goal))
-
-
-def find_between(goal, counts, offset=0):
-    sorted_counts = sorted(counts, key=lambda i: float(i))
-    result = sorted_counts[bisect.bisect_right(sorted_counts, float(goal)) + offset]
-    return result
 
 
 def percent_of_min_max_reversed(min_val, max_val, val):
@@ -17,13 +9,71 @@ def percent_of_min_max_reversed(min_val, max_val, val):
 
 
 def get_trends_from_config(trend_config):
+    """
+    :return: list of trend prices, or 'auto' to find them in the candle history with core.levels
+    """
+    if trend_config.strip() == 'auto':
+        return 'auto'
     return list(map(lambda t: float(t), trend_config.split(',')))
 
 
+def write_snapshot(path, state):
+    """
+    atomically write state to path as a pickle, readers see either the old or the new file
+
+    :param path: file to write
+    :param state: picklable state
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_snapshot(path):
+    """
+    :param path: file written by write_snapshot
+    :return: the state, or None if there is no snapshot
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
 def config_to_dict(confparser):
     parsed_config = dict(
         symbols=dict(),
-        balances=dict()
+        balances=dict(),
+        ticker=dict(
+            flush_rows='500',
+            flush_ms='250',
+            max_rows='50000',
+            url='wss://sc-02.coinigy.com/socketcluster/',
+            connections='1',
+            stats_seconds='60',
+            notify='1',
+            record_path='',
+            record_segment_seconds='3600',
+            record_segment_mb='64'
+        ),
+        snapshot=dict(
+            path='',
+            interval_seconds='300'
+        ),
+        engine=dict(
+            query_threads='4',
+            notify='1'
+        )
     )
     for section in confparser.sections():
         if section.startswith('symbol:'):
@@ -52,13 +102,41 @@ def config_to_dict(confparser):
                 port=confparser.get(section, 'port'),
                 db_name=confparser.get(section, 'db_name'),
                 username=confparser.get(section, 'username'),
-                password=confparser.get(section, 'password')
+                password=confparser.get(section, 'password'),
+                pool_size=confparser.get(section, 'pool_size', fallback='5')
+            )
+
+        elif section == 'ticker':
+            parsed_config['ticker'] = dict(
+                flush_rows=confparser.get(section, 'flush_rows', fallback='500'),
+                flush_ms=confparser.get(section, 'flush_ms', fallback='250'),
+                max_rows=confparser.get(section, 'max_rows', fallback='50000'),
+                url=confparser.get(section, 'url', fallback='wss://sc-02.coinigy.com/socketcluster/'),
+                connections=confparser.get(section, 'connections', fallback='1'),
+                stats_seconds=confparser.get(section, 'stats_seconds', fallback='60'),
+                notify=confparser.get(section, 'notify', fallback='1'),
+                record_path=confparser.get(section, 'record_path', fallback=''),
+                record_segment_seconds=confparser.get(section, 'record_segment_seconds', fallback='3600'),
+                record_segment_mb=confparser.get(section, 'record_segment_mb', fallback='64')
+            )
+
+        elif section == 'snapshot':
+            parsed_config['snapshot'] = dict(
+                path=confparser.get(section, 'path', fallback=''),
+                interval_seconds=confparser.get(section, 'interval_seconds', fallback='300')
+            )
+
+        elif section == 'engine':
+            parsed_config['engine'] = dict(
+                query_threads=confparser.get(section, 'query_threads', fallback='4'),
+                notify=confparser.get(section, 'notify', fallback='1')
             )
 
         elif section == 'coinigy':
             parsed_config['coinigy'] = dict(
                 api_key=confparser.get(section, 'api_key'),
-                api_secret=confparser.get(section, 'api_secret')
+                api_secret=confparser.get(section, 'api_secret'),
+                ticker_ttl=confparser.get(section, 'ticker_ttl', fallback='10')
             )
 
         elif section.startswith('balance'):
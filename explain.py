@@ -0,0 +1,80 @@
+import os
+import sys
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects import postgresql
+
+import core.util as util
+from core.database import setup_db, trade_history_query, trades_after_query, last_trade_id
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+
+
+def explain(db_session, query):
+    """
+    run EXPLAIN for a query and return the plan lines
+
+    :param db_session: a session to the backend database
+    :param query: sqlalchemy query object
+    :return: list of plan lines
+    """
+    compiled = query.statement.compile(dialect=postgresql.dialect())
+    cursor = db_session.connection().connection.cursor()
+    cursor.execute('EXPLAIN {}'.format(compiled), compiled.params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def uses_index(plan):
+    return any(scan in line for line in plan for scan in INDEX_SCANS) and \
+        not any('Seq Scan on trades' in line for line in plan)
+
+
+def main():
+    """
+    :return: True if every trade query uses an index scan
+    """
+    parser = argparse.ArgumentParser(description='check that the engine trade queries use index scans')
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'trade.conf'))
+    parser.add_argument('--no-seqscan', action='store_true',
+                        help='disable sequential scans, for tables too small for the planner to pick an index')
+    args = parser.parse_args()
+
+    config = util.get_config(args.config)
+    db_session = setup_db(**config['database'])
+    db_session.execute('ANALYZE trades')
+    if args.no_seqscan:
+        db_session.execute('SET enable_seqscan = off')
+
+    now = datetime.utcnow()
+    failed = False
+    for symbol, options in config['symbols'].items():
+        queries = dict(
+            get_trade_history=trade_history_query(
+                db_session, symbol, options['exchange'], start_at=now - timedelta(days=30), stop_at=now
+            ),
+            monitor=trades_after_query(
+                db_session, symbol, options['exchange'],
+                after_id=last_trade_id(db_session, symbol, options['exchange']), limit=1000
+            ),
+        )
+
+        for name, query in queries.items():
+            plan = explain(db_session, query)
+            ok = uses_index(plan)
+            failed = failed or not ok
+            logger.info('{} {}-{}: {}\n{}'.format(
+                name, symbol, options['exchange'], 'index scan' if ok else 'NO INDEX SCAN', '\n'.join(plan)
+            ))
+
+    return not failed
+
+
+if __name__ == '__main__':
+    if not main():
+        logger.error('some trade queries do not use an index scan')
+        sys.exit(1)
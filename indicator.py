@@ -4,12 +4,16 @@ import numpy as np
 
 def gen_inputs(candles, field):
     inputs = dict()
-    inputs[field] = np.array([getattr(c, field) for c in candles])
+    if hasattr(candles, 'column'):
+        # core.candle.CandleStore, use the column directly
+        inputs[field] = candles.column(field)
+    else:
+        inputs[field] = np.array([getattr(c, field) for c in candles])
     return inputs
 
 
-def rsi(inputs, field, timeperiod=14, high=70, low=30):
-    result = talib.abstract.RSI(inputs, dtype=float, price=field, timeperiod=timeperiod)[-1]
+def rsi_signal(result, high=70, low=30):
+    """1 when oversold, -1 when overbought, otherwise 0"""
     if result:
         if result < low:
             return 1
@@ -18,6 +22,23 @@ def rsi(inputs, field, timeperiod=14, high=70, low=30):
     return 0
 
 
+def crossing_signal(prev_hist, curr_hist):
+    """1 when the histogram crosses above zero, -1 when it crosses below, otherwise 0"""
+    if prev_hist is None or curr_hist is None:
+        return 0
+
+    if prev_hist > 0 > curr_hist:
+        return -1
+    elif prev_hist < 0 < curr_hist:
+        return 1
+    return 0
+
+
+def rsi(inputs, field, timeperiod=14, high=70, low=30):
+    result = talib.abstract.RSI(inputs, dtype=float, price=field, timeperiod=timeperiod)[-1]
+    return rsi_signal(result, high, low)
+
+
 def macd_crossing(inputs, field, fastperiod=12, slowperiod=26, signalperiod=9):
     macd, macdsignal, macdhist = talib.abstract.MACD(
         inputs, price=field,
@@ -25,14 +46,7 @@ def macd_crossing(inputs, field, fastperiod=12, slowperiod=26, signalperiod=9):
     if not len(macdhist) >= 2:
         return 0
 
-    mh1 = macdhist[-1]
-    mh2 = macdhist[-2]
-
-    if mh2 > 0 > mh1:
-        return -1
-    elif mh2 < 0 < mh1:
-        return 1
-    return 0
+    return crossing_signal(macdhist[-2], macdhist[-1])
 
 
 def ema(inputs, field, timeperiod=10):
@@ -40,3 +54,134 @@ def ema(inputs, field, timeperiod=10):
         inputs, timeperiod=timeperiod, price=field
     )
     return ema_result
+
+
+class EMA(object):
+    """
+    Streaming EMA, updated with one value at a time in O(1).
+    Seeded with the simple average of the first timeperiod values, like talib.
+    """
+
+    def __init__(self, timeperiod=10):
+        self.timeperiod = timeperiod
+        self.k = 2.0 / (timeperiod + 1)
+        self.count = 0
+        self.total = 0.0
+        self.value = None
+
+    def update(self, value):
+        """
+        :param value: the newest value, e.g. the close of a candle that just closed
+        :return: the EMA, None until timeperiod values have been seen
+        """
+        if self.value is None:
+            self.count += 1
+            self.total += value
+            if self.count == self.timeperiod:
+                self.value = self.total / self.timeperiod
+        else:
+            self.value = ((value - self.value) * self.k) + self.value
+        return self.value
+
+
+class RSI(object):
+    """
+    Streaming RSI using Wilder's smoothing, updated with one value at a time in O(1).
+    Matches talib.RSI with the default (zero) unstable period.
+    """
+
+    def __init__(self, timeperiod=14):
+        self.timeperiod = timeperiod
+        self.count = 0
+        self.prev = None
+        self.gain = 0.0
+        self.loss = 0.0
+        self.value = None
+
+    def update(self, value):
+        """
+        :param value: the newest value, e.g. the close of a candle that just closed
+        :return: the RSI, None until timeperiod + 1 values have been seen
+        """
+        prev, self.prev = self.prev, value
+        if prev is None:
+            return None
+
+        change = value - prev
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+
+        self.count += 1
+        if self.count < self.timeperiod:
+            self.gain += gain
+            self.loss += loss
+            return None
+
+        if self.count == self.timeperiod:
+            self.gain = (self.gain + gain) / self.timeperiod
+            self.loss = (self.loss + loss) / self.timeperiod
+        else:
+            self.gain = ((self.gain * (self.timeperiod - 1)) + gain) / self.timeperiod
+            self.loss = ((self.loss * (self.timeperiod - 1)) + loss) / self.timeperiod
+
+        total = self.gain + self.loss
+        self.value = 100.0 * (self.gain / total) if total else 0.0
+        return self.value
+
+    def signal(self, high=70, low=30):
+        return rsi_signal(self.value, high, low)
+
+
+class MACD(object):
+    """
+    Streaming MACD, updated with one value at a time in O(1).
+    Matches talib.MACD: both EMAs start at slowperiod, the fast one seeded with
+    the average of the last fastperiod values, and the signal line seeded with
+    the average of the first signalperiod MACD values.
+    """
+
+    def __init__(self, fastperiod=12, slowperiod=26, signalperiod=9):
+        if slowperiod < fastperiod:
+            fastperiod, slowperiod = slowperiod, fastperiod
+
+        self.fast = EMA(fastperiod)
+        self.slow = EMA(slowperiod)
+        self.signal = EMA(signalperiod)
+        self.warmup = list()
+
+        self.macd = None
+        self.macdsignal = None
+        self.macdhist = None
+        self.prev_macdhist = None
+
+    def update(self, value):
+        """
+        :param value: the newest value, e.g. the close of a candle that just closed
+        :return: the MACD histogram, None until slowperiod + signalperiod - 1 values have been seen
+        """
+        if self.warmup is not None:
+            self.warmup.append(value)
+            if len(self.warmup) < self.slow.timeperiod:
+                return None
+
+            for v in self.warmup:
+                self.slow.update(v)
+            for v in self.warmup[-self.fast.timeperiod:]:
+                self.fast.update(v)
+            self.warmup = None
+        else:
+            self.slow.update(value)
+            self.fast.update(value)
+
+        self.macd = self.fast.value - self.slow.value
+        macdsignal = self.signal.update(self.macd)
+        if macdsignal is None:
+            return None
+
+        self.prev_macdhist = self.macdhist
+        self.macdsignal = macdsignal
+        self.macdhist = self.macd - macdsignal
+        return self.macdhist
+
+    def crossing(self):
+        return crossing_signal(self.prev_macdhist, self.macdhist)
@@ -1,60 +1,250 @@
 import os
+import sys
 import asyncio
+import argparse
 import logging.config
+import concurrent.futures
 from datetime import datetime
 
 import strategy
 import core.util as util
-from core.database import setup_db
+from core.database import setup_db, TradeWriter
+import core.bus
 import core.ledger
+import core.notify
+import core.ticker
+import core.supervisor
 
 
 logging.config.fileConfig('logging.conf')
 logger = logging.getLogger(__name__)
 
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'trade.conf')
 
-async def main():
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    config = util.get_config(os.path.join(dir_path, 'trade.conf'))
-    db_session = setup_db(**config['database'])
+# exit code of a worker stopped by ctrl-c, as a shell reports one killed by SIGINT
+INTERRUPTED = 130
 
-    api_key = config['coinigy']['api_key']
-    api_secret = config['coinigy']['api_secret']
 
+def trading_symbols(config):
+    return [symbol for symbol, options in config['symbols'].items() if options['trade'] == '1']
+
+
+def create_coins(config):
     print(config['balances'])
     for coin, options in config['balances'].items():
         core.ledger.Coin.create(coin, options['exchange'], options['supply'])
 
-    with core.ledger.LedgerManager(api_key, api_secret) as ledger_manager:
+
+def get_ledger_manager(config, snapshot=True):
+    """
+    :param snapshot: save and restore the coin balances, only one process should
+    """
+    ledger_snapshot = None
+    if snapshot and config['snapshot']['path']:
+        ledger_snapshot = os.path.join(config['snapshot']['path'], 'ledger.snapshot')
+
+    return core.ledger.LedgerManager(
+        config['coinigy']['api_key'], config['coinigy']['api_secret'], snapshot_path=ledger_snapshot,
+        ticker_ttl=float(config['coinigy']['ticker_ttl'])
+    )
+
+
+async def report_status(engines, on_status, interval):
+    while True:
+        on_status([dict(
+            symbol=eng.symbol,
+            exchange_id=eng.exchange_id,
+            watermark=eng.watermark,
+            backfill=eng.backfill
+        ) for eng in engines])
+        await asyncio.sleep(interval)
+
+
+async def run_engines(config, symbols, ledger_manager, on_status=None, status_interval=60, bus=None):
+    """
+    run an engine for each of symbols on this event loop
+
+    :param on_status: called with a list of engine states every status_interval seconds, optional
+    :param bus: core.bus.TradeBus the engines take new trades from, optional.
+    without one, the engines wait for notifications of new trades if [engine] notify is on
+    """
+    query_threads = int(config['engine']['query_threads'])
+
+    # a backfilling engine keeps its connection checked out between chunks. with fewer connections than
+    # engines plus query threads, every thread can end up waiting on the pool for a connection held
+    # by an engine that needs a thread to finish its backfill
+    db_session = setup_db(**dict(
+        config['database'], pool_size=max(int(config['database']['pool_size']), len(symbols) + query_threads)
+    ))
+
+    # engine queries run here so one slow market does not stall the event loop
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=query_threads, thread_name_prefix='engine-db')
+
+    with executor, ledger_manager:
         engines = list()
-        engines.append(ledger_manager.run(interval=60))
+        tasks = list()
 
-        for symbol, options in config['symbols'].items():
-            if options['trade'] == '1':
-                logger.info('start trading', extra=dict(symbol=symbol, exchange_id=options['exchange']))
-                ledger = ledger_manager.get_or_create(symbol, options['exchange'])
-                eng = strategy.StrategyA(db_session, ledger, symbol, options['exchange'], config)
+        # run for as long as the engines do
+        background = [ledger_manager.run(interval=60)]
 
-                start_at_epoch = options.get('start_at_epoch')
-                stop_at_epoch = options.get('stop_at_epoch')
+        listener = None
+        if bus is None and config['engine']['notify'] == '1':
+            listener = core.notify.TradeListener(db_session)
+            background.append(listener.run())
 
-                start_at = None
-                stop_at = None
-                if start_at_epoch:
-                    start_at = datetime.utcfromtimestamp(float(start_at_epoch))
-                if stop_at_epoch:
-                    stop_at = datetime.utcfromtimestamp(float(stop_at_epoch))
+        for symbol in symbols:
+            options = config['symbols'][symbol]
+            logger.info('start trading', extra=dict(symbol=symbol, exchange_id=options['exchange']))
+            ledger = ledger_manager.get_or_create(symbol, options['exchange'])
+            eng = strategy.StrategyA(db_session, ledger, symbol, options['exchange'], config, executor=executor,
+                                     bus=bus, listener=listener)
+            engines.append(eng)
 
-                engines.append(eng.run(
-                    interval=1,
-                    start_at=start_at,
-                    stop_at=stop_at
-                ))
+            start_at_epoch = options.get('start_at_epoch')
+            stop_at_epoch = options.get('stop_at_epoch')
 
-        await asyncio.gather(*engines)
+            start_at = None
+            stop_at = None
+            if start_at_epoch:
+                start_at = datetime.utcfromtimestamp(float(start_at_epoch))
+            if stop_at_epoch:
+                stop_at = datetime.utcfromtimestamp(float(stop_at_epoch))
 
+            tasks.append(eng.run(
+                interval=1,
+                start_at=start_at,
+                stop_at=stop_at
+            ))
 
-if __name__ == '__main__':
-    future = asyncio.ensure_future(main())
+        if on_status:
+            background.append(report_status(engines, on_status, status_interval))
+
+        await run_until_done(tasks, background)
+
+
+async def run_until_done(tasks, background):
+    """
+    run tasks and background together until every one of tasks returns, then cancel background.
+    an error in any of them cancels the rest and is raised.
+    """
+    done = asyncio.gather(*tasks)
+    background = asyncio.gather(*background)
+    try:
+        await asyncio.wait([done, background], return_when=asyncio.FIRST_COMPLETED)
+        if background.done():
+            background.result()
+        await done
+    finally:
+        done.cancel()
+        background.cancel()
+        await asyncio.gather(done, background, return_exceptions=True)
+
+
+async def main(bus=False):
+    """
+    :param bus: run the ticker in this process too, and pass its trades straight to the engines
+    """
+    config = util.get_config(CONFIG_PATH)
+    create_coins(config)
+
+    if not bus:
+        await run_engines(config, trading_symbols(config), get_ledger_manager(config))
+        return
+
+    trade_bus = core.bus.TradeBus()
+    writer = TradeWriter(
+        setup_db(**config['database']),
+        flush_rows=int(config['ticker']['flush_rows']),
+        flush_ms=int(config['ticker']['flush_ms']),
+        max_rows=int(config['ticker']['max_rows']),
+        notify=config['ticker']['notify'] == '1'
+    )
+    recorder = core.ticker.feed_recorder(config)
+    ticker = core.ticker.Ticker(
+        core.ticker.monitored_tasks(config), writer, core.ticker.api_credentials(config), config['ticker']['url'],
+        connections=int(config['ticker']['connections']),
+        stats_seconds=float(config['ticker']['stats_seconds']),
+        bus=trade_bus,
+        recorder=recorder
+    )
+
+    # persisting trades is left to the writer thread, off the path from the ticker to the engines
+    with writer:
+        try:
+            await asyncio.gather(
+                ticker.run(),
+                run_engines(config, trading_symbols(config), get_ledger_manager(config), bus=trade_bus)
+            )
+        finally:
+            if recorder:
+                recorder.close()
+
+
+def run_until_interrupted(coro):
+    """
+    :return: True if stopped by ctrl-c
+    """
+    future = asyncio.ensure_future(coro)
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(future)
+    try:
+        loop.run_until_complete(future)
+    except KeyboardInterrupt:
+        # cancel the engines so they write their snapshots before exiting
+        future.cancel()
+        try:
+            loop.run_until_complete(future)
+        except asyncio.CancelledError:
+            pass
+        return True
+    return False
+
+
+def worker(index, symbols, book_address, authkey, log_queue, status_queue):
+    """
+    entry point of a worker process started by core.supervisor.Supervisor
+    """
+    core.supervisor.forward_logs(log_queue)
+    core.ledger.Coin.use(core.supervisor.connect_book(book_address, authkey))
+
+    config = util.get_config(CONFIG_PATH)
+
+    def on_status(engines):
+        status_queue.put(dict(worker=index, pid=os.getpid(), engines=engines))
+
+    # the supervisor keeps the balance snapshot
+    if run_until_interrupted(run_engines(config, symbols, get_ledger_manager(config, snapshot=False), on_status)):
+        # exit 0 tells the supervisor every engine reached its stop_at
+        sys.exit(INTERRUPTED)
+
+
+def supervise(workers):
+    config = util.get_config(CONFIG_PATH)
+
+    # create tables and indexes once, before the workers start
+    setup_db(**config['database'])
+    create_coins(config)
+
+    supervisor = core.supervisor.Supervisor(
+        worker, trading_symbols(config), workers, ledger_manager=get_ledger_manager(config)
+    )
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run the trading engines')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='spread the trading symbols across this many processes, 0 runs them all in this one')
+    parser.add_argument('--bus', action='store_true',
+                        help='run the ticker in this process and pass trades to the engines as they arrive')
+    args = parser.parse_args()
+
+    if args.workers and args.bus:
+        parser.error('--bus runs the ticker next to the engines, it does not work with --workers')
+
+    if args.workers:
+        supervise(args.workers)
+    else:
+        run_until_interrupted(main(bus=args.bus))
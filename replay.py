@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import argparse
+import logging
+import logging.config
+from datetime import datetime
+
+import numpy as np
+
+import core.util as util
+from core.feed import decode_trade
+from core.feedlog import read_feed
+from backtest import BacktestLedger, load_strategy
+
+logger = logging.getLogger(__name__)
+
+
+def channel_market(channel):
+    """
+    :param channel: TRADE-EXCHANGE--COIN--BASE channel name
+    :return: (COIN/BASE symbol, exchange id)
+    """
+    exchange, coin, base = channel[len('TRADE-'):].split('--')
+    return '{}/{}'.format(coin, base), exchange
+
+
+def replay(engines, path, speed=0):
+    """
+    feed the messages recorded in path to the engines, skipping trades delivered more than once
+    as the live engines do
+
+    :param engines: dict of (symbol, exchange id) -> engine
+    :param speed: multiple of the recorded pace to replay at, 0 for as fast as possible
+    :return: dict of (symbol, exchange id) -> [messages, trades ticked]
+    """
+    counts = dict((market, [0, 0]) for market in engines)
+    first = None
+    started = time.perf_counter()
+
+    for received_at, channel, data in read_feed(path):
+        engine = engines.get(channel_market(channel))
+        if engine is None:
+            continue
+
+        if speed:
+            if first is None:
+                first = received_at
+            wait = (received_at - first) / speed - (time.perf_counter() - started)
+            if wait > 0:
+                time.sleep(wait)
+
+        trade = decode_trade(data, datetime.utcfromtimestamp(received_at))
+        count = counts[(engine.symbol, engine.exchange_id)]
+        count[0] += 1
+        if engine.tick_trade(trade):
+            count[1] += 1
+        engine.forget_seen(trade['created_at'])
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run strategies over a feed recorded by the ticker')
+    parser.add_argument('path', help='record_path directory the ticker wrote the feed to')
+    parser.add_argument('symbols', nargs='*', help='COIN/BASE symbols configured in trade.conf, '
+                                                   'defaults to those with trade = 1')
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'trade.conf'))
+    parser.add_argument('--strategy', default='strategy.StrategyA', help='module.Class of the engine to test')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='1 replays at the recorded pace, 10 ten times faster, 0 as fast as possible')
+    parser.add_argument('--verbose', action='store_true', help='keep strategy logging enabled')
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.config.fileConfig('logging.conf')
+    else:
+        logging.disable(logging.CRITICAL)
+
+    config = util.get_config(args.config)
+
+    # no snapshots or candle cache, every run starts from scratch
+    config['snapshot']['path'] = ''
+
+    symbols = args.symbols or [s for s, options in config['symbols'].items() if options['trade'] == '1']
+    strategy = load_strategy(args.strategy)
+    engines = dict()
+    for symbol in symbols:
+        options = config['symbols'][symbol]
+        options['candle_cache'] = '0'
+        engines[(symbol, options['exchange'])] = strategy(
+            None, BacktestLedger(symbol, options['exchange']), symbol, options['exchange'], config
+        )
+
+    start = time.perf_counter()
+    counts = replay(engines, args.path, speed=args.speed)
+    elapsed = time.perf_counter() - start
+
+    total = 0
+    for (symbol, exchange_id), engine in sorted(engines.items()):
+        messages, trades = counts[(symbol, exchange_id)]
+        ledger = engine.ledger
+        total += messages
+
+        print('{} {} {}'.format(args.strategy, symbol, exchange_id))
+        print('messages:        {}'.format(messages))
+        print('trades:          {}'.format(trades))
+        print('candles:         {}'.format(engine.candle.candles.count))
+        print('longs executed:  {} {}'.format(len(ledger.longs), 'avg {:.8f}'.format(np.mean(ledger.longs))
+                                              if ledger.longs else ''))
+        print('shorts executed: {} {}'.format(len(ledger.shorts), 'avg {:.8f}'.format(np.mean(ledger.shorts))
+                                              if ledger.shorts else ''))
+        print('profit position: {}'.format(engine.schedule.profit_position))
+    print('elapsed:         {:.3f}s'.format(elapsed))
+    print('throughput:      {:.0f} messages/s'.format(total / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,31 +7,37 @@ from core import engine
 logger = logging.getLogger(__name__)
 
 
-def rsi_check(candles):
-    inputs = indicator.gen_inputs(candles, 'close')
-    return indicator.rsi(inputs, 'close')
-
-
 class StrategyA(engine.BaseEngine):
     """
-    self.cm - access candle manager
-    self.cm.candels - list of candles kept in memory
+    self.candle - access candle manager
+    self.candle.candles - the latest candles kept in memory (core.candle.CandleStore)
+    self.rollup.managers[period].candles - the same for each of the candle_periods timeframes
     """
 
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
         self.logger_strategy_extra = dict(symbol=self.symbol, exchange_id=self.exchange_id, candle_time=None)
+        self.rsi = indicator.RSI(timeperiod=14)
+
+    def get_state(self):
+        state = super(self.__class__, self).get_state()
+        state['rsi'] = self.rsi
+        return state
+
+    def set_state(self, state):
+        super(self.__class__, self).set_state(state)
+        self.rsi = state['rsi']
 
     def candle_open(self, candle):
         self.logger_strategy_extra.update(dict(candle_time=self.candle.curr_candle_time))
 
-        ts = datetime.fromtimestamp(candle.time)
+        ts = datetime.utcfromtimestamp(candle.time)
         logger.debug('candle_open {:%m-%d-%Y %H:%M:%S}'.format(ts), extra=self.logger_strategy_extra)
 
     def candle_close(self, candle):
         self.logger_strategy_extra.update(dict(candle_time=self.candle.curr_candle_time))
 
-        ts = datetime.fromtimestamp(candle.time)
+        ts = datetime.utcfromtimestamp(candle.time)
         logger.debug('candle_close {:%m-%d-%Y %H:%M:%S}'.format(ts), extra=self.logger_strategy_extra)
         self.trend.tick(self.candle.candles, self.candle.curr_candle_time)
         self.schedule.tick(self.trend.curr_price, self.candle.curr_candle_time)
@@ -53,7 +59,12 @@ class StrategyA(engine.BaseEngine):
             extra=self.logger_strategy_extra
         )
 
-        rsi_result = rsi_check(self.candle.candles)
+        self.rsi.update(candle.close)
+        rsi_result = self.rsi.signal()
+
+        if self.trend.curr_trend_price is None:
+            # no trend to schedule around yet, with trends = auto until the first levels are found
+            return
 
         if rsi_result == 1:
             self.schedule.allocate(self.trend.curr_trend_price, self.trend.curr_price)
@@ -63,6 +74,19 @@ class StrategyA(engine.BaseEngine):
     def candle_update(self, candle):
         self.logger_strategy_extra.update(dict(candle_time=self.candle.curr_candle_time))
 
+    def timeframe_candle_open(self, period, candle):
+        ts = datetime.utcfromtimestamp(candle.time)
+        logger.debug('{}s candle_open {:%m-%d-%Y %H:%M:%S}'.format(period, ts), extra=self.logger_strategy_extra)
+
+    def timeframe_candle_close(self, period, candle):
+        ts = datetime.utcfromtimestamp(candle.time)
+        logger.debug('{}s candle_close {:%m-%d-%Y %H:%M:%S} High: {}, Low: {}, Open: {}, Close: {}'.format(
+            period, ts, candle.high, candle.low, candle.open, candle.close
+        ), extra=self.logger_strategy_extra)
+
+    def timeframe_candle_update(self, period, candle):
+        pass
+
     def trend_up(self):
         logger.debug('trend_up: {} > {} - TP: {}'.format(
             self.trend.curr_price,
@@ -0,0 +1,101 @@
+import os
+import asyncio
+import itertools
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import core.feed
+from core.database import Trades, setup_db
+from tests.helpers import EXCHANGE
+
+# the server is taken from the libpq environment, PGHOST, PGPORT, PGUSER and PGPASSWORD,
+# the database is created if it does not exist
+DATABASE = dict(
+    # left to libpq, which also reads PGHOST when it is a socket directory
+    host='',
+    port=os.environ.get('PGPORT', '5432'),
+    username=os.environ.get('PGUSER', 'postgres'),
+    password=os.environ.get('PGPASSWORD', ''),
+    db_name=os.environ.get('ESTBOT_TEST_DB', 'estbot_test'),
+    pool_size=30
+)
+
+
+def create_database():
+    engine = create_engine('postgresql://{username}:{password}@{host}:{port}/postgres'.format(**DATABASE),
+                           isolation_level='AUTOCOMMIT')
+    with engine.connect() as connection:
+        exists = connection.execute(text('SELECT 1 FROM pg_database WHERE datname = :name'),
+                                    dict(name=DATABASE['db_name'])).scalar()
+        if not exists:
+            connection.execute(text('CREATE DATABASE "{}"'.format(DATABASE['db_name'])))
+    engine.dispose()
+
+
+@pytest.fixture(scope='session')
+def database():
+    try:
+        create_database()
+    except OperationalError as e:
+        pytest.skip('no test database: {}'.format(e))
+    return setup_db(**DATABASE)
+
+
+@pytest.fixture
+def db_session(database):
+    """
+    session on the test database, without trades of EXCHANGE before and after the test
+    """
+    database.query(Trades).filter(Trades.exchange == EXCHANGE).delete()
+    database.commit()
+    yield database
+    database.rollback()
+    database.query(Trades).filter(Trades.exchange == EXCHANGE).delete()
+    database.commit()
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def engine_config():
+    """
+    :return: function of markets and symbol options returning an engine config
+    """
+    def make(markets, **options):
+        symbol_options = dict(
+            exchange=EXCHANGE, trends=[float(p) for p in range(8000, 0, -200)], position_size='0.001',
+            position_mult='1', trade_frequency='10', paper='True', candle_period_seconds='300'
+        )
+        symbol_options.update((key, str(value)) for key, value in options.items())
+        return dict(
+            symbols=dict((market, dict(symbol_options)) for market in markets),
+            snapshot=dict(path='', interval_seconds='300')
+        )
+    return make
+
+
+@pytest.fixture
+def received():
+    """
+    :return: function of a market and a trade time, default now, returning a trade as the ticker decodes it
+    """
+    trade_ids = itertools.count()
+
+    def make(market, time=None, price=4000.0, quantity=1.0):
+        return core.feed.decode_trade(dict(
+            exchange=EXCHANGE, label=market, tradeid='test-{}'.format(next(trade_ids)), type='BUY',
+            price=price, quantity=quantity, total=price * quantity,
+            time='{:%Y-%m-%dT%H:%M:%S}'.format(time or datetime.utcnow())
+        ), datetime.utcnow())
+    return make
+
@@ -0,0 +1,14 @@
+import asyncio
+
+# tests only add trades of this exchange, and remove them again
+EXCHANGE = 'TEST'
+
+
+async def wait_until(condition, timeout=10, message='timed out'):
+    """
+    wait for condition() to be true, checking every 10ms
+    """
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_event_loop().time() < deadline, message
+        await asyncio.sleep(0.01)
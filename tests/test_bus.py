@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import core.bus
+import strategy
+from backtest import BacktestLedger
+from core.database import Trades
+from tests.helpers import EXCHANGE, wait_until
+
+MARKET = 'BUS/USDT'
+
+
+def store(db_session, trades):
+    db_session.execute(Trades.__table__.insert(), trades)
+    db_session.commit()
+
+
+def test_catch_up_without_first_bus_trade_stored(loop, db_session, engine_config, received):
+    """
+    after the bus drops trades, the engine reads from the database until it reaches the new subscription,
+    and then goes back to the bus even when the first trade queued on it is never stored
+    """
+    config = engine_config([MARKET], candle_period_seconds=5, bus_sync_seconds=0.5)
+    bus = core.bus.TradeBus(max_pending=10)
+    engine = strategy.StrategyA(db_session, BacktestLedger(MARKET, EXCHANGE), MARKET, EXCHANGE, config, bus=bus)
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(hours=1)
+
+    async def run():
+        task = asyncio.ensure_future(engine.run(0.05, None, None))
+        await wait_until(lambda: not engine.backfill)
+
+        # more than the subscription holds, published before the engine takes any
+        overflow = [received(MARKET, start + timedelta(seconds=n)) for n in range(20)]
+        for trade in overflow:
+            bus.publish(trade)
+        store(db_session, overflow)
+        await wait_until(lambda: engine.catching_up, message='subscription not replaced')
+
+        # the first trade on the new subscription is dropped by the writer
+        bus.publish(received(MARKET, start + timedelta(seconds=20)))
+        stored = [received(MARKET, start + timedelta(seconds=n)) for n in range(21, 30)]
+        for trade in stored:
+            bus.publish(trade)
+        store(db_session, stored)
+        await wait_until(lambda: not engine.catching_up, message='never caught up with the trade bus')
+        await asyncio.wait_for(bus.sync(), 5)
+
+        # only ever published, taken from the bus
+        bus.publish(received(MARKET, start + timedelta(seconds=40)))
+        await asyncio.wait_for(bus.sync(), 5)
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    loop.run_until_complete(run())
+
+    times = engine.candle.candles.column('time')
+    assert np.all(np.diff(times) > 0), 'candle opened back in time'
+    assert engine.late == 1
+    assert engine.candle.candles.column('buy_vol').sum() == len(range(20)) + len(range(21, 30)) + 1
+    assert engine.ticked_until == (start + timedelta(seconds=40) - datetime(1970, 1, 1)).total_seconds()
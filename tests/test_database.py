@@ -0,0 +1,19 @@
+from sqlalchemy import inspect
+
+from core.database import Trades, REPLACED_INDEXES, create_indexes
+
+
+def test_create_indexes_replaces_old_indexes(database):
+    """
+    indexes created by earlier versions are dropped, and those in the model added, on an existing table
+    """
+    engine = database.bind
+    next(i for i in Trades.__table__.indexes if i.name == 'ix_trades_symbol_exchange_id').drop(engine)
+    for name in REPLACED_INDEXES['trades']:
+        engine.execute('CREATE INDEX IF NOT EXISTS {} ON trades (symbol, exchange)'.format(name))
+
+    create_indexes(engine)
+
+    existing = set(i['name'] for i in inspect(engine).get_indexes('trades'))
+    assert existing.isdisjoint(REPLACED_INDEXES['trades'])
+    assert set(index.name for index in Trades.__table__.indexes) <= existing
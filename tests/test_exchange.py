@@ -0,0 +1,207 @@
+import time
+import asyncio
+
+import aiohttp
+import numpy as np
+import pytest
+from aiohttp import web
+
+import core.exchange
+from core.exchange import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+RATE_LIMIT_SECONDS = 0.1
+
+
+class MockCoinigy(object):
+    """
+    Local stand-in for the coinigy ticker endpoint, recording when each request arrived.
+    Markets in fail are answered with HTTP 500. A request for the whole exchange gets the tickers
+    of batch, and an entry without a market, or HTTP 400 if batch is None.
+    """
+
+    def __init__(self, fail=(), batch=None):
+        self.fail = set(fail)
+        self.batch = batch
+        self.runner = None
+
+        # (monotonic time, request values)
+        self.requests = list()
+
+        # monotonic time each request was sent at, recorded by run_limiter. arrival times would count
+        # the connection setup of the first request against the next
+        self.sent = list()
+
+    @property
+    def markets(self):
+        """requested markets in the order they arrived, * for the whole exchange"""
+        return [values.get('exchange_market', '*') for _, values in self.requests]
+
+    async def ticker(self, request):
+        values = await request.json()
+        self.requests.append((time.monotonic(), values))
+
+        market = values.get('exchange_market')
+        if market is None:
+            if self.batch is None:
+                return web.Response(status=400)
+            return web.json_response(dict(data=[dict(market=m, last_trade='4000.0') for m in self.batch] + [
+                dict(last_trade='4000.0')
+            ]))
+        if market in self.fail:
+            return web.Response(status=500)
+        return web.json_response(dict(data=[dict(market=market, last_trade='4000.0')]))
+
+    async def start(self):
+        """
+        :return: base url of the api, served until stop()
+        """
+        app = web.Application()
+        app.router.add_post('/api/v1/ticker', self.ticker)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', 0).start()
+        host, port = self.runner.addresses[0][:2]
+        return 'http://{}:{}/api/v1/'.format(host, port)
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def rate_limited(times, rate_limit_seconds, burst=1):
+    """
+    whether requests sent at times kept to the token bucket
+    """
+    return all(at - times[0] >= (i - burst + 1) * rate_limit_seconds * 0.9 for i, at in enumerate(times))
+
+
+def run_limiter(loop, mock, func, burst=1):
+    """
+    run func(limiter) against the mock api
+
+    :return: (limiter, result of func)
+    """
+    async def run():
+        url = await mock.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                limiter = core.exchange.ExchangeLimiter(
+                    'MOCK', 'key', 'secret', RATE_LIMIT_SECONDS, session, burst=burst, url=url
+                )
+                post = limiter.exchange.post
+
+                async def timed_post(path, values):
+                    mock.sent.append(time.monotonic())
+                    return await post(path, values)
+                limiter.exchange.post = timed_post
+                try:
+                    return limiter, await func(limiter)
+                finally:
+                    await limiter.close()
+        finally:
+            await mock.stop()
+
+    return loop.run_until_complete(run())
+
+
+def call_all(calls):
+    """
+    :param calls: list of (symbol, priority) ticker requests, made at once
+    """
+    async def func(limiter):
+        return await asyncio.gather(*[
+            limiter('fetch_ticker', symbol, priority=priority) for symbol, priority in calls
+        ], return_exceptions=True)
+    return func
+
+
+def test_requests_sent_in_priority_order(loop):
+    mock = MockCoinigy()
+    run_limiter(loop, mock, call_all([
+        ('A/BTC', PRIORITY_LOW),
+        ('B/BTC', PRIORITY_NORMAL),
+        ('C/BTC', PRIORITY_HIGH),
+        ('D/BTC', PRIORITY_LOW),
+        ('E/BTC', PRIORITY_HIGH),
+        # moves the queued low priority request up
+        ('D/BTC', PRIORITY_HIGH),
+    ]))
+
+    assert mock.markets == ['C/BTC', 'E/BTC', 'D/BTC', 'B/BTC', 'A/BTC']
+
+
+def test_identical_requests_coalesced(loop):
+    mock = MockCoinigy()
+    calls = [('A/BTC', PRIORITY_NORMAL)] * 3 + [('B/BTC', PRIORITY_NORMAL)] * 2
+    limiter, results = run_limiter(loop, mock, call_all(calls))
+
+    assert mock.markets == ['A/BTC', 'B/BTC']
+    assert (limiter.sent, limiter.coalesced) == (2, 3)
+    assert [ticker['market'] for ticker in results] == [symbol for symbol, _ in calls]
+
+
+def test_token_bucket_spacing(loop):
+    burst = 2
+    mock = MockCoinigy()
+    run_limiter(loop, mock, call_all([('{}/BTC'.format(c), PRIORITY_NORMAL) for c in 'ABCDEF']), burst=burst)
+
+    gaps = np.diff(mock.sent)
+    assert all(gap < RATE_LIMIT_SECONDS / 2 for gap in gaps[:burst - 1]), 'burst not sent back to back'
+    assert rate_limited(mock.sent, RATE_LIMIT_SECONDS, burst), 'requests closer than the rate limit'
+
+
+def test_errors_raised_to_every_caller(loop):
+    mock = MockCoinigy(fail=('FAIL/BTC',))
+    _, results = run_limiter(loop, mock, call_all([
+        ('FAIL/BTC', PRIORITY_NORMAL), ('A/BTC', PRIORITY_NORMAL), ('FAIL/BTC', PRIORITY_LOW)
+    ]))
+
+    assert mock.markets == ['FAIL/BTC', 'A/BTC']
+    for result in (results[0], results[2]):
+        assert isinstance(result, aiohttp.ClientResponseError) and result.status == 500
+    assert results[1]['market'] == 'A/BTC'
+
+
+def get_tickers(symbols, rounds=1):
+    """
+    ask the ticker cache for symbols at once, with the cache emptied before each round
+    """
+    async def func(limiter):
+        tickers = list()
+        for _ in range(rounds):
+            limiter.tickers.tickers.clear()
+            tickers.append(await asyncio.gather(*[limiter.tickers.get(symbol) for symbol in symbols]))
+        return tickers
+    return func
+
+
+SYMBOLS = ['A/BTC', 'B/BTC', 'C/BTC', 'D/BTC']
+
+
+def test_ticker_cache_batches_stale_markets(loop):
+    mock = MockCoinigy(batch=SYMBOLS)
+    limiter, (tickers,) = run_limiter(loop, mock, get_tickers(SYMBOLS))
+
+    assert mock.markets == ['*']
+    assert [ticker['market'] for ticker in tickers] == SYMBOLS
+    assert limiter.tickers.misses == len(SYMBOLS)
+
+
+def test_ticker_cache_fetches_markets_left_out_of_the_batch(loop):
+    mock = MockCoinigy(batch=('A/BTC', 'B/BTC'))
+    _, (tickers,) = run_limiter(loop, mock, get_tickers(SYMBOLS))
+
+    assert mock.markets == ['*', 'C/BTC', 'D/BTC']
+    assert [ticker['market'] for ticker in tickers] == SYMBOLS
+    assert rate_limited(mock.sent, RATE_LIMIT_SECONDS), 'requests closer than the rate limit'
+
+
+@pytest.mark.parametrize('rounds', [1, 2])
+def test_ticker_cache_falls_back_when_batch_refused(loop, rounds):
+    mock = MockCoinigy(batch=None)
+    limiter, tickers = run_limiter(loop, mock, get_tickers(SYMBOLS, rounds))
+
+    # refused once, not asked again
+    assert mock.markets == ['*'] + SYMBOLS * rounds
+    assert not limiter.exchange.batch_tickers
+    assert all([ticker['market'] for ticker in round_tickers] == SYMBOLS for round_tickers in tickers)
+    assert rate_limited(mock.sent, RATE_LIMIT_SECONDS), 'requests closer than the rate limit'
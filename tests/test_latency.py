@@ -0,0 +1,159 @@
+import time
+import asyncio
+import concurrent.futures
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import core.bus
+import core.notify
+import strategy
+from backtest import BacktestLedger
+from core.database import Trades, TradeWriter, new_session
+from tests.helpers import EXCHANGE, wait_until
+
+SYMBOLS = 20
+
+
+def markets(prefix):
+    return ['{}{:02d}/USDT'.format(prefix, i) for i in range(SYMBOLS)]
+
+
+def engines(db_session, config, **kwargs):
+    return [
+        strategy.StrategyA(db_session, BacktestLedger(market, EXCHANGE), market, EXCHANGE, config, **kwargs)
+        for market in config['symbols']
+    ]
+
+
+async def stop(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_polling_engines_not_held_up_by_backfill(loop, db_session, engine_config, received):
+    """
+    engines sharing the event loop keep picking up new trades while one of them backfills
+    """
+    config = engine_config(markets('P'), backfill_chunk_size=500)
+    backfilling, monitoring = list(config['symbols'])[0], list(config['symbols'])[1:]
+
+    start = datetime.utcnow() - timedelta(days=30)
+    db_session.execute(Trades.__table__.insert(), [
+        dict(received(backfilling, start + timedelta(seconds=i)), trade_id=None) for i in range(50000)
+    ])
+    db_session.commit()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    all_engines = engines(db_session, config, executor=executor)
+    latencies, lags = list(), list()
+
+    async def heartbeat():
+        while True:
+            sent = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - sent - 0.01)
+
+    async def run():
+        tasks = [asyncio.ensure_future(e.run(0.05, None, None)) for e in all_engines]
+        await wait_until(lambda: not any(e.backfill for e in all_engines[1:]))
+        tasks.append(asyncio.ensure_future(heartbeat()))
+
+        while all_engines[0].backfill:
+            trades = [received(market) for market in monitoring]
+            db_session.execute(Trades.__table__.insert(), trades)
+            db_session.commit()
+            stored = time.perf_counter()
+
+            pending = dict((e.symbol, e.watermark) for e in all_engines[1:])
+            while pending:
+                for e in all_engines[1:]:
+                    if e.symbol in pending and e.watermark > pending[e.symbol]:
+                        latencies.append(time.perf_counter() - stored)
+                        del pending[e.symbol]
+                assert time.perf_counter() - stored < 5, 'trades not picked up'
+                await asyncio.sleep(0.001)
+
+        await stop(tasks)
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        executor.shutdown()
+
+    assert len(latencies) >= 3 * len(monitoring), 'backfill finished before enough rounds'
+    assert np.percentile(latencies, 99) < 1
+    assert max(lags) < 0.25
+
+
+def test_bus_engines_take_trades_without_the_database(loop, db_session, engine_config, received):
+    """
+    trades published on the bus are ticked by every engine within milliseconds, before they are stored
+    """
+    config = engine_config(markets('B'), bus_sync_seconds=60)
+    bus = core.bus.TradeBus()
+    all_engines = engines(db_session, config, bus=bus)
+    latencies = list()
+
+    async def run():
+        tasks = [asyncio.ensure_future(e.run(60, None, None)) for e in all_engines]
+        await wait_until(lambda: not any(e.backfill for e in all_engines))
+
+        for _ in range(10):
+            ticked = dict((e.symbol, e.candle.candles.column('buy_vol').sum()) for e in all_engines)
+            sent = time.perf_counter()
+            for market in config['symbols']:
+                bus.publish(received(market))
+            await asyncio.wait_for(bus.sync(), 1)
+            latencies.append(time.perf_counter() - sent)
+            assert all(e.candle.candles.column('buy_vol').sum() == ticked[e.symbol] + 1 for e in all_engines)
+
+        await stop(tasks)
+
+    loop.run_until_complete(run())
+
+    assert db_session.query(Trades).filter(Trades.exchange == EXCHANGE).count() == 0
+    assert np.percentile(latencies, 50) < 0.05
+
+
+def test_listening_engines_woken_by_notifications(loop, db_session, engine_config, received):
+    """
+    engines waiting on notifications pick up stored trades long before their next poll
+    """
+    config = engine_config(markets('N'), notify_poll_seconds=60)
+    listener = core.notify.TradeListener(db_session)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    all_engines = engines(db_session, config, executor=executor, listener=listener)
+    writer = TradeWriter(new_session(db_session), notify=True)
+    latencies = list()
+
+    async def run():
+        tasks = [asyncio.ensure_future(listener.run())]
+        tasks.extend(asyncio.ensure_future(e.run(60, None, None)) for e in all_engines)
+        await wait_until(lambda: listener.listening and not any(e.backfill for e in all_engines))
+
+        # the first wait on the notification starts once the monitor loop has read what is stored
+        await asyncio.sleep(0.5)
+
+        with writer:
+            for _ in range(10):
+                watermarks = dict((e.symbol, e.watermark) for e in all_engines)
+                for market in config['symbols']:
+                    writer.add(received(market))
+                writer.flush()
+                stored = time.perf_counter()
+
+                await wait_until(lambda: all(e.watermark > watermarks[e.symbol] for e in all_engines),
+                                 timeout=5, message='engines not woken')
+                latencies.append(time.perf_counter() - stored)
+
+        await stop(tasks)
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        executor.shutdown()
+
+    assert listener.notifications >= 10 * SYMBOLS
+    assert np.percentile(latencies, 50) < 0.5
@@ -0,0 +1,66 @@
+import json
+import asyncio
+
+import aiohttp
+from aiohttp import web
+
+from core.feed import decode_trade
+from core.socketcluster import SocketClusterClient
+from tests.helpers import wait_until
+
+CHANNEL = 'TRADE-TEST--BTC--USDT'
+
+TRADE = dict(exchange='TEST', label='BTC/USDT', tradeid='1', type='BUY', price='4000.0', quantity='1.0',
+             total='4000.0', time='2017-10-01T00:00:00')
+
+
+async def publisher(request):
+    """
+    acknowledges the handshake, and answers a subscription with malformed messages before a good one
+    """
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    async for msg in ws:
+        message = json.loads(msg.data)
+        await ws.send_str(json.dumps(dict(rid=message['cid'], data=dict())))
+        if message['event'] == '#subscribe':
+            await ws.send_str('not json')
+            await ws.send_str(json.dumps(dict(event='#publish', data=dict(data=TRADE))))
+            await ws.send_str(json.dumps(dict(event='#publish', data=dict(
+                channel=CHANNEL, data=dict(TRADE, time=None)
+            ))))
+            await ws.send_str(json.dumps(dict(event='#publish', data=dict(channel=CHANNEL, data=TRADE))))
+    return ws
+
+
+def test_bad_messages_do_not_close_the_connection(loop):
+    trades = list()
+
+    def received(channel, data):
+        trades.append(decode_trade(data, None))
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/socketcluster/', publisher)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        host, port = runner.addresses[0][:2]
+
+        async with aiohttp.ClientSession() as session:
+            client = SocketClusterClient('http://{}:{}/socketcluster/'.format(host, port), session)
+            await client.subscribe(CHANNEL, received)
+            task = asyncio.ensure_future(client.run())
+            try:
+                await wait_until(lambda: trades, timeout=5, message='good message not handled')
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        await runner.cleanup()
+        return client
+
+    client = loop.run_until_complete(run())
+
+    assert [trade['trade_id'] for trade in trades] == ['1']
+    assert client.errors == 3
+    assert client.connects == 1
@@ -1,106 +1,63 @@
 import os
-import json
+import asyncio
+import argparse
 import logging
-from datetime import datetime
-from socketclusterclient import Socketcluster
 
 import core.util as util
+from core.database import TradeWriter, setup_db
+from core.ticker import Ticker, api_credentials, monitored_tasks, shard_tasks, feed_recorder
 
-from core.database import Trades, setup_db
-
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class Ticker(object):
-
-    def __init__(self, tasks, db_session, api_credentials):
-        self.tasks = tasks
-        self.db_session = db_session
-        self.api_credentials = api_credentials
-
-    def subscribe(self, socket):
-        for task in self.tasks:
-            coin, base = task['symbol'].split('/')
-            symbol = "{}--{}".format(coin, base)
-            exchange = task['exchange']
-
-            trade_channel = 'TRADE-{exchange}--{symbol}'.format(exchange=exchange, symbol=symbol)
-
-            socket.subscribe(trade_channel)
-            socket.onchannel(trade_channel, self.update_db)  # This is used for watching messages over channel
-
-    def update_db(self, _, data):
-        symbol = data['label']
-        exchange = data['exchange']
-        logger.debug("RESULT {symbol}-{exchange} : {result}".format(
-            symbol=symbol,
-            exchange=exchange,
-            result=data['price']
-        ))
-
-        trade = Trades()
-        trade.symbol = symbol
-        trade.exchange = exchange
-        trade.price = data['price']
-        trade.type = data['type']
-        trade.quantity = data['quantity']
-        trade.total = data['total']
-        trade.time = datetime.strptime(data['time'], "%Y-%m-%dT%H:%M:%S")
-        trade.created_at = datetime.utcnow()
-
-        self.db_session.add(trade)
-        self.db_session.commit()
-
-    @staticmethod
-    def on_set_authentication(socket, token):
-        logger.info("Token received " + token)
-        socket.setAuthtoken(token)
-
-    def on_authentication(self, socket, isauthenticated):
-        logger.info("Authenticated is " + str(isauthenticated))
-
-        def ack(_, __, data):
-            logger.debug("token is " + json.dumps(data, sort_keys=True))
-            self.subscribe(socket)
-
-        socket.emitack("auth", self.api_credentials, ack)
-
-    def on_connect(self, socket):
-        pass
-
-    def on_disconnect(self, socket):
-        pass
-
-    def on_connect_error(self, socket, error):
-        pass
-
-
 def main():
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    config = util.get_config(os.path.join(dir_path, 'trade.conf'))
-    db_session = setup_db(**config['database'])
-
-    api_credentials = {
-        'apiKey': config['coinigy']['api_key'],
-        'apiSecret': config['coinigy']['api_secret'],
-    }
+    parser = argparse.ArgumentParser(description='store the trades of the monitored symbols')
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'trade.conf'))
+    parser.add_argument('--shard', type=int, default=0, help='index of this ticker process')
+    parser.add_argument('--shards', type=int, default=1, help='number of ticker processes sharing the symbols')
+    args = parser.parse_args()
 
-    tasks = list()
-    for symbol, options in config['symbols'].items():
-        if options['monitor'] == '1':
-            tasks.append(dict(
-                exchange=options['exchange'],
-                symbol=symbol
-            ))
-
-    tick = Ticker(tasks, db_session, api_credentials)
+    config = util.get_config(args.config)
+    db_session = setup_db(**config['database'])
 
-    socket = Socketcluster.socket("wss://sc-02.coinigy.com/socketcluster/")
-    socket.setBasicListener(tick.on_connect, tick.on_disconnect, tick.on_connect_error)
-    socket.setAuthenticationListener(tick.on_set_authentication, tick.on_authentication)
-    socket.setreconnection(True)
-    socket.connect()
+    tasks = shard_tasks(monitored_tasks(config), args.shard, args.shards)
+    logger.info('shard {}/{}: {}'.format(args.shard, args.shards, ', '.join(
+        '{exchange}:{symbol}'.format(**t) for t in tasks
+    )), extra=dict(symbol=None, exchange_id=None))
+
+    writer = TradeWriter(
+        db_session,
+        flush_rows=int(config['ticker']['flush_rows']),
+        flush_ms=int(config['ticker']['flush_ms']),
+        max_rows=int(config['ticker']['max_rows']),
+        notify=config['ticker']['notify'] == '1'
+    )
+
+    recorder = feed_recorder(config, prefix='feed{}'.format(args.shard))
+
+    with writer:
+        tick = Ticker(
+            tasks, writer, api_credentials(config), config['ticker']['url'],
+            connections=int(config['ticker']['connections']),
+            stats_seconds=float(config['ticker']['stats_seconds']),
+            recorder=recorder
+        )
+
+        future = asyncio.ensure_future(tick.run())
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(future)
+        except KeyboardInterrupt:
+            logger.info("shutting down, flushing buffered trades")
+            future.cancel()
+            try:
+                loop.run_until_complete(future)
+            except asyncio.CancelledError:
+                pass
+        finally:
+            if recorder:
+                recorder.close()
 
 
 if __name__ == '__main__':
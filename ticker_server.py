@@ -0,0 +1,156 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import itertools
+from datetime import datetime
+
+from aiohttp import web, WSMsgType
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class StandInServer(object):
+    """
+    Local stand-in for the coinigy socketcluster, for testing ticker.py without an api key.
+    Answers handshakes, auth and subscriptions, and publishes random trades on every
+    subscribed TRADE channel at a fixed total rate.
+    """
+
+    def __init__(self, rate, ping_seconds=20, seed=0):
+        """
+        :param rate: trade messages per second over all channels
+        :param ping_seconds: seconds between #1 pings
+        """
+        self.rate = rate
+        self.ping_seconds = ping_seconds
+        self.random = random.Random(seed)
+
+        # channel -> set of websockets
+        self.subscribers = dict()
+        self.prices = dict()
+        self.trade_id = itertools.count(1)
+        self.sent = 0
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        logger.info('client connected from {}'.format(request.remote))
+
+        pinger = asyncio.ensure_future(self.ping(ws))
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT or msg.data == '#2':
+                    continue
+                await self.receive(ws, json.loads(msg.data))
+        finally:
+            pinger.cancel()
+            for sockets in self.subscribers.values():
+                sockets.discard(ws)
+            logger.info('client disconnected from {}'.format(request.remote))
+        return ws
+
+    async def receive(self, ws, message):
+        event, data, cid = message.get('event'), message.get('data'), message.get('cid')
+        reply = None
+
+        if event == '#handshake':
+            reply = dict(id='stand-in', isAuthenticated=False, pingTimeout=self.ping_seconds * 1000)
+        elif event == 'auth':
+            await ws.send_str(json.dumps(dict(event='#setAuthToken', data=dict(token='stand-in-token'))))
+            reply = 'stand-in-token'
+        elif event == '#subscribe':
+            self.subscribers.setdefault(data['channel'], set()).add(ws)
+        elif event == '#unsubscribe':
+            self.subscribers.get(data, set()).discard(ws)
+
+        if cid is not None:
+            await ws.send_str(json.dumps(dict(rid=cid, error=None, data=reply)))
+
+    async def ping(self, ws):
+        while True:
+            await asyncio.sleep(self.ping_seconds)
+            await ws.send_str('#1')
+
+    def trade(self, channel):
+        exchange, coin, base = channel[len('TRADE-'):].split('--')
+        price = self.prices.get(channel, 4000.0) + self.random.gauss(0, 2)
+        self.prices[channel] = price
+        quantity = self.random.random()
+        return dict(
+            exchange=exchange,
+            label='{}/{}'.format(coin, base),
+            tradeid=str(next(self.trade_id)),
+            type=self.random.choice(('BUY', 'SELL')),
+            price=round(price, 2),
+            quantity=quantity,
+            total=price * quantity,
+            time='{:%Y-%m-%dT%H:%M:%S}'.format(datetime.utcnow())
+        )
+
+    async def publish(self, tick_seconds=0.01):
+        """
+        send the trades due since the last tick, taking turns over the subscribed channels
+        """
+        turn = itertools.count()
+        due = 0.0
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(tick_seconds)
+            now = time.monotonic()
+            due += (now - last) * self.rate
+            last = now
+
+            active = sorted(c for c, sockets in self.subscribers.items() if sockets)
+            if not active:
+                due = 0.0
+                continue
+
+            while due >= 1:
+                due -= 1
+                channel = active[next(turn) % len(active)]
+                message = json.dumps(dict(event='#publish', data=dict(channel=channel, data=self.trade(channel))))
+                for ws in list(self.subscribers[channel]):
+                    await ws.send_str(message)
+                self.sent += 1
+
+    async def report(self, interval=10):
+        sent = 0
+        while True:
+            await asyncio.sleep(interval)
+            logger.info('{:.0f} msg/s to {} channels'.format(
+                (self.sent - sent) / interval, sum(1 for s in self.subscribers.values() if s)
+            ))
+            sent = self.sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='local stand-in for the coinigy websocket api')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rate', type=float, default=1000, help='trade messages per second over all channels')
+    args = parser.parse_args()
+
+    server = StandInServer(args.rate)
+
+    async def start_background(app):
+        app['tasks'] = [asyncio.ensure_future(server.publish()), asyncio.ensure_future(server.report())]
+
+    async def stop_background(app):
+        for task in app['tasks']:
+            task.cancel()
+
+    app = web.Application()
+    app.router.add_get('/socketcluster/', server.handle)
+    app.on_startup.append(start_background)
+    app.on_cleanup.append(stop_background)
+
+    logger.info('serving ws://{}:{}/socketcluster/ at {} msg/s'.format(args.host, args.port, args.rate))
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()